@@ -31,6 +31,12 @@ class Devices(BaseModelDB):
   def on_update(self):
     # Обновление устройства обрабатывается отдельно
     print("Device updated:", self.id, self.name)
+    from utils.port_registry import port_registry
+    port_registry.reload_device(self.id)
 
   def on_delete(self):
     print("Device deleted:", self.id, self.name)
+    from utils.port_registry import port_registry
+    from utils.port_history import port_history
+    port_registry.remove_device(self.id)
+    port_history.forget_device(self.id)
@@ -28,7 +28,20 @@ class Ports(BaseModelDB):
   groups_name = Column(String(100))
   values_variant = Column(List)
   params = Column(MutableDict.as_mutable(Json))
+  last_value = Column(String(255))
 
   @declared_attr
   def device_id(cls):
     return Column(Integer, ForeignKey('devices.id'), nullable=False)
+
+  def on_create(self):
+    from utils.port_registry import port_registry
+    port_registry.reload_device(self.device_id)
+
+  def on_update(self):
+    from utils.port_registry import port_registry
+    port_registry.reload_device(self.device_id)
+
+  def on_delete(self):
+    from utils.port_registry import port_registry
+    port_registry.reload_device(self.device_id)
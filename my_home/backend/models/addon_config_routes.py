@@ -1259,8 +1259,7 @@ def add_addon_config_routes(app: APIRouter):
             
             # Отправляем WebSocket уведомление об обновлении статуса
             try:
-                from utils.socket_utils import connection_manager
-                import asyncio
+                from utils.event_dispatcher import event_dispatcher
                 
                 ws_data = {
                     "type": "addon_config",
@@ -1271,19 +1270,7 @@ def add_addon_config_routes(app: APIRouter):
                     }
                 }
                 
-                # Запускаем broadcast в event loop
-                try:
-                    loop = asyncio.get_running_loop()
-                    if loop and loop.is_running():
-                        asyncio.create_task(connection_manager.broadcast(ws_data))
-                    else:
-                        loop.run_until_complete(connection_manager.broadcast(ws_data))
-                except RuntimeError:
-                    # Если нет активного loop, запускаем в новом потоке
-                    import threading
-                    def broadcast_update():
-                        asyncio.run(connection_manager.broadcast(ws_data))
-                    threading.Thread(target=broadcast_update, daemon=True).start()
+                event_dispatcher.publish(ws_data)
                 
                 logger.info("WebSocket notification sent: Google auth status updated")
             except Exception as e:
@@ -33,7 +33,7 @@ class BaseModelDB(Base):
 
   @declared_attr
   def updated_at(cls):
-    return Column(DateTime, default=datetime.now)
+    return Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
   readonly_columns = ['id']
 
@@ -166,7 +166,7 @@ class BaseModelDB(Base):
           raise HTTPException(status_code=400, detail=f"Error creating {cls.__tablename__}: {e}")
         db.refresh(db_item)
         log_print(f"Created {cls.__tablename__} id {db_item.id}")
-        if hasattr(db, 'on_create'):
+        if hasattr(db_item, 'on_create'):
           db_item.on_create()
         return db_item.to_dict()
 
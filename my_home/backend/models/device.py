@@ -1,12 +1,18 @@
 # services/myhome_device_client.py
 import asyncio
 import json
+import time
 import aiohttp
-from typing import Callable, Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
-from utils.values import flatten_ports
+from utils.values import flatten_ports, decode_value
+from models.port_state import PortMeta, PortState, PortsSnapshot, EMPTY_SNAPSHOT
+from utils.device_http import device_http
+from utils.reconnect_policy import reconnect_policy
+from utils.port_history import port_history
 from utils.db_utils import db_session
+from utils.configs import config
 from db_models.devices import Devices as DbDevices
 from db_models.ports import Ports as DbPorts
 from utils.logs import log_print
@@ -42,10 +48,13 @@ class MyHomeDeviceClient:
       on_value: Callable[[int, Dict[str, Any]], None],
       on_connect: Optional[Callable[[int], None]] = None,
       on_disconnect: Optional[Callable[[int], None]] = None,
+      on_values: Optional[Callable[[int, List[Dict[str, Any]]], None]] = None,
+      on_ports_changed: Optional[Callable[[int, Dict[str, List[Dict[str, Any]]]], None]] = None,
       http_timeout: float = 5.0,
       ping_interval: float = 20.0,
-      reconnect_delay: float = 5.0,
+      reconnect_delay: Optional[float] = None,  # базовая задержка, по умолчанию из device_reconnect
       ws_port: int = 81,  # << новый параметр
+      command_rate: Optional[float] = None,  # команд в секунду на устройство, по умолчанию из device_commands
   ):
     # публичные поля
     self.device_id = device_id
@@ -62,20 +71,49 @@ class MyHomeDeviceClient:
     # колбэки/настройки
     self.on_initial_ports = on_initial_ports
     self.on_value = on_value
+    self.on_values = on_values  # пачка событий из одного кадра WS
+    self.on_ports_changed = on_ports_changed  # изменения состава/метаданных портов при повторной загрузке
     self.on_connect = on_connect
     self.on_disconnect = on_disconnect
     self.http_timeout = http_timeout
     self.ping_interval = ping_interval
     self.reconnect_delay = reconnect_delay
     self.ws_port = ws_port
+    if command_rate is None:
+      command_rate = float((config['device_commands'] or {}).get('max_rate', 20))
+    self.command_interval = 1 / command_rate if command_rate > 0 else 0.0
 
     # runtime
+    self._loop: Optional[asyncio.AbstractEventLoop] = None  # loop, в котором работает клиент
     self._task: Optional[asyncio.Task] = None
     self._stop = asyncio.Event()
-    self._ports: List[Dict[str, Any]] = []
-    self._ports_index: Dict[str, Dict[str, Any]] = {}
-    self._ports_lock = asyncio.Lock()
+    # Порты изменяются только в loop клиента; читатели используют self._snapshot
+    self._ports_index: Dict[str, PortState] = {}
+    self._ports_version = 0
+    self._snapshot: PortsSnapshot = EMPTY_SNAPSHOT
     self._ports_initialized = False  # Флаг для отслеживания инициализации портов
+    self._offline_reported = False  # on_disconnect уже вызван для текущей серии отключений
+    self._failures = 0  # неудачных попыток подряд (для экспоненциальной задержки)
+    self.reconnect_attempts = 0
+    self.last_backoff: Optional[float] = None
+    self.last_error: Optional[str] = None
+    # Ожидающие эха команд: code → [{value, future, written_at}] (только в loop клиента).
+    # Эхо принимается только после фактической записи команды (written_at)
+    # и только с тем значением, которое было отправлено
+    self._echo_waiters: Dict[str, List[Dict[str, Any]]] = {}
+    # Исходящие команды: code → (последнее значение, futures ожидающих отправки).
+    # Новое значение для порта в очереди заменяет старое (побеждает последнее),
+    # отправка — не чаще command_interval; всё только в loop клиента
+    self._outbox: Dict[str, Tuple[Any, List[asyncio.Future]]] = {}
+    self._outbox_ready = asyncio.Event()
+    self._sender_task: Optional[asyncio.Task] = None
+    self._last_command_at = 0.0
+    self._command_counters = {
+      "queued": 0,
+      "sent": 0,
+      "coalesced": 0,  # команд, замененных более новым значением до отправки
+      "failed": 0,
+    }
 
   # ---------- фабрика ----------
   @classmethod
@@ -99,6 +137,8 @@ class MyHomeDeviceClient:
       on_value: Callable[[int, Dict[str, Any]], None],
       on_connect: Optional[Callable[[int], None]] = None,
       on_disconnect: Optional[Callable[[int], None]] = None,
+      on_values: Optional[Callable[[int, List[Dict[str, Any]]], None]] = None,
+      on_ports_changed: Optional[Callable[[int, Dict[str, List[Dict[str, Any]]]], None]] = None,
   ) -> "MyHomeDeviceClient":
     if isinstance(device, dict):
       # если передали словарь, то создаём объект DbDevices
@@ -119,6 +159,8 @@ class MyHomeDeviceClient:
         on_value=on_value,
         on_connect=on_connect,
         on_disconnect=on_disconnect,
+        on_values=on_values,
+        on_ports_changed=on_ports_changed,
       )
     return cls(
       device_id=device.id,
@@ -133,6 +175,8 @@ class MyHomeDeviceClient:
       on_value=on_value,
       on_connect=on_connect,
       on_disconnect=on_disconnect,
+      on_values=on_values,
+      on_ports_changed=on_ports_changed,
     )
 
   @property
@@ -153,19 +197,54 @@ class MyHomeDeviceClient:
 
   # ---------- старт/стоп ----------
   def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
-    loop = loop or asyncio.get_running_loop()
+    loop = loop or self._loop or asyncio.get_running_loop()
+    try:
+      current_loop = asyncio.get_running_loop()
+    except RuntimeError:
+      current_loop = None
+    if loop is not current_loop and loop.is_running():
+      # Вызов из другого потока (например, из FastAPI) — запускаем в loop клиента
+      loop.call_soon_threadsafe(self.start, loop)
+      return
+    self._loop = loop
     if not self._task or self._task.done():
       self._stop.clear()
       self._task = loop.create_task(self._run_loop())
 
   async def stop(self):
+    await self._in_client_loop(self._stop_task())
+
+  async def _stop_task(self):
     self._stop.set()
+    if self._sender_task:
+      self._sender_task.cancel()
+      self._sender_task = None
+    self._fail_outbox()
     if self._task:
       await asyncio.wait([self._task], timeout=2)
+      if not self._task.done():
+        # Задача висит в ожидании WS-сообщения — прерываем
+        self._task.cancel()
     self._ports_initialized = False  # Сбрасываем флаг при остановке
 
+  @property
+  def running(self) -> bool:
+    return bool(self._task and not self._task.done())
+
+  async def _in_client_loop(self, coro):
+    """
+    Выполняет корутину в event loop клиента.
+    WS-соединение и asyncio-примитивы клиента привязаны к его loop,
+    поэтому вызовы из других loop (FastAPI, HA) передаются туда потокобезопасно.
+    """
+    loop = self._loop
+    if loop is None or not loop.is_running() or loop is asyncio.get_running_loop():
+      return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
   # ---------- HTTP bootstrap ----------
-  async def _fetch_values(self, session: aiohttp.ClientSession) -> List[Dict[str, Any]]:
+  async def _fetch_values(self, session: aiohttp.ClientSession) -> Dict[str, List[Dict[str, Any]]]:
+    """Загружает /values и сливает порты в кэш, возвращает набор изменений"""
     if not self.ip:
       raise RuntimeError(f"Device {self.device_id}: IP is not set in params")
     url = f"http://{self.ip}/values"
@@ -176,14 +255,96 @@ class MyHomeDeviceClient:
       payload = json.loads(txt)
     ports = flatten_ports(payload)
 
+    changes = self._merge_ports(ports)
+    self._publish()
+    return changes
+
+  def _merge_ports(self, ports: List[Dict[str, Any]]) -> Dict[str, List[PortState]]:
+    """
+    Сливает свежий список портов в кэш и возвращает изменения:
+    added / removed / value_changed / metadata_changed.
+    Метаданные без изменений остаются тем же объектом PortMeta.
+    """
     now = datetime.now().isoformat()
-    for p in ports:
-      p["last_update"] = now
+    changes = {"added": [], "removed": [], "value_changed": [], "metadata_changed": []}
+    seen = set()
+
+    for rec in ports:
+      code = rec.get("code")
+      if not code:
+        continue
+      seen.add(code)
+      # Значение приводится так же, как у событий WS (строка → decode_value по kind),
+      # иначе число из /values и его строковый вид из WS всегда различаются
+      raw = (rec.get("raw") or {}).get("val", rec.get("val"))
+      val_raw = str(raw) if raw is not None else None
+      val = decode_value(rec.get("kind"), val_raw)
+      port = self._ports_index.get(code)
+      if port is None:
+        port = PortState(PortMeta.from_flat(rec), val, val_raw, now)
+        self._ports_index[code] = port
+        changes["added"].append(port)
+        continue
+
+      meta = port.meta
+      new_meta = PortMeta.from_flat(rec)
+      metadata_changed = meta.virtual or not meta.same_as(new_meta)
+      if metadata_changed:
+        meta = new_meta
+      value_changed = port.val != val
+      if metadata_changed or value_changed:
+        port = PortState(meta, val, val_raw, now if value_changed else port.last_update)
+        self._ports_index[code] = port
+        if metadata_changed:
+          changes["metadata_changed"].append(port)
+        if value_changed:
+          changes["value_changed"].append(port)
+
+    # Удаляем порты, пропавшие из /values (виртуальные порты из WS не трогаем)
+    for code, port in list(self._ports_index.items()):
+      if code not in seen and not port.meta.virtual:
+        del self._ports_index[code]
+        changes["removed"].append(port)
+
+    return changes
+
+  def _publish(self):
+    """Публикует новый неизменяемый снимок портов (читается без блокировок)"""
+    self._ports_version += 1
+    self._snapshot = PortsSnapshot(self._ports_version, tuple(self._ports_index.values()))
+
+  @property
+  def snapshot(self) -> PortsSnapshot:
+    """Текущий снимок портов; безопасно читать из любого потока"""
+    return self._snapshot
+
+  def _emit_changes(self, changes: Dict[str, List[PortState]]):
+    """
+    Отправляет наверх только изменения после повторной загрузки /values:
+    новые значения — как события WS, состав/метаданные портов — через on_ports_changed.
+    """
+    if changes["value_changed"]:
+      events = [
+        {
+          "code": port.code,
+          "val": port.val,
+          "val_raw": port.val_raw,
+          "direction": port.direction,
+          "kind": port.kind,
+          "raw": None,
+        }
+        for port in changes["value_changed"]
+      ]
+      if self.on_values:
+        self.on_values(self.device_id, events)
+      else:
+        for event in events:
+          self.on_value(self.device_id, event)
 
-    async with self._ports_lock:
-      self._ports = ports
-      self._ports_index = {p["code"]: p for p in ports if p.get("code")}
-    return ports
+    if self.on_ports_changed and (changes["added"] or changes["removed"] or changes["metadata_changed"]):
+      self.on_ports_changed(self.device_id, {
+        key: [port.to_dict() for port in ports] for key, ports in changes.items() if key != "value_changed"
+      })
 
   # ---------- WS (порт 81) ----------
   async def _open_ws(self, session: aiohttp.ClientSession) -> aiohttp.ClientWebSocketResponse:
@@ -207,7 +368,7 @@ class MyHomeDeviceClient:
     value = value.strip()
     if not code:
       return None
-    # Ничего не предполагаем про тип значения — отдаём строкой как есть
+    # Тип значения определяется позже по kind порта (см. _apply_events)
     return {
       "code": code,  # например "clock.time" или "in.temp"
       "val": value,  # "23:44:06"
@@ -216,103 +377,296 @@ class MyHomeDeviceClient:
       "raw": line,
     }
 
+  @classmethod
+  def _parse_ws_frame(cls, data: str) -> List[Dict[str, Any]]:
+    """
+    Кадр WS может содержать несколько строк 'code#value' (прошивка отправляет
+    обновления пачкой). Если не все строки в таком формате — это одно значение
+    с переводами строк (например, текстовый порт).
+    """
+    lines = [line for line in data.splitlines() if line.strip()]
+    if len(lines) > 1 and all("#" in line for line in lines):
+      return [event for event in map(cls._parse_ws_line, lines) if event]
+    event = cls._parse_ws_line(data.strip())
+    return [event] if event else []
+
+  def _apply_events(self, events: List[Dict[str, Any]]):
+    """
+    Обновляет кэш портов пачкой событий и один раз приводит значения к типу
+    по kind порта из /values (val — типизированное, val_raw — строка с устройства).
+    Публикуется один снимок на пачку.
+    """
+    now = datetime.now().isoformat()
+    for event in events:
+      code = event["code"]
+      port = self._ports_index.get(code)
+      if port is not None:
+        event["kind"] = port.kind
+        event["direction"] = port.direction
+      event["val_raw"] = event["val"]
+      event["val"] = decode_value(event["kind"], event["val"])
+
+      if port is not None:
+        self._ports_index[code] = port.with_value(event["val"], event["val_raw"], now)
+      else:
+        # создаём виртуальный порт для событий, которых нет в /values
+        meta = PortMeta(code, virtual=True, direction=event.get("direction"), kind=event.get("kind"))
+        self._ports_index[code] = PortState(meta, event["val"], event["val_raw"], now)
+
+      # Эхо порта от устройства подтверждает отправленные команды с тем же значением
+      for waiter in self._echo_waiters.get(code, ()):
+        if waiter["written_at"] is not None and waiter["value"] == event["val"] and not waiter["future"].done():
+          waiter["future"].set_result(event["val_raw"])
+    self._publish()
+
   async def _run_loop(self):
     while not self._stop.is_set():
+      connected_at = None
       try:
-        async with aiohttp.ClientSession() as session:
-          # 1) bootstrap
-          ports = await self._fetch_values(session)
-          # Вызываем on_initial_ports только если порты еще не были инициализированы
+        # Сессия общего пула соединений (см. utils.device_http)
+        session = device_http.session()
+        self.reconnect_attempts += 1
+        # 1) bootstrap + открытие WS — в ограниченном слоте, чтобы после сбоя сети
+        # устройства не переподключались все одновременно
+        async with reconnect_policy.bootstrap():
+          changes = await self._fetch_values(session)
+          # on_initial_ports — только при первой загрузке, при переподключении — только изменения
           if not self._ports_initialized:
-            self.on_initial_ports(self.device_id, ports)
+            self.on_initial_ports(self.device_id, self._snapshot.to_dicts())
             self._ports_initialized = True
+          else:
+            self._emit_changes(changes)
 
           # 2) WS
           ws = await self._open_ws(session)
+
+        connected_at = time.monotonic()
+        try:
           self._current_ws = ws  # Сохраняем ссылку на WebSocket для отправки команд
           self._online = True
+          self._offline_reported = False
+          self.last_error = None
           if self.on_connect:
             self.on_connect(self.device_id)
 
           async for msg in ws:
             if msg.type == aiohttp.WSMsgType.TEXT:
-              event = self._parse_ws_line(msg.data)
-              if not event:
+              events = self._parse_ws_frame(msg.data)
+              if not events:
                 continue
 
-              code = event["code"]
-              now = datetime.now().isoformat()
-
-              async with self._ports_lock:
-                p = self._ports_index.get(code)
-                if p is not None:
-                  p["val"] = event["val"]
-                  p["last_update"] = now
-                else:
-                  # создаём виртуальный порт для событий, которых нет в /values
-                  self._ports_index[code] = {
-                    "code": code,
-                    "val": event["val"],
-                    "last_update": now,
-                    "direction": event.get("direction"),
-                    "kind": event.get("kind"),
-                    "raw": event["raw"],
-                  }
-                  self._ports.append(self._ports_index[code])
-
-              # проброс наверх
-              self.on_value(self.device_id, event)
+              self._apply_events(events)
+
+              # проброс наверх: пачкой, если задан on_values, иначе по одному
+              if self.on_values:
+                self.on_values(self.device_id, events)
+              else:
+                for event in events:
+                  self.on_value(self.device_id, event)
+        finally:
+          await ws.close()
 
       except Exception as e:
-        self._online = False
-        self._current_ws = None  # Очищаем ссылку на WebSocket
-        if self.on_disconnect:
-          self.on_disconnect(self.device_id)
-        logger.error(f"Device {self.device_id} WebSocket error, reconnecting: {str(e)}")
-        await asyncio.sleep(self.reconnect_delay)
+        self.last_error = str(e)
+        logger.error(f"Device {self.device_id} WebSocket error: {str(e)}")
       else:
-        self._online = False
-        self._current_ws = None  # Очищаем ссылку на WebSocket
-        if self.on_disconnect:
-          self.on_disconnect(self.device_id)
-        logger.warning(f"Device {self.device_id} WebSocket connection closed, reconnecting...")
-        await asyncio.sleep(self.reconnect_delay)
+        logger.warning(f"Device {self.device_id} WebSocket connection closed")
+
+      self._mark_offline()
+      if self._stop.is_set():
+        break
+
+      # Счетчик попыток сбрасывается только после стабильного соединения
+      if connected_at is not None and time.monotonic() - connected_at >= reconnect_policy.stable_sec:
+        self._failures = 0
+      self._failures += 1
+      delay = reconnect_policy.delay(self._failures, self.reconnect_delay)
+      self.last_backoff = round(delay, 2)
+      logger.info(f"Device {self.device_id} reconnecting in {delay:.1f}s (attempt {self._failures})")
+      await self._wait_stop(delay)
+
+  def _mark_offline(self):
+    self._online = False
+    self._current_ws = None  # Очищаем ссылку на WebSocket
+    self._fail_outbox()
+    # on_disconnect — только один раз на серию неудачных попыток
+    if not self._offline_reported:
+      self._offline_reported = True
+      if self.on_disconnect:
+        self.on_disconnect(self.device_id)
+
+  async def _wait_stop(self, timeout: float):
+    """Пауза, прерываемая остановкой клиента"""
+    try:
+      await asyncio.wait_for(self._stop.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+      pass
+
+  @property
+  def reconnect_stats(self) -> Dict[str, Any]:
+    return {
+      "attempts": self.reconnect_attempts,
+      "consecutive_failures": self._failures,
+      "last_backoff": self.last_backoff,
+      "last_error": self.last_error,
+    }
+
+  @property
+  def command_stats(self) -> Dict[str, Any]:
+    return {
+      **self._command_counters,
+      "pending": len(self._outbox),
+      "max_rate": round(1 / self.command_interval, 2) if self.command_interval else None,
+    }
 
   # ---------- публичные методы данных ----------
   async def get_ports_cached(self) -> List[Dict[str, Any]]:
-    async with self._ports_lock:
-      return list(self._ports)
+    # Снимок неизменяемый — читаем без блокировки и без перехода в loop клиента
+    return self._snapshot.to_dicts()
 
   async def refresh_ports_http(self) -> List[Dict[str, Any]]:
-    async with aiohttp.ClientSession() as session:
-      ports = await self._fetch_values(session)
-    # Обновляем кэш портов без вызова on_initial_ports
-    async with self._ports_lock:
-      self._ports = ports
-      self._ports_index = {p["code"]: p for p in ports}
-    return ports
+    return await self._in_client_loop(self._refresh_ports_http())
+
+  async def _refresh_ports_http(self) -> List[Dict[str, Any]]:
+    changes = await self._fetch_values(device_http.session())
+    # Наверх уходят только изменения (on_initial_ports не вызывается)
+    if self._ports_initialized:
+      self._emit_changes(changes)
+    return self._snapshot.to_dicts()
 
   async def send_command(self, code: str, value) -> bool:
     """
     Отправляет команду на устройство в формате ESP: "code#value"
     """
+    return await self._in_client_loop(self._send_command(code, value))
+
+  async def send_command_ack(self, code: str, value, timeout: float = 3.0) -> Dict[str, Any]:
+    """
+    Отправляет команду и ждет эхо порта от устройства (не дольше timeout).
+    Возвращает success, echoed, время отправки и полного цикла до эха (мс).
+    """
+    return await self._in_client_loop(self._send_command_ack(code, value, timeout))
+
+  async def _send_command_ack(self, code: str, value, timeout: float) -> Dict[str, Any]:
+    started = time.perf_counter()
+    waiter = {
+      "value": self._decode_command_value(code, value),
+      "future": asyncio.get_running_loop().create_future(),
+      "written_at": None,  # отмечается в _write_command сразу после отправки
+    }
+    self._echo_waiters.setdefault(code, []).append(waiter)
+    result: Dict[str, Any] = {"success": False, "echoed": False, "sent_ms": None, "latency_ms": None}
     try:
-      if not self._online:
-        return False
+      if not await self._send_command(code, value):
+        result["error"] = "device offline" if not self._online else "send failed"
+        return result
+      result["success"] = True
+      result["sent_ms"] = round((time.perf_counter() - started) * 1000, 2)
+      if waiter["written_at"] is None:
+        # В очереди значение заменено более новым — это значение на устройство не ушло
+        result["error"] = "superseded"
+        return result
+      try:
+        result["echo"] = await asyncio.wait_for(asyncio.shield(waiter["future"]), timeout=timeout)
+        result["echoed"] = True
+        # От записи в сокет до эха с тем же значением
+        result["latency_ms"] = round((time.perf_counter() - waiter["written_at"]) * 1000, 2)
+      except asyncio.TimeoutError:
+        result["error"] = "echo timeout"
+      return result
+    finally:
+      waiters = self._echo_waiters.get(code)
+      if waiters and waiter in waiters:
+        waiters.remove(waiter)
+        if not waiters:
+          del self._echo_waiters[code]
+
+  async def _send_command(self, code: str, value) -> bool:
+    """
+    Ставит команду в очередь устройства. Если для порта уже ждет команда,
+    ее значение заменяется новым; результат — итог фактической отправки.
+    """
+    if not self._online or not self._current_ws:
+      return False
+    if not self.command_interval:
+      return await self._write_command(code, value)
+
+    future = asyncio.get_running_loop().create_future()
+    pending = self._outbox.get(code)
+    if pending is not None:
+      self._command_counters["coalesced"] += 1
+      pending[1].append(future)
+      self._outbox[code] = (value, pending[1])  # позиция порта в очереди сохраняется
+    else:
+      self._outbox[code] = (value, [future])
+    self._command_counters["queued"] += 1
+
+    if self._sender_task is None or self._sender_task.done():
+      self._sender_task = asyncio.get_running_loop().create_task(self._command_sender())
+    self._outbox_ready.set()
+    return await future
 
-      if not hasattr(self, '_current_ws') or not self._current_ws:
+  async def _command_sender(self):
+    """Отправляет очередь команд с ограничением частоты"""
+    while not self._stop.is_set():
+      if not self._outbox:
+        self._outbox_ready.clear()
+        await self._outbox_ready.wait()
+        continue
+      wait = self._last_command_at + self.command_interval - time.monotonic()
+      if wait > 0:
+        # Пока ждем слота, новые значения заменяют ожидающие
+        await asyncio.sleep(wait)
+        continue
+      code = next(iter(self._outbox))
+      value, futures = self._outbox.pop(code)
+      self._last_command_at = time.monotonic()
+      sent = await self._write_command(code, value)
+      for future in futures:
+        if not future.done():
+          future.set_result(sent)
+
+  def _fail_outbox(self):
+    """Соединение потеряно — ожидающие команды не отправлены"""
+    outbox, self._outbox = self._outbox, {}
+    for _, futures in outbox.values():
+      # Считается каждая ожидавшая команда, включая схлопнутые
+      for future in futures:
+        if not future.done():
+          self._command_counters["failed"] += 1
+          future.set_result(False)
+
+  def _decode_command_value(self, code: str, value) -> Any:
+    """Значение команды в том виде, в каком придет эхо порта (decode_value по kind)"""
+    port = self._ports_index.get(code)
+    return decode_value(port.kind if port else None, str(value))
+
+  async def _write_command(self, code: str, value) -> bool:
+    try:
+      ws = self._current_ws
+      if not self._online or not ws:
+        self._command_counters["failed"] += 1
         return False
 
       # Формируем команду в формате ESP
       command = f"{code}#{value}"
-      print('>>>>', command)
+      logger.debug(f"Device {self.device_id} >>> {command}")
 
       # Отправляем команду
-      await self._current_ws.send_str(command)
+      await ws.send_str(command)
+      self._command_counters["sent"] += 1
+
+      # С этого момента эхо с отправленным значением подтверждает команду
+      written_at = time.perf_counter()
+      decoded = self._decode_command_value(code, value)
+      for waiter in self._echo_waiters.get(code, ()):
+        if waiter["written_at"] is None and waiter["value"] == decoded:
+          waiter["written_at"] = written_at
 
       return True
 
     except Exception as e:
+      self._command_counters["failed"] += 1
       logger.error(f"Device {self.device_id} error sending command: {e}")
       return False
 
@@ -411,6 +765,24 @@ def add_myhome_device_routes(
 
     return {"device": client.meta, "ports": ports}
 
+  @app.get("/api/myhome/device/{device_id}/ports/{code}/history", tags=['devices'])
+  async def myhome_get_port_history(
+      device_id: int,
+      code: str,
+      since: Optional[float] = None,
+      max_points: Optional[int] = None,
+  ):
+    """
+    История значений порта из памяти (since — unix timestamp,
+    max_points — прореживание до указанного числа точек)
+    """
+    client = resolver(device_id)
+    if not client:
+      return JSONResponse({"error": "device not found"}, 404)
+    if max_points is not None and max_points <= 0:
+      return JSONResponse({"error": "max_points must be positive"}, 422)
+    return port_history.get(device_id, code, since=since, max_points=max_points)
+
   @app.post("/api/myhome/device/{device_id}/params", tags=['devices'])
   async def myhome_update_params(device_id: int, patch: Dict[str, Any]):
     client = resolver(device_id)
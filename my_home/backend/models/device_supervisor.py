@@ -0,0 +1,244 @@
+"""
+Супервизор клиентов устройств MyHome.
+
+Все MyHomeDeviceClient работают в одном выделенном event loop (или в N loop-ах,
+между которыми устройства распределяются по device_id), вместо отдельного
+потока с asyncio.run на каждое устройство. Колбэки клиентов передаются
+в основной loop приложения (uvicorn) через call_soon_threadsafe.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from models.device import MyHomeDeviceClient
+from utils.configs import config
+from utils.device_http import device_http
+from utils.logger import device_logger as logger
+
+
+class _SupervisorLoop:
+  """Event loop в отдельном потоке"""
+
+  def __init__(self, index: int):
+    self.index = index
+    self.loop = asyncio.new_event_loop()
+    self.thread = threading.Thread(target=self._run, name=f"DeviceSupervisor-{index}", daemon=True)
+    self.thread.start()
+
+  def _run(self):
+    asyncio.set_event_loop(self.loop)
+    self.loop.run_forever()
+
+  def stop(self):
+    if self.loop.is_running():
+      self.loop.call_soon_threadsafe(self.loop.stop)
+    self.thread.join(timeout=5)
+
+
+class DeviceSupervisor:
+  """Владелец event loop-ов, в которых живут задачи клиентов устройств"""
+
+  def __init__(self, loops_count: int = 1):
+    self.loops_count = max(1, int(loops_count))
+    self._loops: List[_SupervisorLoop] = []
+    self._clients: Dict[int, MyHomeDeviceClient] = {}
+    self._info: Dict[int, Dict[str, Any]] = {}
+    self._main_loop: Optional[asyncio.AbstractEventLoop] = None
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_config(cls) -> "DeviceSupervisor":
+    params = config['device_supervisor'] or {}
+    return cls(loops_count=params.get('loops', 1))
+
+  # === loops ===
+  def _ensure_loops(self):
+    with self._lock:
+      while len(self._loops) < self.loops_count:
+        self._loops.append(_SupervisorLoop(len(self._loops)))
+
+  def _shard(self, device_id: int) -> int:
+    return device_id % self.loops_count
+
+  def get_loop(self, device_id: int) -> asyncio.AbstractEventLoop:
+    self._ensure_loops()
+    return self._loops[self._shard(device_id)].loop
+
+  def submit(self, device_id: int, coro) -> Future:
+    """Выполняет корутину в loop устройства (из любого потока)"""
+    return asyncio.run_coroutine_threadsafe(coro, self.get_loop(device_id))
+
+  # === передача колбэков в основной loop ===
+  def set_main_loop(self, loop: asyncio.AbstractEventLoop):
+    """Запоминает loop приложения (uvicorn), в котором выполняются колбэки клиентов"""
+    self._main_loop = loop
+    logger.info("DeviceSupervisor: main loop set, device callbacks are dispatched to it")
+
+  def wrap_callback(self, callback: Optional[Callable]) -> Optional[Callable]:
+    """Оборачивает колбэк клиента: вызов переносится в основной loop приложения"""
+    if callback is None:
+      return None
+
+    def dispatch(*args):
+      loop = self._main_loop
+      if loop is not None and loop.is_running():
+        loop.call_soon_threadsafe(self._safe_call, callback, args)
+      else:
+        self._safe_call(callback, args)
+
+    return dispatch
+
+  @staticmethod
+  def _safe_call(callback: Callable, args: tuple):
+    try:
+      callback(*args)
+    except Exception as e:
+      logger.error(f"DeviceSupervisor callback {getattr(callback, '__name__', callback)} error: {e}")
+
+  # === управление клиентами ===
+  def add(self, client: MyHomeDeviceClient):
+    """Регистрирует клиента и запускает его (старый клиент с тем же id останавливается)"""
+    device_id = client.device_id
+    old_client = self._clients.get(device_id)
+    if old_client is not None and old_client is not client:
+      self.submit(device_id, old_client.stop())
+
+    self._clients[device_id] = client
+    info = self._info.setdefault(device_id, {'restarts': 0})
+    info['shard'] = self._shard(device_id)
+    self.start(device_id)
+
+  def get_client(self, device_id: int) -> Optional[MyHomeDeviceClient]:
+    return self._clients.get(device_id)
+
+  def start(self, device_id: int) -> bool:
+    client = self._clients.get(device_id)
+    if client is None:
+      return False
+    loop = self.get_loop(device_id)
+    loop.call_soon_threadsafe(client.start, loop)
+    self._info[device_id]['started_at'] = datetime.now()
+    return True
+
+  def stop(self, device_id: int) -> Optional[Future]:
+    client = self._clients.get(device_id)
+    if client is None:
+      return None
+    self._info[device_id]['stopped_at'] = datetime.now()
+    return self.submit(device_id, client.stop())
+
+  def restart(self, device_id: int) -> Optional[Future]:
+    client = self._clients.get(device_id)
+    if client is None:
+      return None
+
+    async def _restart():
+      await client.stop()
+      client.start(asyncio.get_running_loop())
+
+    self._info[device_id]['restarts'] += 1
+    self._info[device_id]['started_at'] = datetime.now()
+    return self.submit(device_id, _restart())
+
+  def remove(self, device_id: int) -> Optional[Future]:
+    future = self.stop(device_id)
+    self._clients.pop(device_id, None)
+    self._info.pop(device_id, None)
+    return future
+
+  def shutdown(self, timeout: float = 5.0):
+    """Останавливает всех клиентов и loop-ы"""
+    futures = [self.stop(device_id) for device_id in list(self._clients)]
+    for future in futures:
+      if future is None:
+        continue
+      try:
+        future.result(timeout=timeout)
+      except Exception:
+        pass
+    with self._lock:
+      for supervisor_loop in self._loops:
+        # Закрываем сессию пула соединений, принадлежащую этому loop
+        if supervisor_loop.loop.is_running():
+          try:
+            asyncio.run_coroutine_threadsafe(device_http.close(), supervisor_loop.loop).result(timeout=timeout)
+          except Exception:
+            pass
+        supervisor_loop.stop()
+      self._loops = []
+    logger.info("DeviceSupervisor stopped")
+
+  # === статус ===
+  def get_device_status(self, device_id: int) -> Optional[Dict[str, Any]]:
+    client = self._clients.get(device_id)
+    if client is None:
+      return None
+    info = self._info.get(device_id, {})
+    return {
+      'device_id': device_id,
+      'name': client.name,
+      'ip': client.ip,
+      'shard': info.get('shard'),
+      'running': client.running,
+      'online': client._online,
+      'restarts': info.get('restarts', 0),
+      'reconnect': client.reconnect_stats,
+      'commands': client.command_stats,
+      'started_at': info.get('started_at'),
+      'stopped_at': info.get('stopped_at'),
+    }
+
+  def get_status(self) -> Dict[str, Any]:
+    devices = [self.get_device_status(device_id) for device_id in list(self._clients)]
+    return {
+      'loops': [
+        {
+          'index': supervisor_loop.index,
+          'alive': supervisor_loop.thread.is_alive(),
+          'running': supervisor_loop.loop.is_running(),
+          'devices': sum(1 for device in devices if device['shard'] == supervisor_loop.index),
+        }
+        for supervisor_loop in self._loops
+      ],
+      'main_loop_set': self._main_loop is not None,
+      'devices_count': len(devices),
+      'running_count': sum(1 for device in devices if device['running']),
+      'online_count': sum(1 for device in devices if device['online']),
+      'commands_coalesced': sum(device['commands']['coalesced'] for device in devices),
+      'devices': devices,
+    }
+
+
+def add_device_supervisor_routes(app: APIRouter):
+  """Маршруты управления клиентами устройств"""
+
+  @app.get("/api/live/supervisor", tags=["live"])
+  async def get_supervisor_status():
+    """Статус супервизора и всех клиентов устройств"""
+    return device_supervisor.get_status()
+
+  @app.post("/api/live/supervisor/{device_id}/{action}", tags=["live"])
+  async def control_device_client(device_id: int, action: str):
+    """Управление клиентом устройства: start / stop / restart"""
+    if action not in ('start', 'stop', 'restart'):
+      return JSONResponse({"error": f"Unknown action {action}"}, 422)
+    if device_supervisor.get_device_status(device_id) is None:
+      return JSONResponse({"error": "device not found"}, 404)
+
+    if action == 'start':
+      device_supervisor.start(device_id)
+    else:
+      future = getattr(device_supervisor, action)(device_id)
+      try:
+        await asyncio.wait_for(asyncio.wrap_future(future), timeout=10)
+      except asyncio.TimeoutError:
+        return JSONResponse({"error": f"{action} timeout"}, 504)
+    return device_supervisor.get_device_status(device_id)
+
+
+device_supervisor = DeviceSupervisor.from_config()
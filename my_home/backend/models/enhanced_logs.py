@@ -431,9 +431,7 @@ class EnhancedLogsManager:
         Отправляет WebSocket уведомление об обновлении устройства
         """
         try:
-            from utils.socket_utils import connection_manager
-            import asyncio
-            import threading
+            from utils.event_dispatcher import event_dispatcher
             
             ws_data = {
                 "type": "device",
@@ -445,18 +443,7 @@ class EnhancedLogsManager:
                 }
             }
             
-            # Запускаем broadcast в event loop
-            try:
-                loop = asyncio.get_running_loop()
-                if loop and loop.is_running():
-                    asyncio.create_task(connection_manager.broadcast(ws_data))
-                else:
-                    loop.run_until_complete(connection_manager.broadcast(ws_data))
-            except RuntimeError:
-                # Если нет активного loop, запускаем в новом потоке
-                def broadcast_update():
-                    asyncio.run(connection_manager.broadcast(ws_data))
-                threading.Thread(target=broadcast_update, daemon=True).start()
+            event_dispatcher.publish(ws_data)
             
         except Exception as e:
             print(f"Error broadcasting device update: {e}")
@@ -11,9 +11,9 @@ from utils.db_utils import db_session
 from utils.configs import config
 from utils.home_assistant import ha_websocket
 from utils.ha_manager import ha_manager
+from utils.port_registry import port_registry
 import os
 import json
-import aiohttp
 from datetime import datetime
 
 
@@ -577,18 +577,13 @@ async def send_command_to_device(client, code: str, value) -> bool:
   Отправляет команду на устройство в формате ESP: "code#value"
   """
   try:
-    # Проверяем что клиент онлайн
-    if not hasattr(client, '_ws') or not client._ws:
+    # Отправляем через клиента устройства: WS принадлежит loop супервизора,
+    # send_command передает отправку туда
+    if not await client.send_command(code, value):
       print(f"[DeviceControl] Device {client.device_id} WebSocket not connected")
       return False
 
-    # Формируем команду в формате ESP
-    command = f"{code}#{value}"
-
-    # Отправляем через WebSocket клиента устройства
-    await client._ws.send_str(command)
-
-    print(f"[DeviceControl] Command sent to device {client.device_id}: {command}")
+    print(f"[DeviceControl] Command sent to device {client.device_id}: {code}#{value}")
     return True
 
   except Exception as e:
@@ -763,6 +758,7 @@ async def remove_ha_entity(device_id: int, port_code: str) -> Dict[str, Any]:
           print(f"[HA-Remove-Entity] Updated port {port_code} in database: ha_published=False")
         
         db.commit()
+        port_registry.reload_device(device_id)
         
         # Удаляем порт из AppConfig
         from utils.configs import config
@@ -851,16 +847,16 @@ async def create_entity_via_rest(entity_id: str, entity_state: Dict[str, Any]) -
     print(f"[HA-Create-Entity] State: {json.dumps(entity_state, indent=2)}")
     
     # Отправляем POST запрос для создания сущности
-    async with aiohttp.ClientSession() as session:
-      async with session.post(api_url, headers=headers, json=entity_state) as response:
-        if response.status == 200:
-          result_data = await response.json()
-          print(f"[HA-Create-Entity] Success: {result_data}")
-          return {"success": True, "data": result_data}
-        else:
-          error_text = await response.text()
-          print(f"[HA-Create-Entity] Error {response.status}: {error_text}")
-          return {"success": False, "error": f"HTTP {response.status}: {error_text}"}
+    session = ha_manager.ha_client.http_session()
+    async with session.post(api_url, headers=headers, json=entity_state) as response:
+      if response.status == 200:
+        result_data = await response.json()
+        print(f"[HA-Create-Entity] Success: {result_data}")
+        return {"success": True, "data": result_data}
+      else:
+        error_text = await response.text()
+        print(f"[HA-Create-Entity] Error {response.status}: {error_text}")
+        return {"success": False, "error": f"HTTP {response.status}: {error_text}"}
           
   except Exception as e:
     print(f"[HA-Create-Entity] Exception: {e}")
@@ -892,20 +888,20 @@ async def remove_entity_via_rest(entity_id: str) -> Dict[str, Any]:
     print(f"[HA-Remove-Entity] URL: {api_url}")
     
     # Отправляем DELETE запрос для удаления сущности
-    async with aiohttp.ClientSession() as session:
-      async with session.delete(api_url, headers=headers) as response:
-        if response.status == 200:
-          result_data = await response.json()
-          print(f"[HA-Remove-Entity] Success: {result_data}")
-          return {"success": True, "data": result_data}
-        elif response.status == 404:
-          # Сущность уже не существует
-          print(f"[HA-Remove-Entity] Entity {entity_id} not found (already removed)")
-          return {"success": True, "message": "Entity not found (already removed)"}
-        else:
-          error_text = await response.text()
-          print(f"[HA-Remove-Entity] Error {response.status}: {error_text}")
-          return {"success": False, "error": f"HTTP {response.status}: {error_text}"}
+    session = ha_manager.ha_client.http_session()
+    async with session.delete(api_url, headers=headers) as response:
+      if response.status == 200:
+        result_data = await response.json()
+        print(f"[HA-Remove-Entity] Success: {result_data}")
+        return {"success": True, "data": result_data}
+      elif response.status == 404:
+        # Сущность уже не существует
+        print(f"[HA-Remove-Entity] Entity {entity_id} not found (already removed)")
+        return {"success": True, "message": "Entity not found (already removed)"}
+      else:
+        error_text = await response.text()
+        print(f"[HA-Remove-Entity] Error {response.status}: {error_text}")
+        return {"success": False, "error": f"HTTP {response.status}: {error_text}"}
           
   except Exception as e:
     print(f"[HA-Remove-Entity] Exception: {e}")
@@ -1093,6 +1089,7 @@ async def save_port_data_to_db(device_id: int, port_code: str, parameters: Dict[
         db.commit()
         print(f"[HA-Save-Port] Created new port {port_code} in database")
       
+      port_registry.reload_device(device_id)
       return True
       
   except Exception as e:
@@ -15,6 +15,7 @@ from utils.db_utils import db_session
 from models.enhanced_logs import EnhancedLogsManager, LogsTable
 from models.my_home import MyHomeClass, ConfigVersionManager
 from utils.google_connector import GoogleConnector
+from utils.device_http import device_http
 
 
 def add_logs_backup_routes(app: APIRouter):
@@ -154,36 +155,35 @@ def add_logs_backup_routes(app: APIRouter):
                 url = f"http://{ip}/list?dir=/logs/"
                 
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                            if response.status != 200:
-                                error_text = await response.text()
-                                return {"success": False, "error": f"Device returned status {response.status}: {error_text[:200]}"}
-                            
-                            # Читаем текст ответа и парсим JSON вручную (устройство может вернуть text/json вместо application/json)
-                            response_text = await response.text()
-                            try:
-                                entries = json.loads(response_text)
-                            except json.JSONDecodeError as e:
-                                return {"success": False, "error": f"Invalid JSON response from device: {str(e)}, response: {response_text[:200]}"}
-                            
-                            # Фильтруем только файлы и преобразуем формат
-                            files = []
-                            for entry in entries:
-                                if entry.get("type") == "file":
-                                    filename = entry.get("name", "")
-                                    # Исключаем служебные файлы
-                                    if filename == "_.txt":
-                                        continue
-                                    files.append({
-                                        "name": filename,
-                                        "size": entry.get("size", "0B")
-                                    })
-                            
-                            # Сортируем по имени
-                            files.sort(key=lambda x: x['name'])
-                            
-                            return {"success": True, "files": files}
+                    async with device_http.session().get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                        if response.status != 200:
+                            error_text = await response.text()
+                            return {"success": False, "error": f"Device returned status {response.status}: {error_text[:200]}"}
+                        
+                        # Читаем текст ответа и парсим JSON вручную (устройство может вернуть text/json вместо application/json)
+                        response_text = await response.text()
+                        try:
+                            entries = json.loads(response_text)
+                        except json.JSONDecodeError as e:
+                            return {"success": False, "error": f"Invalid JSON response from device: {str(e)}, response: {response_text[:200]}"}
+                        
+                        # Фильтруем только файлы и преобразуем формат
+                        files = []
+                        for entry in entries:
+                            if entry.get("type") == "file":
+                                filename = entry.get("name", "")
+                                # Исключаем служебные файлы
+                                if filename == "_.txt":
+                                    continue
+                                files.append({
+                                    "name": filename,
+                                    "size": entry.get("size", "0B")
+                                })
+                        
+                        # Сортируем по имени
+                        files.sort(key=lambda x: x['name'])
+                        
+                        return {"success": True, "files": files}
                 
                 except asyncio.TimeoutError:
                     return {"success": False, "error": "Timeout connecting to device"}
@@ -219,24 +219,23 @@ def add_logs_backup_routes(app: APIRouter):
                 url = f"http://{ip}/logs/{filename}"
                 
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                            if response.status != 200:
-                                error_text = await response.text()
-                                raise HTTPException(
-                                    status_code=response.status,
-                                    detail=f"Device returned status {response.status}: {error_text[:200]}"
-                                )
-                            
-                            content = await response.read()
-                            
-                            return Response(
-                                content=content,
-                                media_type='text/plain',
-                                headers={
-                                    "Content-Disposition": f'attachment; filename="{filename}"'
-                                }
+                    async with device_http.session().get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                        if response.status != 200:
+                            error_text = await response.text()
+                            raise HTTPException(
+                                status_code=response.status,
+                                detail=f"Device returned status {response.status}: {error_text[:200]}"
                             )
+                        
+                        content = await response.read()
+                        
+                        return Response(
+                            content=content,
+                            media_type='text/plain',
+                            headers={
+                                "Content-Disposition": f'attachment; filename="{filename}"'
+                            }
+                        )
                 
                 except asyncio.TimeoutError:
                     raise HTTPException(status_code=500, detail="Timeout connecting to device")
@@ -271,22 +270,21 @@ def add_logs_backup_routes(app: APIRouter):
                 url = f"http://{ip}/logs/{filename}"
                 
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                            if response.status != 200:
-                                error_text = await response.text()
-                                return {"success": False, "error": f"Device returned status {response.status}: {error_text[:200]}"}
-                            
-                            # Читаем содержимое файла
-                            content = await response.text()
-                            
-                            # Ограничиваем размер для больших файлов (1MB)
-                            max_size = 1024 * 1024
-                            if len(content) > max_size:
-                                # Берем последнюю часть файла
-                                content = "...(файл обрезан, показываются последние 1MB)...\n" + content[-max_size:]
-                            
-                            return {"success": True, "content": content}
+                    async with device_http.session().get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                        if response.status != 200:
+                            error_text = await response.text()
+                            return {"success": False, "error": f"Device returned status {response.status}: {error_text[:200]}"}
+                        
+                        # Читаем содержимое файла
+                        content = await response.text()
+                        
+                        # Ограничиваем размер для больших файлов (1MB)
+                        max_size = 1024 * 1024
+                        if len(content) > max_size:
+                            # Берем последнюю часть файла
+                            content = "...(файл обрезан, показываются последние 1MB)...\n" + content[-max_size:]
+                        
+                        return {"success": True, "content": content}
                 
                 except asyncio.TimeoutError:
                     return {"success": False, "error": "Timeout connecting to device"}
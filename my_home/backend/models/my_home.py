@@ -6,11 +6,17 @@ from pprint import pprint
 from typing import Optional, Union
 from utils.db_utils import db_session
 from db_models.devices import Devices as DbDevices
-from db_models.ports import Ports as DbPorts
 from models.device import get_ports_from_db
 import threading
 from datetime import datetime, timedelta
 from utils.socket_utils import connection_manager
+from utils.event_dispatcher import event_dispatcher
+from utils.port_values_writer import port_values_writer
+from utils.port_registry import port_registry
+from utils.device_liveness import device_liveness
+from utils.device_http import device_http
+from utils.reconnect_policy import reconnect_policy
+from utils.port_history import port_history
 from utils.logs import log_print
 from utils.logger import myhome_logger as logger
 from ssdpy import SSDPClient
@@ -30,6 +36,7 @@ import socket
 import ipaddress
 
 from models.device import MyHomeDeviceClient
+from models.device_supervisor import device_supervisor
 from models.singelton import SingletonClass
 
 
@@ -252,9 +259,6 @@ class ConfigVersionManager:
     Отправляет WebSocket уведомление об обновлении устройства
     """
     try:
-      from utils.socket_utils import connection_manager
-      import asyncio
-
       ws_data = {
         "type": "device",
         "action": "update",
@@ -265,19 +269,8 @@ class ConfigVersionManager:
         }
       }
 
-      # Запускаем broadcast в event loop
-      try:
-        loop = asyncio.get_running_loop()
-        if loop and loop.is_running():
-          asyncio.create_task(connection_manager.broadcast(ws_data))
-        else:
-          loop.run_until_complete(connection_manager.broadcast(ws_data))
-      except RuntimeError:
-        # Если нет активного loop, запускаем в новом потоке
-        def broadcast_update():
-          asyncio.run(connection_manager.broadcast(ws_data))
-
-        threading.Thread(target=broadcast_update, daemon=True).start()
+      # Доставка в loop сервера (метод вызывается из потока бэкапа)
+      event_dispatcher.publish(ws_data)
 
     except Exception as e:
       logger.error(f"Error broadcasting device update: {e}")
@@ -979,10 +972,10 @@ class MyHomeClass(SingletonClass):
       ip_list = [driver['location'].split('/')[2].split(':')[0] for driver in devices]
 
     semaphore = asyncio.Semaphore(10)  # Максимум 5 одновременных запросов
-    async with aiohttp.ClientSession() as session:
-      tasks = [fetch_info(session, ip, semaphore) for ip in ip_list]
-      results = await asyncio.gather(*tasks)
-      return [value[1] for value in results if isinstance(value[1], dict) and 'error' not in value[1]]
+    session = device_http.session()
+    tasks = [fetch_info(session, ip, semaphore) for ip in ip_list]
+    results = await asyncio.gather(*tasks)
+    return [value[1] for value in results if isinstance(value[1], dict) and 'error' not in value[1]]
 
   def load_devices(self):
     """
@@ -991,6 +984,9 @@ class MyHomeClass(SingletonClass):
     # Сначала выполняем миграцию старых log.json файлов
     self._migrate_all_log_files()
 
+    # Загружаем реестр портов, чтобы обработка значений не обращалась к БД
+    port_registry.load()
+
     with db_session() as db:
       devices = db.query(DbDevices).all()
 
@@ -1076,7 +1072,7 @@ class MyHomeClass(SingletonClass):
     if device_id in self._devices:
       existing_client = self._devices[device_id]
       # Проверяем, не запущен ли уже клиент
-      if hasattr(existing_client, '_running') and existing_client._running:
+      if getattr(existing_client, 'running', False):
         logger.warning(f"Device {device_id} already running, skipping duplicate add")
         return
 
@@ -1085,37 +1081,16 @@ class MyHomeClass(SingletonClass):
       logger.warning(f"Device with IP {device_ip} already exists, skipping duplicate add for device {device_id}")
       return
 
-    # Остановим старый клиент, если он есть
-    old_client = self._devices.get(device_id)
-    if old_client:
-      try:
-        # Проверяем, есть ли активный event loop
-        try:
-          loop = asyncio.get_running_loop()
-          if loop and loop.is_running():
-            asyncio.create_task(old_client.stop())
-          else:
-            # Если нет активного loop, запускаем в новом потоке
-            def stop_client():
-              asyncio.run(old_client.stop())
-
-            threading.Thread(target=stop_client, daemon=True).start()
-        except RuntimeError:
-          # Если нет event loop, запускаем в новом потоке
-          def stop_client():
-            asyncio.run(old_client.stop())
-
-          threading.Thread(target=stop_client, daemon=True).start()
-      except Exception:
-        pass
-
     # Создаём клиента из ORM-объекта
+    # Колбэки выполняются в основном loop приложения (передаются супервизором)
     client = MyHomeDeviceClient.from_db_device(
       device,
-      on_initial_ports=self._on_initial_ports,
-      on_value=self._on_value,
-      on_connect=self._on_connect,
-      on_disconnect=self._on_disconnect,
+      on_initial_ports=device_supervisor.wrap_callback(self._on_initial_ports),
+      on_value=device_supervisor.wrap_callback(self._on_value),
+      on_values=device_supervisor.wrap_callback(self._on_values),
+      on_ports_changed=device_supervisor.wrap_callback(self._on_ports_changed),
+      on_connect=device_supervisor.wrap_callback(self._on_connect),
+      on_disconnect=device_supervisor.wrap_callback(self._on_disconnect),
     )
 
     # Дополнительная проверка: если клиент с таким IP уже существует, не добавляем
@@ -1125,25 +1100,8 @@ class MyHomeClass(SingletonClass):
 
     self._devices[device_id] = client
 
-    # Запускаем клиента
-    try:
-      loop = asyncio.get_running_loop()
-    except RuntimeError:
-      loop = None
-
-    if loop and loop.is_running():
-      client.start(loop)
-    else:
-      threading.Thread(target=self._run_client_in_thread, args=(client,), daemon=True).start()
-
-  def _run_client_in_thread(self, client):
-    """
-    Запускает клиент в отдельном потоке с собственным event loop
-    """
-    try:
-      asyncio.run(client.start())
-    except Exception as e:
-      logger.error(f"[MyHomeClass] Error running client in thread: {e}")
+    # Запускаем клиента в loop супервизора (старый клиент с тем же id будет остановлен)
+    device_supervisor.add(client)
 
   # === callbacks ===
   def _on_connect(self, device_id: int):
@@ -1151,51 +1109,41 @@ class MyHomeClass(SingletonClass):
     Вызывается при подключении устройства
     """
     logger.success(f"Device {device_id} WebSocket connected")
-
-    # Обновляем статус в БД
-    try:
-      with db_session() as db:
-        device = db.query(DbDevices).filter(DbDevices.id == device_id).first()
-        if device:
-          device.online = True
-          device.last_seen = datetime.now()
-          # Инициализируем поля в params для бэкапов и логов
-          params = device.params if isinstance(device.params, dict) else {}
-          if 'last_backup_time' not in params:
-            params['last_backup_time'] = None
-          if 'last_backup_check' not in params:
-            params['last_backup_check'] = None
-          if 'last_logs_export' not in params:
-            params['last_logs_export'] = None
-          if 'uploaded_files' not in params:
-            params['uploaded_files'] = []
-          device.params = params
-          db.commit()
-
-          # Обновляем объект из БД
-          db.refresh(device)
-
-          # Извлекаем данные устройства внутри контекста сессии
-          device_data = device.to_dict()
-
-          # Отправляем WebSocket уведомление об изменении статуса
-          self._broadcast_device_status_update(device_id, device_data)
-    except Exception as e:
-      logger.error(f"[MyHome] Error updating online status for device {device_id}: {e}")
+    if device_liveness.set_online(device_id):
+      self._save_online_status(device_id, True)
 
   def _on_disconnect(self, device_id: int):
     """
     Вызывается при отключении устройства
     """
     logger.warning(f"Device {device_id} WebSocket disconnected")
+    if device_liveness.set_offline(device_id):
+      self._save_online_status(device_id, False)
 
-    # Обновляем статус в БД
+  def _save_online_status(self, device_id: int, online: bool):
+    """
+    Записывает переход online/offline в БД и уведомляет UI.
+    Вызывается только при смене статуса, last_seen между переходами
+    пишется контрольными точками DeviceLivenessTracker.
+    """
     try:
       with db_session() as db:
         device = db.query(DbDevices).filter(DbDevices.id == device_id).first()
         if device:
-          device.online = False
-          device.last_seen = datetime.now()
+          device.online = online
+          device.last_seen = device_liveness.last_seen(device_id) or datetime.now()
+          if online:
+            # Инициализируем поля в params для бэкапов и логов
+            params = device.params if isinstance(device.params, dict) else {}
+            if 'last_backup_time' not in params:
+              params['last_backup_time'] = None
+            if 'last_backup_check' not in params:
+              params['last_backup_check'] = None
+            if 'last_logs_export' not in params:
+              params['last_logs_export'] = None
+            if 'uploaded_files' not in params:
+              params['uploaded_files'] = []
+            device.params = params
           db.commit()
 
           # Обновляем объект из БД
@@ -1207,16 +1155,14 @@ class MyHomeClass(SingletonClass):
           # Отправляем WebSocket уведомление об изменении статуса
           self._broadcast_device_status_update(device_id, device_data)
     except Exception as e:
-      logger.error(f"[MyHome] Error updating offline status for device {device_id}: {e}")
+      status = 'online' if online else 'offline'
+      logger.error(f"[MyHome] Error updating {status} status for device {device_id}: {e}")
 
   def _broadcast_device_status_update(self, device_id: int, device_data: dict):
     """
     Отправляет WebSocket уведомление об изменении статуса устройства
     """
     try:
-      from utils.socket_utils import connection_manager
-      import asyncio
-
       ws_data = {
         "type": "device",
         "action": "status_update",
@@ -1229,19 +1175,7 @@ class MyHomeClass(SingletonClass):
         }
       }
 
-      # Запускаем broadcast в event loop
-      try:
-        loop = asyncio.get_running_loop()
-        if loop and loop.is_running():
-          asyncio.create_task(connection_manager.broadcast(ws_data))
-        else:
-          loop.run_until_complete(connection_manager.broadcast(ws_data))
-      except RuntimeError:
-        # Если нет активного loop, запускаем в новом потоке
-        def broadcast_update():
-          asyncio.run(connection_manager.broadcast(ws_data))
-
-        threading.Thread(target=broadcast_update, daemon=True).start()
+      event_dispatcher.publish(ws_data)
 
     except Exception as e:
       logger.error(f"Error broadcasting device status update: {e}")
@@ -1251,6 +1185,8 @@ class MyHomeClass(SingletonClass):
     Регистрируем/обновляем порты в БД под устройством и синхронизируем runtime-модель.
     """
     logger.info(f"Initial ports for device {device_id}: {len(ports)} ports")
+    for p in ports:
+      port_registry.update_runtime(device_id, p.get("code"), kind=p.get("kind"), direction=p.get("direction"))
     # with db_session() as db:
     #   for p in ports:
     #     code = p["code"]
@@ -1284,71 +1220,91 @@ class MyHomeClass(SingletonClass):
     # оповестим runtime-слой/UI
     # Devices().reload_device(device_id)
 
+  def _on_ports_changed(self, device_id: int, changes: dict):
+    """
+    Повторная загрузка /values изменила состав или метаданные портов:
+    обновляем реестр и отправляем в UI только изменения.
+    """
+    for p in changes["added"] + changes["metadata_changed"]:
+      port_registry.update_runtime(device_id, p.get("code"), kind=p.get("kind"), direction=p.get("direction"))
+
+    logger.info(
+      f"Ports changed for device {device_id}: +{len(changes['added'])} -{len(changes['removed'])} "
+      f"~{len(changes['metadata_changed'])}"
+    )
+
+    try:
+      ws_data = {
+        "type": "ports",
+        "action": "changed",
+        "data": {
+          "device_id": device_id,
+          "added": [self._port_summary(p) for p in changes["added"]],
+          "removed": [p.get("code") for p in changes["removed"]],
+          "metadata_changed": [self._port_summary(p) for p in changes["metadata_changed"]],
+          "ts": datetime.now().timestamp()
+        }
+      }
+
+      event_dispatcher.publish(ws_data)
+
+    except Exception as e:
+      logger.error(f"Error broadcasting ports change: {e}")
+
+  @staticmethod
+  def _port_summary(p: dict) -> dict:
+    return {
+      "code": p.get("code"),
+      "title": p.get("title"),
+      "direction": p.get("direction"),
+      "kind": p.get("kind"),
+      "unit": p.get("unit"),
+      "value": p.get("val"),
+    }
+
+  def _on_values(self, device_id: int, events: list):
+    """
+    Пачка событий из одного кадра WS (один вызов в основном loop на кадр).
+    """
+    for event in events:
+      self._on_value(device_id, event)
+
   def _on_value(self, device_id: int, event: dict):
     """
     Пришло событие от WS по одному порту: обновим БД и нотифицируем UI/HA.
-    event: {code, direction, kind, val, raw}
+    event: {code, direction, kind, val (типизированное по kind), val_raw, raw}
     """
     code = event.get("code")
     if not code:
       return
 
-    # Обновляем БД
-    pin_id = device_id  # По умолчанию используем device_id
-    with db_session() as db:
-      # Обновляем порт
-      db_port = (
-        db.query(DbPorts)
-        .filter(DbPorts.device_id == device_id, DbPorts.code == code)
-        .first()
-      )
-      if db_port:
-        db_port.last_value = event.get("val")
-        pin_id = db_port.id  # Используем ID порта если он найден
+    # Значение порта пишется в БД пакетно (write-behind)
+    port_values_writer.put(device_id, code, event.get("val_raw", event.get("val")))
+    # Числовые значения — в кольцевой буфер истории
+    port_history.add(device_id, code, event.get("val"))
 
-      # Обновляем статус устройства как онлайн при получении любых данных
-      device = db.query(DbDevices).filter(DbDevices.id == device_id).first()
-      if device:
-        device.online = True
-        device.last_seen = datetime.now()
-
-        # Инициализируем поля для отслеживания операций в params, если их нет
-        params = device.params if isinstance(device.params, dict) else {}
-        if 'last_backup_time' not in params:
-          params['last_backup_time'] = None
-        if 'last_backup_check' not in params:
-          params['last_backup_check'] = None
-        if 'last_logs_export' not in params:
-          params['last_logs_export'] = None
-        if 'uploaded_files' not in params:
-          params['uploaded_files'] = []
-        device.params = params
+    # last_seen обновляется в памяти, в БД пишется только переход в online
+    if device_liveness.touch(device_id):
+      self._save_online_status(device_id, True)
 
-      db.commit()
+    # ID порта берем из реестра в памяти, по умолчанию используем device_id
+    pin_id = port_registry.get_port_id(device_id, code) or device_id
 
     # Отправляем состояние в Home Assistant
     try:
       from utils.ha_manager import ha_manager
-      import asyncio
 
       # Получаем значение из события
       value = event.get("val")
       if value is not None:
-        # Отправляем состояние в HA асинхронно
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-          asyncio.create_task(ha_manager.send_device_state_to_ha(device_id, code, value))
-        else:
-          loop.run_until_complete(ha_manager.send_device_state_to_ha(device_id, code, value))
+        # Очередь публикации отбрасывает повторы и схлопывает частые значения
+        ha_manager.queue_device_state(device_id, code, value)
 
     except Exception as e:
       logger.error(f"Error sending state to HA: {e}")
 
     # Пуш в WebSocket/UI
     try:
-      from utils.socket_utils import connection_manager
-      import asyncio
-
       ws_data = {
         "type": "port",
         "action": "in",
@@ -1357,19 +1313,14 @@ class MyHomeClass(SingletonClass):
           "device_id": device_id,
           "code": code,
           "value": event.get("val"),
-          "value_raw": event.get("raw"),
+          "value_raw": event.get("val_raw"),
           "direction": event.get("direction"),
           "kind": event.get("kind"),
           "ts": datetime.now().timestamp()
         }
       }
 
-      # Запускаем broadcast в event loop
-      loop = asyncio.get_event_loop()
-      if loop.is_running():
-        asyncio.create_task(connection_manager.broadcast(ws_data))
-      else:
-        loop.run_until_complete(connection_manager.broadcast(ws_data))
+      event_dispatcher.publish(ws_data)
 
     except Exception as e:
       logger.error(f"Error broadcasting port update: {e}")
@@ -1393,17 +1344,16 @@ def add_routes(app: APIRouter, my_home: MyHomeClass):
     """
     try:
       # Получаем данные с устройства
-      async with aiohttp.ClientSession() as session:
-        url = f"http://{ip}/values"
-        async with session.get(url) as response:
-          if response.status == 200:
-            data = await response.text()
-            try:
-              device_data = json.loads(data)
-            except json.JSONDecodeError as e:
-              return {"error": f"JSON decode error: {str(e)}", "raw_response": data}
-          else:
-            return {"error": f"Error: {response.status}"}
+      url = f"http://{ip}/values"
+      async with device_http.session().get(url) as response:
+        if response.status == 200:
+          data = await response.text()
+          try:
+            device_data = json.loads(data)
+          except json.JSONDecodeError as e:
+            return {"error": f"JSON decode error: {str(e)}", "raw_response": data}
+        else:
+          return {"error": f"Error: {response.status}"}
 
       # Находим устройство в базе данных по IP
       device_id = None
@@ -1458,32 +1408,32 @@ def add_routes(app: APIRouter, my_home: MyHomeClass):
 
     timeout = aiohttp.ClientTimeout(sock_connect=5, total=10)
 
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-      try:
-        # Получение /values
-        url_values = f"http://{ip}/values"
-        async with session.get(url_values) as response:
-          if response.status != 200:
-            return JSONResponse({'error': f"Ошибка при запросе: {url_values}"}, 422)
-          text = await response.text()
-          try:
-            values = json.loads(text)
-          except json.JSONDecodeError as e:
-            return JSONResponse({'error': f"Ошибка парсинга /values: {str(e)}"}, 422)
-
-        # Получение /info
-        url_info = f"http://{ip}/info"
-        async with session.get(url_info) as response:
-          if response.status != 200:
-            return JSONResponse({'error': f"Ошибка при запросе: {url_info}"}, 422)
-          text = await response.text()
-          try:
-            info = json.loads(text)
-          except json.JSONDecodeError as e:
-            return JSONResponse({'error': f"Ошибка парсинга /info: {str(e)}"}, 422)
+    session = device_http.session()
+    try:
+      # Получение /values
+      url_values = f"http://{ip}/values"
+      async with session.get(url_values, timeout=timeout) as response:
+        if response.status != 200:
+          return JSONResponse({'error': f"Ошибка при запросе: {url_values}"}, 422)
+        text = await response.text()
+        try:
+          values = json.loads(text)
+        except json.JSONDecodeError as e:
+          return JSONResponse({'error': f"Ошибка парсинга /values: {str(e)}"}, 422)
+
+      # Получение /info
+      url_info = f"http://{ip}/info"
+      async with session.get(url_info, timeout=timeout) as response:
+        if response.status != 200:
+          return JSONResponse({'error': f"Ошибка при запросе: {url_info}"}, 422)
+        text = await response.text()
+        try:
+          info = json.loads(text)
+        except json.JSONDecodeError as e:
+          return JSONResponse({'error': f"Ошибка парсинга /info: {str(e)}"}, 422)
 
-      except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        return JSONResponse({'error': f"Ошибка при запросе: {str(e)}"}, 422)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+      return JSONResponse({'error': f"Ошибка при запросе: {str(e)}"}, 422)
 
     # Работа с БД
     with db_session() as db:
@@ -1557,6 +1507,25 @@ def add_routes(app: APIRouter, my_home: MyHomeClass):
     logger.info("=== GET /api/live/test called ===")
     return {"status": "ok", "message": "Live routes are working", "my_home_exists": my_home is not None}
 
+  @app.get("/api/live/stats", tags=["live"])
+  async def get_live_stats():
+    """
+    Внутренние счетчики live-подсистемы (буфер записи значений портов и т.п.)
+    """
+    return {
+      "port_values_writer": port_values_writer.get_stats(),
+      "port_registry": port_registry.get_stats(),
+      "device_liveness": device_liveness.get_stats(),
+      "device_http": device_http.get_stats(),
+      "reconnect": reconnect_policy.get_stats(),
+      "port_history": port_history.get_stats(),
+      "websocket": connection_manager.get_stats(),
+      "event_dispatcher": event_dispatcher.get_stats(),
+      "device_supervisor": {
+        key: value for key, value in device_supervisor.get_status().items() if key != 'devices'
+      },
+    }
+
   @app.get("/api/live/{ip}/info", tags=["live"])
   async def get_device_info(ip: str):
     """
@@ -1564,18 +1533,17 @@ def add_routes(app: APIRouter, my_home: MyHomeClass):
     """
     try:
       url = f"http://{ip}/info"
-      async with aiohttp.ClientSession() as session:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
-          text = await response.text()
-          if response.status == 200:
-            try:
-              data = json.loads(text)
-              data['ip'] = ip
-              return data
-            except json.JSONDecodeError:
-              return {"error": "JSON decode error", "raw_response": text, "ip": ip}
-          else:
-            return {"error": f"HTTP {response.status}", "raw_response": text, "ip": ip}
+      async with device_http.session().get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+        text = await response.text()
+        if response.status == 200:
+          try:
+            data = json.loads(text)
+            data['ip'] = ip
+            return data
+          except json.JSONDecodeError:
+            return {"error": "JSON decode error", "raw_response": text, "ip": ip}
+        else:
+          return {"error": f"HTTP {response.status}", "raw_response": text, "ip": ip}
     except asyncio.TimeoutError:
       return {"error": "Timeout error", "ip": ip}
     except Exception as e:
@@ -1601,10 +1569,14 @@ def add_routes(app: APIRouter, my_home: MyHomeClass):
       for device_id, client in my_home._devices.items():
         try:
           info = client.meta
+          # Доступность берем из трекера в памяти, без обращения к БД
+          liveness = device_liveness.get(device_id) or {}
+          last_seen = liveness.get('last_seen')
           result.append({
             **info,
             'device_id': client.device_id,
-            'online': client._online,
+            'online': liveness.get('online', client._online),
+            'last_seen': last_seen.isoformat() if last_seen else None,
             'id': client.id,
             'code': client.code,
             'name': client.name,
@@ -1661,7 +1633,7 @@ def add_routes(app: APIRouter, my_home: MyHomeClass):
             "unit": p.get("unit"),
             "title": p.get("title"),
             "group_title": p.get("group_title"),
-            "raw": p.get("raw"),
+            "raw": p.get("val_raw"),
           })
       except Exception as e:
         # Если клиент недоступен, пропускаем или можно добавить ошибку
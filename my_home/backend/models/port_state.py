@@ -0,0 +1,111 @@
+"""
+Компактное представление портов устройства MyHome в памяти клиента.
+
+PortMeta — статические метаданные из /values (общий объект для всех значений порта),
+PortState — горячие поля (значение, строка с устройства, время обновления).
+Оба класса на __slots__ и после публикации не изменяются: обновление значения
+создает новый PortState с той же PortMeta. Поэтому PortsSnapshot (кортеж
+состояний + версия) можно читать из любого потока без блокировок и копирования.
+"""
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+# Поля порта из /values, изменение которых считается изменением метаданных
+METADATA_FIELDS = (
+  "title", "direction", "kind", "type_raw", "unit", "mqtt", "href", "group_title", "group_href", "extra",
+)
+
+
+class PortMeta:
+  """Статические метаданные порта"""
+
+  __slots__ = ("code",) + METADATA_FIELDS + ("virtual",)
+
+  def __init__(self, code: str, virtual: bool = False, **fields):
+    self.code = code
+    self.virtual = virtual  # порт создан по событию WS, в /values его нет
+    for field in METADATA_FIELDS:
+      setattr(self, field, fields.get(field))
+
+  @classmethod
+  def from_flat(cls, rec: Dict[str, Any]) -> "PortMeta":
+    """Из элемента flatten_ports"""
+    return cls(rec["code"], **{field: rec.get(field) for field in METADATA_FIELDS})
+
+  def same_as(self, other: "PortMeta") -> bool:
+    return all(getattr(self, field) == getattr(other, field) for field in METADATA_FIELDS)
+
+
+class PortState:
+  """Значение порта; неизменяемый после публикации в снапшоте"""
+
+  __slots__ = ("meta", "val", "val_raw", "last_update")
+
+  def __init__(self, meta: PortMeta, val: Any = None, val_raw: Any = None, last_update: Optional[str] = None):
+    self.meta = meta
+    self.val = val  # значение, приведенное к типу по kind
+    self.val_raw = val_raw  # значение в том виде, в каком его прислало устройство
+    self.last_update = last_update
+
+  @property
+  def code(self) -> str:
+    return self.meta.code
+
+  @property
+  def kind(self) -> Optional[str]:
+    return self.meta.kind
+
+  @property
+  def direction(self) -> Optional[str]:
+    return self.meta.direction
+
+  def with_value(self, val: Any, val_raw: Any, last_update: str) -> "PortState":
+    return PortState(self.meta, val, val_raw, last_update)
+
+  def to_dict(self) -> Dict[str, Any]:
+    """Представление для API (в формате прежних словарей портов)"""
+    meta = self.meta
+    data = {
+      "code": meta.code,
+      "title": meta.title,
+      "direction": meta.direction,
+      "kind": meta.kind,
+      "type_raw": meta.type_raw,
+      "val": self.val,
+      "val_raw": self.val_raw,
+      "unit": meta.unit,
+      "mqtt": meta.mqtt,
+      "href": meta.href,
+      "group_title": meta.group_title,
+      "group_href": meta.group_href,
+      "last_update": self.last_update,
+    }
+    if meta.extra:
+      data["extra"] = meta.extra
+    return data
+
+
+class PortsSnapshot:
+  """Неизменяемый снимок портов устройства с номером версии"""
+
+  __slots__ = ("version", "ports", "created_at")
+
+  def __init__(self, version: int, ports: Tuple[PortState, ...]):
+    self.version = version
+    self.ports = ports
+    self.created_at = datetime.now()
+
+  def __len__(self) -> int:
+    return len(self.ports)
+
+  def to_dicts(self):
+    return [port.to_dict() for port in self.ports]
+
+  def find(self, code: str) -> Optional[PortState]:
+    for port in self.ports:
+      if port.code == code:
+        return port
+    return None
+
+
+EMPTY_SNAPSHOT = PortsSnapshot(0, ())
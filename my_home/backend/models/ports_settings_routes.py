@@ -9,6 +9,8 @@ from fastapi import APIRouter, HTTPException
 from utils.db_utils import db_session
 from db_models.devices import Devices as DbDevices
 from utils.logger import api_logger as logger
+from utils.port_registry import port_registry
+from utils.device_http import device_http
 
 def add_ports_settings_routes(app: APIRouter):
     """Add ports settings routes to the app"""
@@ -56,26 +58,25 @@ def add_ports_settings_routes(app: APIRouter):
                 config_data = {}
                 
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                            response_text = await response.text()
-                            logger.debug(f"Device {device_id} response status: {response.status}, length: {len(response_text)}")
-                            
-                            if response.status != 200:
-                                logger.error(f"Device {device_id} returned status {response.status}: {response_text[:500]}")
-                                raise HTTPException(
-                                    status_code=500,
-                                    detail=f"Device returned status {response.status}: {response_text[:200]}"
-                                )
-                            
-                            # Пытаемся получить JSON
-                            try:
-                                config_data = await response.json()
-                                logger.debug(f"Successfully parsed JSON from device {device_id}, keys: {list(config_data.keys()) if isinstance(config_data, dict) else 'not a dict'}")
-                            except (json_lib.JSONDecodeError, aiohttp.ContentTypeError) as e:
-                                logger.warning(f"Invalid JSON response from device {device_id}: {str(e)}, response: {response_text[:500]}")
-                                # Возвращаем пустой словарь, если устройство не поддерживает logs-config или вернуло невалидный JSON
-                                config_data = {}
+                    async with device_http.session().get(url, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                        response_text = await response.text()
+                        logger.debug(f"Device {device_id} response status: {response.status}, length: {len(response_text)}")
+                        
+                        if response.status != 200:
+                            logger.error(f"Device {device_id} returned status {response.status}: {response_text[:500]}")
+                            raise HTTPException(
+                                status_code=500,
+                                detail=f"Device returned status {response.status}: {response_text[:200]}"
+                            )
+                        
+                        # Пытаемся получить JSON
+                        try:
+                            config_data = await response.json()
+                            logger.debug(f"Successfully parsed JSON from device {device_id}, keys: {list(config_data.keys()) if isinstance(config_data, dict) else 'not a dict'}")
+                        except (json_lib.JSONDecodeError, aiohttp.ContentTypeError) as e:
+                            logger.warning(f"Invalid JSON response from device {device_id}: {str(e)}, response: {response_text[:500]}")
+                            # Возвращаем пустой словарь, если устройство не поддерживает logs-config или вернуло невалидный JSON
+                            config_data = {}
                 except asyncio.TimeoutError:
                     logger.error(f"Timeout connecting to device {device_id} at {url}")
                     raise HTTPException(
@@ -134,13 +135,12 @@ def add_ports_settings_routes(app: APIRouter):
                 
                 # Save logs configuration to device
                 url = f"http://{ip}/logs"
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, json=config, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                        if response.status != 200:
-                            raise HTTPException(
-                                status_code=response.status,
-                                detail=f"Device returned status {response.status}"
-                            )
+                async with device_http.session().post(url, json=config, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                    if response.status != 200:
+                        raise HTTPException(
+                            status_code=response.status,
+                            detail=f"Device returned status {response.status}"
+                        )
                 
                 return {"message": "Logs configuration saved successfully"}
                 
@@ -169,14 +169,14 @@ def add_ports_settings_routes(app: APIRouter):
                     "code": port_code,
                     "updates": updates
                 }
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, json=data, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                        if response.status != 200:
-                            raise HTTPException(
-                                status_code=response.status,
-                                detail=f"Device returned status {response.status}"
-                            )
-                
+                async with device_http.session().post(url, json=data, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                    if response.status != 200:
+                        raise HTTPException(
+                            status_code=response.status,
+                            detail=f"Device returned status {response.status}"
+                        )
+                
+                port_registry.reload_device(device_id)
                 return {"message": "Port parameter updated successfully"}
                 
         except aiohttp.ClientError as e:
@@ -199,6 +199,7 @@ def add_ports_settings_routes(app: APIRouter):
                 device.params = params
                 db.commit()
                 db.refresh(device)
+                port_registry.reload_device(device_id)
                 
                 return {"message": "HA settings updated successfully"}
                 
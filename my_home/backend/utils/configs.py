@@ -661,10 +661,63 @@ class AppConfig:
     'local_networks': "192.168.0.1/24",
     'scan_timeout': 2,
     'is_fast_scan': True,
+    'port_values': {
+      'flush_interval_ms': 1000,
+      'max_batch_size': 500
+    },
+    'device_liveness': {
+      'checkpoint_interval_sec': 60
+    },
+    'device_supervisor': {
+      'loops': 1
+    },
+    'device_http': {
+      'limit': 0,
+      'limit_per_host': 1,
+      'keepalive_timeout': 15,
+      'force_close': False
+    },
+    'device_reconnect': {
+      'base_delay': 1,
+      'max_delay': 60,
+      'jitter': 0.5,
+      'stable_sec': 30,
+      'max_concurrent_bootstraps': 4
+    },
+    'port_history': {
+      'max_points': 1000,
+      'max_age_sec': 86400,
+      'max_total_points': 500000
+    },
+    'websocket': {
+      'send_queue_size': 1000,
+      'slow_consumer_policy': 'drop_oldest',
+      'batch_tick_ms': 100,
+      'min_batch_tick_ms': 20,
+      'max_batch_tick_ms': 1000,
+      'events_history': 10000,
+      'latency_samples': 500
+    },
+    'device_commands': {
+      'ack_timeout': 3,
+      'max_batch': 100,
+      'max_rate': 20
+    },
+    'ha_publisher': {
+      'window_ms': 200,
+      'max_rate': 20
+    },
+    'event_dispatcher': {
+      'max_pending': 10000
+    },
     'homeassistant': {
       'url': 'homeassistant.local:8123',
       'token': '',
       'timeout': 30,
+      'http_limit': 10,
+      'http_keepalive': 60,
+      'max_in_flight': 32,
+      'full_audit_interval': 21600,
       'retry_attempts': 3,
       'log_requests': True,
       'log_responses': False,
@@ -889,6 +942,9 @@ class AppConfig:
       self._config['homeassistant']['entity_ports'][entity_id] = port_key
 
       self.save_yaml()
+
+      from utils.port_registry import port_registry
+      port_registry.set_published(device_id, port_code, True, entity_id)
       print(f"[AppConfig-HA] Added published port: {device_id}:{port_code} -> {entity_id}")
       return True
 
@@ -917,6 +973,9 @@ class AppConfig:
         self._config['homeassistant']['entity_ports'].pop(entity_id, None)
 
       self.save_yaml()
+
+      from utils.port_registry import port_registry
+      port_registry.set_published(device_id, port_code, False)
       print(f"[AppConfig-HA] Removed published port: {device_id}:{port_code}")
       return True
 
@@ -1009,8 +1068,10 @@ class AppConfig:
       # Формируем команду в формате ESP: "code#value"
       command = f"{port_code}#{value}"
 
-      # Отправляем команду через WebSocket устройства
-      await client._current_ws.send_str(command)
+      # Отправляем команду через клиента (WS принадлежит loop супервизора)
+      if not await client.send_command(port_code, value):
+        print(f"[AppConfig-HA] Device {device_id} failed to send command: {command}")
+        return
 
       print(f"[AppConfig-HA] Sent command to device {device_id}: {command}")
 
@@ -1088,6 +1149,10 @@ class AppConfig:
       'url': 'http://192.168.0.78:8123',  # Дефолтный URL из вашего примера
       'token': '',  # Пустой токен - пользователь может настроить позже
       'timeout': 30,
+      'http_limit': 10,
+      'http_keepalive': 60,
+      'max_in_flight': 32,
+      'full_audit_interval': 21600,
       'retry_attempts': 3,
       'log_requests': True,
       'log_responses': False,
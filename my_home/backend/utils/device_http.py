@@ -0,0 +1,149 @@
+"""
+Общий пул HTTP/WS соединений с устройствами MyHome.
+
+Вместо отдельного aiohttp.ClientSession на каждый запрос (и на каждое
+переподключение клиента) используется одна сессия с TCPConnector на event loop:
+aiohttp-сессии привязаны к loop, поэтому у loop-ов супервизора устройств и у loop
+приложения (FastAPI) свои сессии с одинаковыми настройками.
+
+Настройки (секция device_http конфигурации):
+- limit_per_host — ESP-прошивки обслуживают одно соединение за раз, поэтому
+  по умолчанию 1 (HTTP :80 и WS :81 — разные ключи пула);
+- limit — общий лимит соединений пула (0 — без ограничения, WS устройств держат
+  соединение постоянно);
+- keepalive_timeout / force_close — повторное использование соединений,
+  если прошивка не закрывает их сама.
+DNS-кэш отключен: устройства адресуются по IP.
+"""
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Dict
+
+import aiohttp
+
+from utils.configs import config
+from utils.logger import device_logger as logger
+
+
+class DeviceHttpPool:
+  """Сессии aiohttp с общим пулом соединений (одна на event loop)"""
+
+  def __init__(
+      self,
+      limit: int = 0,
+      limit_per_host: int = 1,
+      keepalive_timeout: float = 15.0,
+      force_close: bool = False,
+  ):
+    self.limit = limit
+    self.limit_per_host = limit_per_host
+    self.keepalive_timeout = keepalive_timeout
+    self.force_close = force_close
+
+    self._sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+    self.stats = {
+      'sessions_created': 0,
+      'requests': 0,
+      'connections_created': 0,  # новые TCP-соединения
+      'connections_reused': 0,  # запросы по уже открытому (keep-alive) соединению
+      'queued': 0,  # ожидания свободного соединения из-за лимитов
+      'errors': 0,
+    }
+
+  @classmethod
+  def from_config(cls) -> "DeviceHttpPool":
+    params = config['device_http'] or {}
+    return cls(
+      limit=int(params.get('limit', 0)),
+      limit_per_host=int(params.get('limit_per_host', 1)),
+      keepalive_timeout=float(params.get('keepalive_timeout', 15.0)),
+      force_close=bool(params.get('force_close', False)),
+    )
+
+  def session(self) -> aiohttp.ClientSession:
+    """Сессия текущего event loop (создается при первом обращении)"""
+    loop = asyncio.get_running_loop()
+    session = self._sessions.get(loop)
+    if session is None or session.closed:
+      # Убираем сессии завершившихся loop-ов
+      for old_loop in [item for item in self._sessions if item.is_closed()]:
+        self._sessions.pop(old_loop, None)
+      session = self._create_session()
+      self._sessions[loop] = session
+      self.stats['sessions_created'] += 1
+      logger.debug(
+        f"DeviceHttpPool: session created (limit {self.limit}, per host {self.limit_per_host}, "
+        f"keepalive {self.keepalive_timeout}s)"
+      )
+    return session
+
+  async def close(self):
+    """Закрывает сессию текущего event loop"""
+    session = self._sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+      await session.close()
+
+  def get_stats(self) -> Dict[str, Any]:
+    """Счетчики и состояние пулов для подбора настроек"""
+    pools = []
+    for session in list(self._sessions.values()):
+      connector = session.connector
+      if connector is None:
+        continue
+      idle = getattr(connector, '_conns', {}) or {}
+      acquired = getattr(connector, '_acquired', ()) or ()
+      pools.append({
+        'closed': session.closed,
+        'acquired': len(acquired),
+        'idle': sum(len(conns) for conns in idle.values()),
+        'idle_hosts': len(idle),
+      })
+    return {
+      **self.stats,
+      'limit': self.limit,
+      'limit_per_host': self.limit_per_host,
+      'keepalive_timeout': self.keepalive_timeout,
+      'force_close': self.force_close,
+      'sessions': len(self._sessions),
+      'pools': pools,
+    }
+
+  # === вспомогательные ===
+  def _create_session(self) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+      limit=self.limit,
+      limit_per_host=self.limit_per_host,
+      use_dns_cache=False,
+      keepalive_timeout=None if self.force_close else self.keepalive_timeout,
+      force_close=self.force_close,
+    )
+    return aiohttp.ClientSession(connector=connector, trace_configs=[self._trace_config()])
+
+  def _trace_config(self) -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context: SimpleNamespace, params):
+      self.stats['requests'] += 1
+
+    async def on_request_exception(session, context: SimpleNamespace, params):
+      self.stats['errors'] += 1
+
+    async def on_connection_create_end(session, context: SimpleNamespace, params):
+      self.stats['connections_created'] += 1
+
+    async def on_connection_reuseconn(session, context: SimpleNamespace, params):
+      self.stats['connections_reused'] += 1
+
+    async def on_connection_queued_start(session, context: SimpleNamespace, params):
+      self.stats['queued'] += 1
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_exception.append(on_request_exception)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_connection_queued_start.append(on_connection_queued_start)
+    return trace_config
+
+
+device_http = DeviceHttpPool.from_config()
@@ -0,0 +1,172 @@
+"""
+Отслеживание доступности (online/last_seen) устройств в памяти.
+
+last_seen обновляется в памяти на каждом кадре от устройства. В БД пишутся
+только переходы online/offline (из колбэков подключения) и периодическая
+контрольная точка last_seen раз в checkpoint_interval_sec секунд.
+"""
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+
+from utils.configs import config
+from utils.db_utils import db_session
+from utils.logger import db_logger as logger
+
+
+class DeviceLivenessTracker:
+  """Состояние доступности устройств с редкой записью в БД"""
+
+  _checkpoint_sql = text("UPDATE devices SET last_seen = :last_seen WHERE id = :device_id")
+
+  def __init__(self, checkpoint_interval_sec: int = 60):
+    self.checkpoint_interval_sec = checkpoint_interval_sec
+
+    self._state: Dict[int, Dict[str, Any]] = {}  # device_id → {online, last_seen, since}
+    self._dirty = set()  # устройства, у которых last_seen изменился после контрольной точки
+    self._lock = threading.Lock()
+    self._stop_event = threading.Event()
+    self._thread = None
+
+    self.stats = {
+      'touches': 0,
+      'transitions': 0,
+      'checkpoints': 0,
+      'checkpoint_rows': 0,
+      'errors': 0,
+      'last_checkpoint_at': None,
+    }
+
+  @classmethod
+  def from_config(cls) -> "DeviceLivenessTracker":
+    params = config['device_liveness'] or {}
+    return cls(checkpoint_interval_sec=int(params.get('checkpoint_interval_sec', 60)))
+
+  def start(self):
+    """Запускает поток периодической контрольной точки"""
+    if self._thread and self._thread.is_alive():
+      return
+    self._stop_event.clear()
+    self._thread = threading.Thread(target=self._run, name="DeviceLivenessTracker", daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    """Останавливает поток и записывает последнюю контрольную точку"""
+    self._stop_event.set()
+    if self._thread and self._thread.is_alive():
+      self._thread.join(timeout=5)
+    self._thread = None
+    self.checkpoint()
+
+  def touch(self, device_id: int) -> bool:
+    """
+    Отмечает кадр от устройства. Возвращает True, если устройство
+    было offline и перешло в online.
+    """
+    now = datetime.now()
+    with self._lock:
+      state = self._state.get(device_id)
+      became_online = state is None or not state['online']
+      if became_online:
+        self._state[device_id] = {'online': True, 'last_seen': now, 'since': now}
+        self.stats['transitions'] += 1
+      else:
+        state['last_seen'] = now
+      self._dirty.add(device_id)
+      self.stats['touches'] += 1
+
+    if not self._thread:
+      self.start()
+    return became_online
+
+  def set_online(self, device_id: int) -> bool:
+    """Переход в online (подключение WS). Возвращает True, если статус изменился"""
+    return self._set(device_id, True)
+
+  def set_offline(self, device_id: int) -> bool:
+    """Переход в offline (отключение WS). Возвращает True, если статус изменился"""
+    return self._set(device_id, False)
+
+  def _set(self, device_id: int, online: bool) -> bool:
+    now = datetime.now()
+    with self._lock:
+      state = self._state.get(device_id)
+      changed = state is None or state['online'] != online
+      if changed:
+        self._state[device_id] = {'online': online, 'last_seen': now, 'since': now}
+        self.stats['transitions'] += 1
+      else:
+        state['last_seen'] = now
+      # last_seen уже записывается в БД вместе с переходом
+      self._dirty.discard(device_id)
+
+    if not self._thread:
+      self.start()
+    return changed
+
+  def forget(self, device_id: int):
+    with self._lock:
+      self._state.pop(device_id, None)
+      self._dirty.discard(device_id)
+
+  def get(self, device_id: int) -> Optional[Dict[str, Any]]:
+    """Текущее состояние устройства (копия)"""
+    state = self._state.get(device_id)
+    return dict(state) if state else None
+
+  def is_online(self, device_id: int) -> bool:
+    state = self._state.get(device_id)
+    return bool(state and state['online'])
+
+  def last_seen(self, device_id: int) -> Optional[datetime]:
+    state = self._state.get(device_id)
+    return state['last_seen'] if state else None
+
+  def checkpoint(self) -> int:
+    """Пакетно записывает last_seen измененных устройств в БД"""
+    with self._lock:
+      dirty, self._dirty = self._dirty, set()
+      rows = [
+        {'device_id': device_id, 'last_seen': self._state[device_id]['last_seen']}
+        for device_id in dirty if device_id in self._state
+      ]
+    if not rows:
+      return 0
+
+    try:
+      with db_session() as db:
+        db.execute(self._checkpoint_sql, rows)
+        db.commit()
+    except Exception as e:
+      self.stats['errors'] += 1
+      logger.error(f"DeviceLivenessTracker checkpoint error: {e}")
+      with self._lock:
+        self._dirty.update(dirty)
+      return 0
+
+    self.stats['checkpoints'] += 1
+    self.stats['checkpoint_rows'] += len(rows)
+    self.stats['last_checkpoint_at'] = datetime.now()
+    logger.debug(f"DeviceLivenessTracker checkpoint: {len(rows)} devices")
+    return len(rows)
+
+  def get_stats(self) -> Dict[str, Any]:
+    return {
+      **self.stats,
+      'devices': len(self._state),
+      'online': sum(1 for state in self._state.values() if state['online']),
+      'pending': len(self._dirty),
+      'checkpoint_interval_sec': self.checkpoint_interval_sec,
+    }
+
+  def _run(self):
+    while not self._stop_event.wait(self.checkpoint_interval_sec):
+      try:
+        self.checkpoint()
+      except Exception as e:
+        logger.error(f"DeviceLivenessTracker loop error: {e}")
+
+
+device_liveness = DeviceLivenessTracker.from_config()
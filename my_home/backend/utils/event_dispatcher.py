@@ -0,0 +1,113 @@
+"""
+Единый диспетчер событий для браузеров (WebSocket /ws).
+
+publish(event) можно вызывать из любого потока и loop-а: событие кладется
+в ограниченный буфер, а доставка выполняется в loop сервера (uvicorn), которому
+принадлежат сокеты. Из чужого потока в loop сервера передается один вызов
+call_soon_threadsafe на пачку накопившихся событий — без отдельных потоков
+и asyncio.run на каждое сообщение.
+"""
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+from utils.configs import config
+from utils.logger import api_logger as logger
+
+
+class EventDispatcher:
+  """Потокобезопасная передача событий в loop сервера"""
+
+  def __init__(self, max_pending: int = 10000):
+    self.max_pending = max(1, max_pending)
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+    self._pending = deque()
+    self._lock = threading.Lock()
+    self._drain_scheduled = False
+
+    self.stats = {
+      'published': 0,
+      'delivered': 0,
+      'dropped': 0,  # вытеснены из переполненного буфера
+      'handoffs': 0,  # передач в loop сервера (call_soon_threadsafe)
+      'errors': 0,
+      'max_pending': 0,
+    }
+
+  @classmethod
+  def from_config(cls) -> "EventDispatcher":
+    params = config['event_dispatcher'] or {}
+    return cls(max_pending=int(params.get('max_pending', 10000)))
+
+  def set_loop(self, loop: asyncio.AbstractEventLoop):
+    """Loop сервера; накопленные до запуска события доставляются сразу"""
+    self._loop = loop
+    with self._lock:
+      need_drain = bool(self._pending) and not self._drain_scheduled
+      self._drain_scheduled = self._drain_scheduled or need_drain
+    if need_drain:
+      self.stats['handoffs'] += 1
+      loop.call_soon_threadsafe(self._drain)
+
+  def publish(self, event: Any, permission: str = 'all'):
+    """Публикует событие для рассылки (из любого потока)"""
+    self.stats['published'] += 1
+    loop = self._loop
+    try:
+      running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+      running_loop = None
+
+    # Уже в loop сервера и нет очереди — доставляем сразу
+    if loop is not None and running_loop is loop and not self._pending:
+      self._deliver(event, permission)
+      return
+
+    with self._lock:
+      if len(self._pending) >= self.max_pending:
+        self._pending.popleft()
+        self.stats['dropped'] += 1
+      self._pending.append((event, permission))
+      self.stats['max_pending'] = max(self.stats['max_pending'], len(self._pending))
+      schedule = loop is not None and not self._drain_scheduled
+      if schedule:
+        self._drain_scheduled = True
+
+    if schedule:
+      self.stats['handoffs'] += 1
+      try:
+        loop.call_soon_threadsafe(self._drain)
+      except RuntimeError:
+        # loop сервера уже закрыт
+        with self._lock:
+          self._drain_scheduled = False
+
+  def get_stats(self) -> Dict[str, Any]:
+    return {
+      **self.stats,
+      'pending': len(self._pending),
+      'max_pending_limit': self.max_pending,
+      'loop_set': self._loop is not None,
+    }
+
+  def _drain(self):
+    with self._lock:
+      events = list(self._pending)
+      self._pending.clear()
+      self._drain_scheduled = False
+    for event, permission in events:
+      self._deliver(event, permission)
+
+  def _deliver(self, event: Any, permission: str):
+    from utils.socket_utils import connection_manager
+
+    try:
+      connection_manager.broadcast_nowait(event, permission)
+      self.stats['delivered'] += 1
+    except Exception as e:
+      self.stats['errors'] += 1
+      logger.error(f"EventDispatcher delivery error: {e}")
+
+
+event_dispatcher = EventDispatcher.from_config()
@@ -0,0 +1,107 @@
+"""
+Отпечатки сущностей MyHome, примененных в Home Assistant.
+
+Для каждой сущности хранится хэш атрибутов, с которыми она последний раз
+была создана/обновлена в HA, и последнее отправленное состояние. При
+переподключении к HA сверяются только сущности, чей отпечаток изменился;
+полная сверка с get_states выполняется по расписанию.
+Хранится в ha_fingerprints.json в каталоге данных.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from utils.configs import get_data_dir
+from utils.logger import ha_logger as logger
+
+
+class HaFingerprints:
+  """Хранилище отпечатков сущностей с сохранением в файл"""
+
+  def __init__(self, path: Optional[str] = None):
+    self._path = path
+    self._entities: Dict[str, Dict[str, Any]] = {}
+    self.last_full_audit: Optional[float] = None
+    self._loaded = False
+    self._dirty = False
+
+  @property
+  def path(self) -> str:
+    if self._path is None:
+      self._path = os.path.join(get_data_dir(), 'ha_fingerprints.json')
+    return self._path
+
+  @staticmethod
+  def attributes_hash(attributes: Dict[str, Any]) -> str:
+    data = json.dumps(attributes, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+  def load(self):
+    self._loaded = True
+    if not os.path.exists(self.path):
+      return
+    try:
+      with open(self.path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+      self._entities = data.get('entities') or {}
+      self.last_full_audit = data.get('last_full_audit')
+    except Exception as e:
+      logger.error(f"Error loading HA fingerprints: {e}")
+      self._entities = {}
+
+  def save(self):
+    """Сохраняет изменения (атомарно, через временный файл)"""
+    if not self._dirty:
+      return
+    try:
+      tmp_path = f"{self.path}.tmp"
+      with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({'entities': self._entities, 'last_full_audit': self.last_full_audit}, file)
+      os.replace(tmp_path, self.path)
+      self._dirty = False
+    except Exception as e:
+      logger.error(f"Error saving HA fingerprints: {e}")
+
+  def entities(self) -> Dict[str, Dict[str, Any]]:
+    self._ensure_loaded()
+    return self._entities
+
+  def get(self, entity_id: str) -> Optional[Dict[str, Any]]:
+    return self.entities().get(entity_id)
+
+  def set_applied(self, entity_id: str, attributes_hash: str):
+    """Сущность применена в HA с этими атрибутами"""
+    entry = self.entities().setdefault(entity_id, {})
+    if entry.get('attrs') != attributes_hash:
+      entry['attrs'] = attributes_hash
+      self._dirty = True
+
+  def set_state(self, entity_id: str, state: str):
+    """Последнее отправленное состояние (только для уже известных сущностей)"""
+    entry = self.entities().get(entity_id)
+    if entry is not None and entry.get('state') != state:
+      entry['state'] = state
+      self._dirty = True
+
+  def remove(self, entity_id: str):
+    if self.entities().pop(entity_id, None) is not None:
+      self._dirty = True
+
+  def mark_full_audit(self):
+    self.last_full_audit = time.time()
+    self._dirty = True
+
+  def full_audit_due(self, interval_sec: float) -> bool:
+    self._ensure_loaded()
+    if not self._entities or self.last_full_audit is None:
+      return True
+    return interval_sec > 0 and time.time() - self.last_full_audit >= interval_sec
+
+  def _ensure_loaded(self):
+    if not self._loaded:
+      self.load()
+
+
+ha_fingerprints = HaFingerprints()
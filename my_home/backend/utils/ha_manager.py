@@ -9,17 +9,27 @@ import json
 import logging
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 from db_models.devices import Devices
 from db_models.ports import Ports
 from utils.db_utils import db_session
 from utils.configs import config
-from utils.home_assistant import HomeAssistantWebSocket, PortConfig, PortType, ControlType
+from utils.home_assistant import HomeAssistantWebSocket, PortConfig, PortType, ControlType, run_pipelined
 from utils.value_mapper import value_mapper
+from utils.port_registry import port_registry
+from utils.ha_state_publisher import ha_state_publisher
+from utils.ha_fingerprints import ha_fingerprints
 
 # Импортируем глобальный логгер
 from utils.logger import ha_logger as logger
 
+# Атрибуты сущности, которые задаются параметрами порта (PortConfig.to_attributes)
+_MANAGED_ATTRIBUTES = (
+  'friendly_name', 'device_class', 'unit_of_measurement', 'icon', 'state_class', 'entity_category',
+  'enabled_by_default', 'force_update', 'suggested_display_precision',
+)
+
 
 class HomeAssistantManager:
   """Менеджер Home Assistant с централизованной логикой"""
@@ -35,6 +45,33 @@ class HomeAssistantManager:
     # Кэш опубликованных портов
     self._published_ports_cache = []
     self._ports_cache_timestamp = None
+    # Индекс кэша для инкрементального обновления: id порта → данные порта,
+    # и максимальный updated_at портов/устройств на момент последней загрузки
+    self._ports_cache_index: Dict[int, Dict[str, Any]] = {}
+    self._ports_cache_since: Optional[datetime] = None
+    self.ports_cache_stats = {
+      'full_loads': 0,
+      'incremental_refreshes': 0,
+      'ports_reloaded': 0,
+      'ports_removed': 0,
+    }
+
+    # Состояния портов уходят в HA через очередь с подавлением повторов
+    self.state_publisher = ha_state_publisher
+    self.state_publisher.set_sender(self._publish_state)
+
+    # Отпечатки примененных в HA сущностей: при переподключении сверяются только
+    # изменившиеся, полная сверка (get_states) — раз в full_audit_interval секунд
+    self.fingerprints = ha_fingerprints
+    self.full_audit_interval = float((config['homeassistant'] or {}).get('full_audit_interval', 6 * 3600))
+    self._audit_task: Optional[asyncio.Task] = None
+    self.reconcile_stats = {
+      'full_audits': 0,
+      'incremental': 0,
+      'entities_applied': 0,
+      'entities_skipped': 0,  # отпечаток не изменился — сущность не трогали
+      'entities_removed': 0,
+    }
 
     # Настройка колбэков
     self.ha_client.set_callbacks(
@@ -107,10 +144,13 @@ class HomeAssistantManager:
       # Выполняем синхронизацию если включена
       if self.auto_sync_enabled:
         logger.info("Auto-sync enabled, performing initial synchronization...")
-        await self.sync_ports_with_ha()
+        await self.reconcile_ports_with_ha()
       else:
         logger.info("Auto-sync disabled, skipping initial synchronization")
 
+      if self._audit_task is None or self._audit_task.done():
+        self._audit_task = asyncio.create_task(self._full_audit_loop())
+
       self.initialized = True
       logger.success("Home Assistant manager initialized successfully")
       return True
@@ -124,6 +164,11 @@ class HomeAssistantManager:
     try:
       logger.info("Shutting down Home Assistant manager...")
 
+      if self._audit_task:
+        self._audit_task.cancel()
+        self._audit_task = None
+      self.fingerprints.save()
+
       if self.ha_client:
         await self.ha_client.disconnect()
 
@@ -182,6 +227,8 @@ class HomeAssistantManager:
 
       # Анализируем различия
       sync_result = await self._analyze_and_sync(ports_to_sync, ha_our_entities)
+      if sync_result.get('success'):
+        self._record_full_audit(ports_to_sync, sync_result['details'].get('failed_entities', []))
 
       logger.success(f"Sync completed: {sync_result}")
       return sync_result
@@ -202,75 +249,125 @@ class HomeAssistantManager:
 
     return self._published_ports_cache
 
-  async def _refresh_ports_cache(self, force_log: bool = False):
-    """Обновление кэша всех портов из базы данных"""
+  async def _refresh_ports_cache(self, force_log: bool = False, full: bool = False):
+    """
+    Обновление кэша всех портов из базы данных.
+    После первой загрузки перечитываются только порты, у которых (или у их
+    устройства) изменился updated_at, и убираются удаленные.
+    """
     try:
       logger.debug("Refreshing ports cache from database...")
 
-      # Загружаем все порты из БД (без фильтрации)
-      all_ports = await self._load_ports_from_database()
+      if full or self._ports_cache_since is None:
+        # Загружаем все порты из БД (без фильтрации)
+        await self._load_ports_from_database()
+        changed = len(self._ports_cache_index)
+      else:
+        changed = self._refresh_ports_incremental()
 
       # Обновляем кэш всеми портами
-      self._published_ports_cache = all_ports
+      self._published_ports_cache = sorted(
+        self._ports_cache_index.values(), key=lambda port: (port['device_id'], port['port_id'])
+      )
       self._ports_cache_timestamp = datetime.now()
 
+      message = f"Cache refreshed: {len(self._published_ports_cache)} total ports, {changed} reloaded"
       if force_log:
-        logger.info(f"Cache refreshed: {len(all_ports)} total ports loaded")
+        logger.info(message)
       else:
-        logger.debug(f"Cache refreshed: {len(all_ports)} total ports loaded")
+        logger.debug(message)
 
     except Exception as e:
       logger.error(f"Error refreshing ports cache: {e}")
       self._published_ports_cache = []
       self._ports_cache_timestamp = None
+      self._ports_cache_index = {}
+      self._ports_cache_since = None
 
   async def _load_ports_from_database(self) -> List[Dict[str, Any]]:
-    """Загрузка всех портов из базы данных (без проверки публикации в HA)"""
+    """Загрузка всех портов из базы данных одним запросом с join (без проверки публикации в HA)"""
     ports = []
 
     try:
       logger.debug("Loading all ports from database...")
       with db_session() as db:
-        # Получаем все устройства
-        devices = db.query(Devices).all()
-        logger.debug(f"Found {len(devices)} devices in database")
-
+        rows = self._ports_query(db).all()
         # Извлекаем данные из объектов SQLAlchemy внутри контекста сессии
-        device_data = []
-        total_ports = 0
-
-        for device in devices:
-          device_ports = db.query(Ports).filter(Ports.device_id == device.id).all()
-          total_ports += len(device_ports)
-
-          for port in device_ports:
-            # Загружаем все порты без проверки публикации
-            port_data = {
-              'device_id': device.id,
-              'port_code': port.code,
-              'port_type': port.type,
-              'params': port.params or {},
-              'device_name': device.name,
-              'port_name': port.name
-            }
-            device_data.append(port_data)
-
-            # Логируем информацию о порте
-            params = port.params or {}
-            ha_published = params.get('ha_published', False)
-            entity_id = params.get('entity_id', 'N/A')
-            logger.debug(
-              f"Loaded port: {port.code} ({device.name} - {port.name}) - Published: {ha_published}, Entity: {entity_id}")
-
-        # Обрабатываем данные вне контекста сессии
-        ports = device_data
-        logger.debug(f"Loaded {total_ports} total ports from {len(devices)} devices")
+        index = {}
+        since = None
+        for row in rows:
+          port_data, updated_at = self._port_row_to_dict(row)
+          index[port_data['port_id']] = port_data
+          if updated_at and (since is None or updated_at > since):
+            since = updated_at
+
+      self._ports_cache_index = index
+      self._ports_cache_since = since or datetime.min
+      self.ports_cache_stats['full_loads'] += 1
+      ports = list(index.values())
+      logger.debug(f"Loaded {len(ports)} total ports from database")
 
     except Exception as e:
       logger.error(f"Error loading ports from database: {e}")
 
     return ports
 
+  def _refresh_ports_incremental(self) -> int:
+    """Перечитывает измененные с прошлой загрузки порты; возвращает их количество"""
+    since = self._ports_cache_since
+    with db_session() as db:
+      # >= — записи с той же меткой времени перечитываются повторно, это безопасно
+      rows = (
+        self._ports_query(db)
+        .filter(or_(Ports.updated_at >= since, Devices.updated_at >= since))
+        .all()
+      )
+      changed = [self._port_row_to_dict(row) for row in rows]
+      total = db.query(func.count(Ports.id)).join(Devices, Ports.device_id == Devices.id).scalar()
+
+      index = self._ports_cache_index
+      for port_data, updated_at in changed:
+        index[port_data['port_id']] = port_data
+        if updated_at and updated_at > since:
+          since = updated_at
+
+      # Количество не сходится — были удаления, сверяем id
+      removed = 0
+      if total != len(index):
+        existing = {port_id for port_id, in db.query(Ports.id).join(Devices, Ports.device_id == Devices.id)}
+        for port_id in [port_id for port_id in index if port_id not in existing]:
+          del index[port_id]
+          removed += 1
+
+    self._ports_cache_since = since
+    self.ports_cache_stats['incremental_refreshes'] += 1
+    self.ports_cache_stats['ports_reloaded'] += len(changed)
+    self.ports_cache_stats['ports_removed'] += removed
+    return len(changed) + removed
+
+  @staticmethod
+  def _ports_query(db: Session):
+    return (
+      db.query(Ports, Devices.name, Devices.updated_at)
+      .join(Devices, Ports.device_id == Devices.id)
+    )
+
+  @staticmethod
+  def _port_row_to_dict(row) -> tuple:
+    """Строка запроса → (данные порта для кэша, последняя метка updated_at порта/устройства)"""
+    port, device_name, device_updated_at = row
+    port_data = {
+      'port_id': port.id,
+      'device_id': port.device_id,
+      'port_code': port.code,
+      'port_type': port.type,
+      'params': dict(port.params or {}),
+      'device_name': device_name,
+      'port_name': port.name
+    }
+    stamps = [stamp for stamp in (port.updated_at, device_updated_at) if stamp is not None]
+    return port_data, max(stamps) if stamps else None
+
   async def _filter_published_ports(self, all_ports: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Фильтрация портов, опубликованных в HA"""
     published_ports = []
@@ -316,6 +413,180 @@ class HomeAssistantManager:
       logger.error(f"Error getting all ports from database: {e}")
       return []
 
+  async def reconcile_ports_with_ha(self) -> Dict[str, Any]:
+    """
+    Сверка при подключении: применяются только сущности, чей отпечаток
+    (хэш атрибутов) изменился, и удаляются исчезнувшие из БД. Если полная
+    сверка просрочена или HA потерял наши сущности — выполняется она.
+    """
+    if self.fingerprints.full_audit_due(self.full_audit_interval):
+      return await self.sync_ports_with_ha()
+    if self.sync_in_progress:
+      logger.warning("Sync already in progress, skipping")
+      return {"success": False, "error": "Sync already in progress"}
+    if not (self.ha_client.connected and self.ha_client.authenticated):
+      return {"success": False, "error": "HA WebSocket is not connected"}
+
+    try:
+      self.sync_in_progress = True
+      await self._refresh_ports_cache()
+      ports = await self._filter_published_ports(await self._get_ports_from_database())
+      desired = {port['entity_id']: port for port in ports if port.get('entity_id')}
+      known = self.fingerprints.entities()
+
+      to_apply = [
+        port for entity_id, port in desired.items()
+        if (known.get(entity_id) or {}).get('attrs') != self._attributes_hash(port)
+      ]
+      to_remove = [entity_id for entity_id in known if entity_id not in desired]
+      skipped = len(desired) - len(to_apply)
+
+      # HA перезапускался и потерял созданные через REST сущности — нужна полная сверка
+      apply_ids = {port['entity_id'] for port in to_apply}
+      unchanged = [entity_id for entity_id in desired if entity_id in known and entity_id not in apply_ids]
+      if unchanged and not await self._entity_exists(unchanged[0]):
+        logger.info(f"Entity {unchanged[0]} is missing in HA, running full audit")
+        self.sync_in_progress = False
+        return await self.sync_ports_with_ha()
+
+      logger.info(f"Incremental HA reconcile: {len(to_apply)} to apply, {len(to_remove)} to remove, {skipped} unchanged")
+      max_in_flight = self.ha_client.max_in_flight
+      errors = []
+
+      applied_count = 0
+      applied = await run_pipelined(to_apply, self._apply_port_to_ha, max_in_flight)
+      for port_data, outcome in zip(to_apply, applied):
+        if isinstance(outcome, Exception):
+          errors.append(f"Failed to apply {port_data['entity_id']}: {outcome}")
+        else:
+          applied_count += 1
+          self.fingerprints.set_applied(port_data['entity_id'], self._attributes_hash(port_data))
+
+      removed_count = 0
+      removed = await run_pipelined(to_remove, self._delete_port_from_ha, max_in_flight)
+      for entity_id, outcome in zip(to_remove, removed):
+        if isinstance(outcome, Exception):
+          errors.append(f"Failed to remove {entity_id}: {outcome}")
+        else:
+          removed_count += 1
+          self.fingerprints.remove(entity_id)
+      self.fingerprints.save()
+
+      self.reconcile_stats['incremental'] += 1
+      self.reconcile_stats['entities_applied'] += applied_count
+      self.reconcile_stats['entities_skipped'] += skipped
+      self.reconcile_stats['entities_removed'] += removed_count
+      for error in errors:
+        logger.error(error)
+      return {
+        'success': True,
+        'mode': 'incremental',
+        'applied': applied_count,
+        'removed': removed_count,
+        'unchanged': skipped,
+        'failed': len(errors),
+        'errors': errors,
+      }
+
+    except Exception as e:
+      logger.error(f"Reconcile error: {e}")
+      return {"success": False, "error": str(e)}
+    finally:
+      self.sync_in_progress = False
+
+  async def _apply_port_to_ha(self, port_data: Dict[str, Any]):
+    """Создание или обновление сущности (полный набор атрибутов, текущее значение порта)"""
+    entity_id = port_data['entity_id']
+    if self.fingerprints.get(entity_id) is None:
+      await self._create_port_in_ha(port_data)
+      await config.add_published_port(port_data['device_id'], port_data['port_code'], entity_id)
+      await self._save_entity_id_to_db(port_data)
+      return
+    # Значение с устройства; если его нет (устройство offline) — состояние берется из HA
+    state = self._live_state(port_data)
+    ha_entity = {'entity_id': entity_id, 'state': state, 'attributes': {}} if state is not None else None
+    await self._update_port_in_ha(port_data, ha_entity)
+
+  def _live_state(self, port_data: Dict[str, Any]) -> Optional[str]:
+    """Текущее значение порта из снимка клиента устройства в формате HA"""
+    from models.device_supervisor import device_supervisor
+
+    client = device_supervisor.get_client(port_data['device_id'])
+    port = client.snapshot.find(port_data['port_code']) if client else None
+    if port is None or port.val is None:
+      return None
+    port_info = self._get_port_info_from_cache(port_data['port_code'], port_data['device_id']) or port_data
+    return self._ha_state(port_data['port_code'], port.val, port_info)
+
+  @staticmethod
+  def _ha_state(port_code: str, value: Any, port_info: Optional[Dict[str, Any]]) -> str:
+    ha_value = value_mapper.map_device_to_ha(port_code, value, port_info)
+    return str(ha_value) if not isinstance(ha_value, str) else ha_value
+
+  async def _entity_exists(self, entity_id: str) -> bool:
+    """Проверка одной сущности через REST (без выгрузки всех состояний HA)"""
+    try:
+      session = self.ha_client.http_session()
+      headers = {'Authorization': f'Bearer {config.get_ha_token()}'}
+      async with session.get(f"{config.get_ha_url()}/api/states/{entity_id}", headers=headers) as response:
+        return response.status != 404
+    except Exception as e:
+      logger.warning(f"Entity check failed for {entity_id}: {e}")
+      return True
+
+  def _record_full_audit(self, ports: List[Dict[str, Any]], failed_entities: List[str]):
+    """После полной сверки отпечатки соответствуют текущему состоянию HA"""
+    failed = set(failed_entities)
+    desired = {port['entity_id']: port for port in ports if port.get('entity_id')}
+    for entity_id in [entity_id for entity_id in self.fingerprints.entities() if entity_id not in desired]:
+      self.fingerprints.remove(entity_id)
+    for entity_id, port_data in desired.items():
+      if entity_id not in failed:
+        self.fingerprints.set_applied(entity_id, self._attributes_hash(port_data))
+    self.fingerprints.mark_full_audit()
+    self.fingerprints.save()
+    self.reconcile_stats['full_audits'] += 1
+
+  async def _full_audit_loop(self):
+    """Периодическая полная сверка с HA"""
+    if self.full_audit_interval <= 0:
+      return
+    while True:
+      await asyncio.sleep(self.full_audit_interval)
+      try:
+        if self.auto_sync_enabled and self.ha_client.connected:
+          await self.sync_ports_with_ha()
+        self.fingerprints.save()
+      except Exception as e:
+        logger.error(f"Full audit error: {e}")
+
+  @staticmethod
+  def _port_config(port_data: Dict[str, Any]) -> PortConfig:
+    """Конфигурация сущности HA для порта (общая для создания, обновления и отпечатка)"""
+    params = port_data.get('params') or {}
+    port_type = port_data.get('port_type', 'switch')
+    return PortConfig(
+      entity_id=port_data['entity_id'],
+      name=port_data.get('port_name') or port_data['port_code'],
+      port_type=PortType.SWITCH if port_type == 'switch' else PortType.SENSOR,
+      device_class=params.get('device_class'),
+      unit_of_measurement=params.get('unit_of_measurement'),
+      icon=params.get('icon'),
+      state_class=params.get('state_class'),
+      entity_category=params.get('entity_category'),
+      enabled_by_default=params.get('enabled_by_default', True),
+      force_update=params.get('force_update', False),
+      suggested_display_precision=params.get('suggested_display_precision'),
+      attributes=params.get('attributes', {})
+    )
+
+  def _port_attributes(self, port_data: Dict[str, Any]) -> Dict[str, Any]:
+    return self._port_config(port_data).to_attributes()
+
+  def _attributes_hash(self, port_data: Dict[str, Any]) -> str:
+    """Хэш ровно тех атрибутов, которые отправляются в HA"""
+    return self.fingerprints.attributes_hash(self._port_attributes(port_data))
+
   async def _analyze_and_sync(self, db_ports: List[Dict[str, Any]], ha_entities: List[Dict[str, Any]]) -> Dict[
     str, Any]:
     """Анализ и синхронизация портов"""
@@ -358,15 +629,21 @@ class HomeAssistantManager:
         'created': 0,
         'deleted': 0,
         'updated': 0,
-        'errors': []
+        'errors': [],
+        'failed_entities': []
       }
 
+      # Запросы к HA выполняются конвейером (до max_in_flight одновременно),
+      # запись в конфигурацию и БД — последовательно по результатам
+      max_in_flight = self.ha_client.max_in_flight
+
       # Создаем недостающие порты
-      for port_data in to_create:
+      logger.info(f"Creating {len(to_create)} ports")
+      created = await run_pipelined(to_create, self._create_port_in_ha, max_in_flight)
+      for port_data, outcome in zip(to_create, created):
         try:
-          logger.info(
-            f"Creating port: {port_data['entity_id']} ({port_data.get('device_name', 'Unknown')} - {port_data.get('port_name', 'Unknown')})")
-          await self._create_port_in_ha(port_data)
+          if isinstance(outcome, Exception):
+            raise outcome
 
           # Добавляем порт в конфигурацию
           await config.add_published_port(port_data['device_id'], port_data['port_code'], port_data['entity_id'])
@@ -374,41 +651,49 @@ class HomeAssistantManager:
           # Сохраняем entity_id в базе данных
           await self._save_entity_id_to_db(port_data)
 
-          # Обновляем кэш
-          await self._refresh_ports_cache()
-
           results['created'] += 1
           logger.success(f"Successfully created: {port_data['entity_id']}")
         except Exception as e:
           error_msg = f"Failed to create {port_data['entity_id']}: {e}"
           results['errors'].append(error_msg)
+          results['failed_entities'].append(port_data['entity_id'])
           logger.error(error_msg)
-          logger.error(f"{error_msg}")
+
+      # Обновляем кэш один раз после создания
+      if results['created']:
+        await self._refresh_ports_cache()
 
       # Удаляем лишние порты
-      for ha_entity in to_delete:
-        try:
-          logger.info(f"Deleting entity: {ha_entity['entity_id']}")
-          await self._delete_port_from_ha(ha_entity['entity_id'])
+      logger.info(f"Deleting {len(to_delete)} entities")
+      deleted = await run_pipelined(
+        to_delete, lambda ha_entity: self._delete_port_from_ha(ha_entity['entity_id']), max_in_flight
+      )
+      for ha_entity, outcome in zip(to_delete, deleted):
+        if isinstance(outcome, Exception):
+          error_msg = f"Failed to delete {ha_entity['entity_id']}: {outcome}"
+          results['errors'].append(error_msg)
+          results['failed_entities'].append(ha_entity['entity_id'])
+          logger.error(error_msg)
+        else:
           results['deleted'] += 1
           logger.success(f"Successfully deleted: {ha_entity['entity_id']}")
-        except Exception as e:
-          error_msg = f"Failed to delete {ha_entity['entity_id']}: {e}"
+
+      # Обновляем измененные порты (текущее состояние уже получено из get_states)
+      logger.info(f"Updating {len(to_update)} ports")
+      updated = await run_pipelined(
+        to_update,
+        lambda port_data: self._update_port_in_ha(port_data, ha_entities_dict.get(port_data['entity_id'])),
+        max_in_flight,
+      )
+      for port_data, outcome in zip(to_update, updated):
+        if isinstance(outcome, Exception):
+          error_msg = f"Failed to update {port_data['entity_id']}: {outcome}"
           results['errors'].append(error_msg)
+          results['failed_entities'].append(port_data['entity_id'])
           logger.error(error_msg)
-
-      # Обновляем измененные порты
-      for port_data in to_update:
-        try:
-          logger.info(
-            f"Updating port: {port_data['entity_id']} ({port_data.get('device_name', 'Unknown')} - {port_data.get('port_name', 'Unknown')})")
-          await self._update_port_in_ha(port_data)
+        else:
           results['updated'] += 1
           logger.success(f"Successfully updated: {port_data['entity_id']}")
-        except Exception as e:
-          error_msg = f"Failed to update {port_data['entity_id']}: {e}"
-          results['errors'].append(error_msg)
-          logger.error(error_msg)
 
       # Финальное сообщение с детальной статистикой
       total_operations = results['created'] + results['deleted'] + results['updated']
@@ -460,6 +745,7 @@ class HomeAssistantManager:
 
           port.params['entity_id'] = entity_id
           db.commit()
+          port_registry.reload_device(device_id)
           logger.debug(f"Entity ID saved to DB: {entity_id}")
         else:
           logger.warning(f"Port not found in DB: device {device_id}, port {port_code}")
@@ -470,26 +756,11 @@ class HomeAssistantManager:
   def _needs_update(self, port_data: Dict[str, Any], ha_entity: Dict[str, Any]) -> bool:
     """Проверка, нужно ли обновить конфигурацию порта"""
     try:
-      # Сравниваем основные атрибуты
+      # Сравниваем все атрибуты, которые отправляются в HA
       ha_attrs = ha_entity.get('attributes', {})
-
-      # Проверяем friendly_name
-      expected_name = port_data.get('port_name', '')
-      actual_name = ha_attrs.get('friendly_name', '')
-      if expected_name != actual_name:
-        return True
-
-      # Проверяем device_class
-      expected_device_class = port_data.get('params', {}).get('device_class', '')
-      actual_device_class = ha_attrs.get('device_class', '')
-      if expected_device_class != actual_device_class:
-        return True
-
-      # Проверяем unit_of_measurement
-      expected_unit = port_data.get('params', {}).get('unit_of_measurement', '')
-      actual_unit = ha_attrs.get('unit_of_measurement', '')
-      if expected_unit != actual_unit:
-        return True
+      for key, expected in self._port_attributes(port_data).items():
+        if ha_attrs.get(key) != expected:
+          return True
 
       return False
 
@@ -500,25 +771,7 @@ class HomeAssistantManager:
   async def _create_port_in_ha(self, port_data: Dict[str, Any]):
     """Создание порта в Home Assistant"""
     try:
-      # Определяем тип порта
-      port_type = port_data.get('port_type', 'switch')
-      entity_type = 'switch' if port_type == 'switch' else 'sensor'
-
-      # Создаем конфигурацию порта
-      port_config = PortConfig(
-        entity_id=port_data['entity_id'],
-        name=port_data.get('port_name', port_data['port_code']),
-        port_type=PortType.SWITCH if port_type == 'switch' else PortType.SENSOR,
-        device_class=port_data.get('params', {}).get('device_class'),
-        unit_of_measurement=port_data.get('params', {}).get('unit_of_measurement'),
-        icon=port_data.get('params', {}).get('icon'),
-        state_class=port_data.get('params', {}).get('state_class'),
-        entity_category=port_data.get('params', {}).get('entity_category'),
-        enabled_by_default=port_data.get('params', {}).get('enabled_by_default', True),
-        force_update=port_data.get('params', {}).get('force_update', False),
-        suggested_display_precision=port_data.get('params', {}).get('suggested_display_precision'),
-        attributes=port_data.get('params', {}).get('attributes', {})
-      )
+      port_config = self._port_config(port_data)
 
       # Создаем порт
       result = await self.ha_client.create_port(port_config)
@@ -544,34 +797,23 @@ class HomeAssistantManager:
       logger.error(f"Error deleting port from HA: {e}")
       raise
 
-  async def _update_port_in_ha(self, port_data: Dict[str, Any]):
-    """Обновление порта в Home Assistant"""
+  async def _update_port_in_ha(self, port_data: Dict[str, Any], ha_entity: Optional[Dict[str, Any]] = None):
+    """Обновление порта в Home Assistant (ha_entity — уже известное состояние сущности)"""
     try:
       # Получаем текущее состояние
-      current_state = await self.ha_client.get_state(port_data['entity_id'])
+      if ha_entity is not None:
+        current_state = {"success": True, "data": ha_entity}
+      else:
+        current_state = await self.ha_client.get_state(port_data['entity_id'])
       if not current_state.get('success'):
         raise Exception("Failed to get current state")
 
-      # Обновляем атрибуты
-      attributes = current_state['data'].get('attributes', {})
-
-      # Обновляем основные атрибуты
-      if 'port_name' in port_data:
-        attributes['friendly_name'] = port_data['port_name']
-      elif 'name' in port_data:
-        attributes['friendly_name'] = port_data['name']
-
-      params = port_data.get('params', {})
-      if 'device_class' in params:
-        attributes['device_class'] = params['device_class']
-      if 'unit_of_measurement' in params:
-        attributes['unit_of_measurement'] = params['unit_of_measurement']
-      if 'icon' in params:
-        attributes['icon'] = params['icon']
-      if 'state_class' in params:
-        attributes['state_class'] = params['state_class']
-      if 'entity_category' in params:
-        attributes['entity_category'] = params['entity_category']
+      # Полный набор атрибутов, как при создании; управляемые атрибуты,
+      # исчезнувшие из параметров порта, удаляются
+      attributes = dict(current_state['data'].get('attributes') or {})
+      for key in _MANAGED_ATTRIBUTES:
+        attributes.pop(key, None)
+      attributes.update(self._port_attributes(port_data))
 
       # Обновляем состояние
       current_state_value = current_state['data'].get('state', 'unknown')
@@ -710,9 +952,9 @@ class HomeAssistantManager:
         elif service == 'turn_off':
           await self._send_command_to_device(device_id, port_code, False)
         elif service == 'toggle':
-          # Получаем текущее состояние и инвертируем его
+          # Текущее состояние — из зеркала состояний клиента HA (без запроса get_states)
           current_state = await self.ha_client.get_state(entity_id)
-          if current_state and current_state.get('state') == 'on':
+          if current_state.get('success') and current_state['data'].get('state') == 'on':
             await self._send_command_to_device(device_id, port_code, False)
           else:
             await self._send_command_to_device(device_id, port_code, True)
@@ -747,9 +989,13 @@ class HomeAssistantManager:
     """Обработка изменения статуса подключения"""
     logger.info(f" Connection status changed: {'connected' if connected else 'disconnected'}")
 
+    if connected:
+      # HA мог потерять состояния — следующие значения отправляются заново
+      self.state_publisher.reset()
+
     if connected and self.auto_sync_enabled:
-      # При переподключении выполняем синхронизацию
-      await self.sync_ports_with_ha()
+      # При переподключении сверяются только изменившиеся сущности
+      await self.reconcile_ports_with_ha()
 
   def set_my_home(self, my_home):
     """Установка ссылки на my_home"""
@@ -763,79 +1009,92 @@ class HomeAssistantManager:
       return None
     return self.my_home.get_client(device_id)
 
+  def queue_device_state(self, device_id: int, port_code: str, value: Any):
+    """
+    Значение порта от устройства → очередь публикации в HA (вызывается в loop приложения).
+    Порт есть в реестре — без отдельной задачи, иначе — через send_device_state_to_ha.
+    """
+    port_info = self._get_port_info_from_cache(port_code, device_id)
+    if port_info is None:
+      asyncio.get_running_loop().create_task(self.send_device_state_to_ha(device_id, port_code, value))
+      return
+    try:
+      self._submit_state(device_id, port_code, value, port_info,
+                         port_info.get('entity_id'), port_info.get('published', False))
+    except Exception as e:
+      logger.error(f"Error queueing device state for HA: {e}")
+
   async def send_device_state_to_ha(self, device_id: int, port_code: str, value: Any):
     """Отправка состояния устройства в Home Assistant"""
     try:
       logger.debug(f"Sending device state to HA: device_id={device_id}, port_code={port_code}, value={value}")
       
-      # Получаем entity_id для порта
-      entity_id = await config.get_entity_id(device_id, port_code)
-      if not entity_id:
-        logger.debug(f"No entity_id found for device {device_id}, port {port_code}")
-        return
-
-      logger.debug(f"Entity ID: {entity_id}")
-
-      # Проверяем, что порт опубликован в HA
-      if not await config.is_port_published(device_id, port_code):
-        logger.debug(f"Port {device_id}:{port_code} is not published to HA")
-        return
-
-      # Преобразуем значение в формат HA
+      # entity_id и флаг публикации берем из реестра портов (без обращения к БД)
       port_info = self._get_port_info_from_cache(port_code, device_id)
-      logger.debug(f"Port info for mapping: {port_info}")
-      
-      ha_value = value_mapper.map_device_to_ha(port_code, value, port_info)
-      ha_state = str(ha_value) if not isinstance(ha_value, str) else ha_value
-      
-      logger.debug(f"Mapped value: {value} -> {ha_value} -> {ha_state}")
-
-      # Отправляем состояние в HA с сохранением friendly_name
-      if self.ha_client and self.ha_client.connected:
-        # Получаем friendly_name из порта
-        friendly_name = None
-        if port_info:
-          friendly_name = port_info.get('name') or port_info.get('port_name')
-        
-        # Формируем атрибуты для сохранения friendly_name
-        attributes = {}
-        if friendly_name:
-          attributes['friendly_name'] = friendly_name
-        
-        await self.ha_client.set_state(entity_id, ha_state, ControlType.UI, attributes)
-        logger.debug(f"State sent to HA: {entity_id} = {ha_state} (friendly_name: {friendly_name})")
+      if port_info:
+        entity_id = port_info.get('entity_id')
+        is_published = port_info.get('published', False)
       else:
-        logger.warning(f"HA client not connected, cannot send state for {entity_id}")
+        entity_id = await config.get_entity_id(device_id, port_code)
+        is_published = await config.is_port_published(device_id, port_code)
+
+      self._submit_state(device_id, port_code, value, port_info, entity_id, is_published)
 
     except Exception as e:
       logger.error(f"Error sending device state to HA: {e}")
       import traceback
       logger.error(f"Traceback: {traceback.format_exc()}")
 
+  def _submit_state(self, device_id: int, port_code: str, value: Any, port_info: Optional[Dict[str, Any]],
+                    entity_id: Optional[str], is_published: bool):
+    """Преобразует значение в состояние HA и ставит его в очередь публикации"""
+    if not entity_id:
+      logger.debug(f"No entity_id found for device {device_id}, port {port_code}")
+      return
+
+    # Проверяем, что порт опубликован в HA
+    if not is_published:
+      logger.debug(f"Port {device_id}:{port_code} is not published to HA")
+      return
+
+    # Преобразуем значение в формат HA
+    logger.debug(f"Port info for mapping: {port_info}")
+    
+    ha_value = value_mapper.map_device_to_ha(port_code, value, port_info)
+    ha_state = str(ha_value) if not isinstance(ha_value, str) else ha_value
+    
+    logger.debug(f"Mapped value: {value} -> {ha_value} -> {ha_state}")
+
+    # Отправляем состояние в HA с полным набором атрибутов сущности:
+    # POST /api/states заменяет атрибуты целиком
+    if self.ha_client and self.ha_client.connected:
+      if port_info and port_info.get('port_code'):
+        attributes = self._port_attributes({**port_info, 'entity_id': entity_id})
+      else:
+        friendly_name = port_info.get('name') or port_info.get('port_name') if port_info else None
+        attributes = {'friendly_name': friendly_name} if friendly_name else {}
+
+      self.state_publisher.submit(entity_id, ha_state, attributes)
+    else:
+      logger.warning(f"HA client not connected, cannot send state for {entity_id}")
+
+  async def _publish_state(self, entity_id: str, state: str, attributes: Dict[str, Any]) -> bool:
+    """Отправка состояния сущности (вызывается очередью публикации)"""
+    if not (self.ha_client and self.ha_client.connected):
+      return False
+    result = await self.ha_client.set_state(entity_id, state, ControlType.UI, attributes)
+    logger.debug(f"State sent to HA: {entity_id} = {state}")
+    if result.get('success'):
+      self.fingerprints.set_state(entity_id, state)
+      return True
+    return False
+
   def _get_port_info_from_cache(self, port_code: str, device_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
-    """Получает информацию о порте из кэша или базы данных"""
+    """Получает информацию о порте из реестра портов (O(1) по device_id, code)"""
     try:
-      logger.debug(f"Looking for port info: port_code={port_code}, device_id={device_id}")
-      logger.debug(f"Cache contains {len(self._published_ports_cache)} ports")
-      
-      # Сначала ищем в кэше опубликованных портов
-      for port in self._published_ports_cache:
-        if port.get('port_code') == port_code:
-          # Если указан device_id, проверяем соответствие
-          if device_id is None or port.get('device_id') == device_id:
-            logger.debug(f"Found port in cache: {port}")
-            # Нормализуем данные порта для маппера
-            normalized_port = self._normalize_port_data(port)
-            return normalized_port
-      
-      logger.debug(f"Port {port_code} not found in cache")
-      
-      # Если не найден в кэше, ищем в базе данных
       if device_id is not None:
-        logger.debug(f"Port {port_code} not found in cache, searching in database for device {device_id}")
-        return self._get_port_info_from_db(device_id, port_code)
-      
-      return None
+        return port_registry.get(device_id, port_code)
+      return port_registry.find_by_code(port_code)
     except Exception as e:
       logger.error(f"Error getting port info from cache: {e}")
       return None
@@ -860,43 +1119,6 @@ class HomeAssistantManager:
     logger.debug(f"Normalized port data: {normalized}")
     return normalized
 
-  def _get_port_info_from_db(self, device_id: int, port_code: str) -> Optional[Dict[str, Any]]:
-    """Получает информацию о порте из базы данных"""
-    try:
-      logger.debug(f"Searching in DB: device_id={device_id}, port_code={port_code}")
-      
-      with db_session() as db:
-        port = db.query(Ports).filter(
-          Ports.device_id == device_id,
-          Ports.code == port_code
-        ).first()
-        
-        if port:
-          # Преобразуем SQLAlchemy объект в словарь
-          port_data = {
-            'device_id': port.device_id,
-            'port_code': port.code,
-            'kind': port.kind,
-            'direction': port.direction,
-            'name': port.name,
-            'params': port.params or {}
-          }
-          logger.debug(f"Found port in DB: {port_code} (type: {port.kind}, direction: {port.direction})")
-          logger.debug(f"Port data: {port_data}")
-          return port_data
-        else:
-          logger.warning(f"Port not found in DB: device {device_id}, port {port_code}")
-          
-          # Давайте посмотрим, какие порты есть для этого устройства
-          all_ports = db.query(Ports).filter(Ports.device_id == device_id).all()
-          logger.debug(f"All ports for device {device_id}: {[(p.code, p.kind) for p in all_ports]}")
-          
-          return None
-          
-    except Exception as e:
-      logger.error(f"Error getting port info from DB: {e}")
-      return None
-
   def get_status(self) -> Dict[str, Any]:
     """Получение статуса менеджера"""
     return {
@@ -905,7 +1127,14 @@ class HomeAssistantManager:
       'sync_in_progress': self.sync_in_progress,
       'ha_client_status': self.ha_client.get_connection_status() if self.ha_client else None,
       'device_clients_count': len(self.device_clients),
-      'cache_status': self.get_cache_status()
+      'cache_status': self.get_cache_status(),
+      'state_publisher': self.state_publisher.get_stats(),
+      'reconcile': {
+        **self.reconcile_stats,
+        'tracked_entities': len(self.fingerprints.entities()),
+        'last_full_audit': self.fingerprints.last_full_audit,
+        'full_audit_interval': self.full_audit_interval,
+      },
     }
 
   async def get_published_ports_count(self) -> int:
@@ -1054,6 +1283,7 @@ class HomeAssistantManager:
     """Получение статуса кэша портов"""
     return {
       'cache_size': len(self._published_ports_cache),
+      'refresh_stats': self.ports_cache_stats,
       'cache_timestamp': self._ports_cache_timestamp.isoformat() if self._ports_cache_timestamp else None,
       'cache_age_seconds': (
           datetime.now() - self._ports_cache_timestamp).total_seconds() if self._ports_cache_timestamp else None,
@@ -1067,7 +1297,7 @@ class HomeAssistantManager:
     logger.info(f" Auto sync {'enabled' if enabled else 'disabled'}")
 
   async def force_sync(self) -> Dict[str, Any]:
-    """Принудительная синхронизация"""
+    """Принудительная синхронизация (полная сверка)"""
     return await self.sync_ports_with_ha()
 
 
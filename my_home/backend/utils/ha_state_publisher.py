@@ -0,0 +1,115 @@
+"""
+Публикация состояний портов устройств в Home Assistant.
+
+Значения от устройств приходят на каждый кадр WS, а HA нужно только
+изменение состояния сущности:
+- состояние, совпадающее с последним отправленным, не отправляется;
+- значения одной сущности в пределах window_ms схлопываются до последнего;
+- общий поток запросов к HA ограничен max_rate запросов в секунду.
+Работает в loop приложения (там же, где клиент HA).
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from utils.configs import config
+from utils.logger import ha_logger as logger
+
+# (entity_id, state, attributes) → успешно ли отправлено
+SendStateFn = Callable[[str, str, Dict[str, Any]], Awaitable[bool]]
+
+
+class HaStatePublisher:
+  """Очередь последних состояний сущностей с ограничением частоты запросов"""
+
+  def __init__(self, window_ms: int = 200, max_rate: float = 20.0):
+    self.window = max(window_ms, 0) / 1000
+    self.min_interval = 1 / max_rate if max_rate > 0 else 0.0
+    self._send: Optional[SendStateFn] = None
+    # entity_id → [state, attributes, срок отправки]; порядок — порядок поступления
+    self._pending: Dict[str, list] = {}
+    # entity_id → (state, attributes), последнее успешно отправленное
+    self._last_sent: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    self._last_request_at = 0.0
+    self._task: Optional[asyncio.Task] = None
+
+    self.stats = {
+      'submitted': 0,
+      'sent': 0,
+      'suppressed': 0,  # совпадает с последним отправленным состоянием
+      'collapsed': 0,  # заменено более новым значением до отправки
+      'failed': 0,
+    }
+
+  @classmethod
+  def from_config(cls) -> "HaStatePublisher":
+    params = config['ha_publisher'] or {}
+    return cls(
+      window_ms=int(params.get('window_ms', 200)),
+      max_rate=float(params.get('max_rate', 20)),
+    )
+
+  def set_sender(self, send: SendStateFn):
+    self._send = send
+
+  def submit(self, entity_id: str, state: str, attributes: Optional[Dict[str, Any]] = None):
+    """Ставит состояние сущности на отправку (вызывается в loop приложения)"""
+    attributes = attributes or {}
+    self.stats['submitted'] += 1
+
+    pending = self._pending.get(entity_id)
+    if pending is not None:
+      # Срок и позиция в очереди остаются, отправится последнее значение
+      pending[0], pending[1] = state, attributes
+      self.stats['collapsed'] += 1
+      return
+    if self._last_sent.get(entity_id) == (state, attributes):
+      self.stats['suppressed'] += 1
+      return
+
+    self._pending[entity_id] = [state, attributes, time.monotonic() + self.window]
+    if self._task is None or self._task.done():
+      self._task = asyncio.get_running_loop().create_task(self._run())
+
+  def reset(self):
+    """Забыть отправленные состояния (после переподключения к HA)"""
+    self._last_sent.clear()
+
+  def get_stats(self) -> Dict[str, Any]:
+    return {
+      **self.stats,
+      'pending': len(self._pending),
+      'tracked_entities': len(self._last_sent),
+      'window_ms': int(self.window * 1000),
+      'max_rate': round(1 / self.min_interval, 2) if self.min_interval else None,
+    }
+
+  async def _run(self):
+    while self._pending:
+      entity_id, (state, attributes, due) = next(iter(self._pending.items()))
+      now = time.monotonic()
+      wait = max(due - now, self._last_request_at + self.min_interval - now)
+      if wait > 0:
+        await asyncio.sleep(wait)
+        continue
+
+      del self._pending[entity_id]
+      if self._last_sent.get(entity_id) == (state, attributes):
+        # Пачка вернулась к уже отправленному значению
+        self.stats['suppressed'] += 1
+        continue
+
+      self._last_request_at = now
+      try:
+        sent = bool(self._send) and await self._send(entity_id, state, attributes)
+      except Exception as e:
+        logger.error(f"Error publishing state {entity_id} to HA: {e}")
+        sent = False
+      if sent:
+        self._last_sent[entity_id] = (state, attributes)
+        self.stats['sent'] += 1
+      else:
+        self.stats['failed'] += 1
+
+
+ha_state_publisher = HaStatePublisher.from_config()
@@ -9,7 +9,7 @@ import socket
 import yaml
 from dataclasses import dataclass
 from enum import Enum
-from typing import Dict, Any, Optional, Callable, Set, List
+from typing import Dict, Any, Optional, Callable, Set, List, Awaitable, Iterable
 import websockets
 import aiohttp
 from websockets.exceptions import ConnectionClosed, WebSocketException
@@ -272,6 +272,46 @@ class PortConfig:
   suggested_display_precision: Optional[int] = None
   attributes: Optional[Dict[str, Any]] = None
 
+  def to_attributes(self) -> Dict[str, Any]:
+    """Атрибуты сущности в HA (POST /api/states заменяет их целиком)"""
+    attributes = {
+      'friendly_name': self.name,
+      'enabled_by_default': self.enabled_by_default,
+      'force_update': self.force_update,
+      'custom_component': 'my_home_addon',
+      'source': 'websocket_client'
+    }
+
+    if self.device_class:
+      attributes['device_class'] = self.device_class
+    if self.unit_of_measurement:
+      attributes['unit_of_measurement'] = self.unit_of_measurement
+    if self.icon:
+      attributes['icon'] = self.icon
+    if self.state_class:
+      attributes['state_class'] = self.state_class
+    if self.entity_category:
+      attributes['entity_category'] = self.entity_category
+    if self.suggested_display_precision:
+      attributes['suggested_display_precision'] = self.suggested_display_precision
+    if self.attributes:
+      attributes.update(self.attributes)
+    return attributes
+
+
+async def run_pipelined(items: Iterable[Any], fn: Callable[[Any], Awaitable[Any]], max_in_flight: int) -> List[Any]:
+  """
+  Выполняет fn для всех элементов, держа в работе не больше max_in_flight одновременно.
+  Результаты — в порядке элементов; исключение элемента возвращается как значение.
+  """
+  semaphore = asyncio.Semaphore(max(1, max_in_flight))
+
+  async def run(item):
+    async with semaphore:
+      return await fn(item)
+
+  return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
 
 class HomeAssistantWebSocket:
   """Home Assistant WebSocket клиент с максимальным функционалом"""
@@ -288,6 +328,27 @@ class HomeAssistantWebSocket:
     self.custom_ports = set()
     self._state_changes_subscribed = False
 
+    # Общая HTTP-сессия для REST API HA: keep-alive соединения вместо
+    # нового TCP/TLS-соединения на каждый запрос (закрывается в disconnect)
+    self._http_session: Optional[aiohttp.ClientSession] = None
+    self._http_loop: Optional[asyncio.AbstractEventLoop] = None
+    self.http_sessions_created = 0
+
+    # Зеркало состояний HA: загружается одним get_states и обновляется событиями
+    # state_changed, поэтому get_state не запрашивает все состояния на каждую сущность
+    self._states: Dict[str, Dict[str, Any]] = {}
+    self._states_loaded = False
+    self._states_task: Optional[asyncio.Task] = None
+
+    # Конвейер команд: сколько запросов синхронизации портов держать в полете одновременно
+    self.max_in_flight = int((config['homeassistant'] or {}).get('max_in_flight', 32))
+    self.command_stats = {
+      'sent': 0,
+      'timeouts': 0,
+      'errors': 0,
+      'max_in_flight': 0,  # пик одновременно ожидающих ответа команд
+    }
+
     # Настройки переподключения
     self.reconnect_interval = 5
     self.max_reconnect_attempts = 10
@@ -415,6 +476,9 @@ class HomeAssistantWebSocket:
         close_timeout=10
       )
       self.connected = True
+      # Новое подключение — зеркало состояний загружается заново
+      self._states.clear()
+      self._states_loaded = False
 
       # Аутентификация
       try:
@@ -466,11 +530,56 @@ class HomeAssistantWebSocket:
       if self.websocket:
         await self.websocket.close()
 
+      await self.close_http_session()
+
       logger.info("[HA-WebSocket] Disconnected from Home Assistant")
 
     except Exception as e:
       logger.error(f"[HA-WebSocket] Error during disconnect: {e}")
 
+  def http_session(self) -> aiohttp.ClientSession:
+    """HTTP-сессия для REST API HA (создается при первом обращении в текущем loop)"""
+    loop = asyncio.get_running_loop()
+    if self._http_session is None or self._http_session.closed or self._http_loop is not loop:
+      self._drop_http_session()
+      params = config['homeassistant'] or {}
+      connector = aiohttp.TCPConnector(
+        limit=int(params.get('http_limit', 10)),
+        keepalive_timeout=float(params.get('http_keepalive', 60)),
+        ttl_dns_cache=300,
+      )
+      self._http_session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=float(params.get('timeout', 30))),
+      )
+      self._http_loop = loop
+      self.http_sessions_created += 1
+      logger.debug("[HA-WebSocket] HTTP session created")
+    return self._http_session
+
+  def _drop_http_session(self):
+    """Закрывает сессию другого loop-а в ее собственном loop (или синхронно, если он уже закрыт)"""
+    session, old_loop = self._http_session, self._http_loop
+    self._http_session = None
+    if session is None or session.closed:
+      return
+    try:
+      if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+        asyncio.run_coroutine_threadsafe(session.close(), old_loop)
+      else:
+        # loop сессии остановлен: закрываем соединения и отвязываем коннектор
+        connector = session.connector
+        if connector is not None:
+          connector.close()
+        session.detach()
+    except Exception as e:
+      logger.warning(f"[HA-WebSocket] Error closing previous HTTP session: {e}")
+
+  async def close_http_session(self):
+    session, self._http_session = self._http_session, None
+    if session is not None and not session.closed:
+      await session.close()
+
   async def _authenticate(self):
     """Аутентификация в Home Assistant"""
     try:
@@ -568,7 +677,8 @@ class HomeAssistantWebSocket:
         logger.debug(f"[HA-WebSocket] Received result for command {message_id}: success={data.get('success')}")
         if message_id in self.pending_requests:
           future = self.pending_requests.pop(message_id)
-          future.set_result(data)
+          if not future.done():
+            future.set_result(data)
         else:
           logger.warning(f"[HA-WebSocket] Received result for unknown command {message_id}")
 
@@ -603,6 +713,13 @@ class HomeAssistantWebSocket:
       new_state = event_data.get('new_state', {})
       old_state = event_data.get('old_state', {})
 
+      if entity_id and self._states_loaded:
+        if new_state:
+          self._put_state(new_state)
+        else:
+          # Сущность удалена
+          self._states.pop(entity_id, None)
+
       if not entity_id or not new_state:
         return
 
@@ -701,13 +818,13 @@ class HomeAssistantWebSocket:
         "attributes": attributes
       }
 
-      async with aiohttp.ClientSession() as session:
-        async with session.post(api_url, headers=headers, json=data) as response:
-          if response.status in [200, 201]:
-            logger.info(f"[HA-WebSocket] UI response sent: {entity_id} = {state}")
-          else:
-            error_text = await response.text()
-            logger.error(f"[HA-WebSocket] UI response failed: HTTP {response.status} - {error_text}")
+      session = self.http_session()
+      async with session.post(api_url, headers=headers, json=data) as response:
+        if response.status in [200, 201]:
+          logger.info(f"[HA-WebSocket] UI response sent: {entity_id} = {state}")
+        else:
+          error_text = await response.text()
+          logger.error(f"[HA-WebSocket] UI response failed: HTTP {response.status} - {error_text}")
 
     except Exception as e:
       logger.error(f"[HA-WebSocket] Error sending UI response: {e}")
@@ -737,7 +854,7 @@ class HomeAssistantWebSocket:
     else:
       logger.error(f"[HA-WebSocket] Max reconnection attempts reached ({self.max_reconnect_attempts})")
 
-  async def _send_command(self, command: Dict[str, Any]) -> Dict[str, Any]:
+  async def _send_command(self, command: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
     """Отправка команды и ожидание ответа"""
     if not self.connected or not self.authenticated:
       if not self.connected:
@@ -748,34 +865,40 @@ class HomeAssistantWebSocket:
         logger.warning("[HA-WebSocket] See previous messages for token setup instructions")
       raise Exception("Not connected or not authenticated")
 
+    # id команды — локальный: параллельные команды увеличивают self.message_id
     self.message_id += 1
-    command['id'] = self.message_id
-    logger.debug(f"[HA-WebSocket] Sending command {self.message_id}: {command.get('type')}")
+    message_id = self.message_id
+    command['id'] = message_id
+    logger.debug(f"[HA-WebSocket] Sending command {message_id}: {command.get('type')}")
 
     # Создаем Future для ожидания ответа
-    future = asyncio.Future()
-    self.pending_requests[self.message_id] = future
+    future = asyncio.get_running_loop().create_future()
+    self.pending_requests[message_id] = future
+    self.command_stats['max_in_flight'] = max(self.command_stats['max_in_flight'], len(self.pending_requests))
+    timeout = timeout or config.get_ha_timeout()
 
     try:
       # Отправляем команду
       await self.websocket.send(json.dumps(command))
-      logger.debug(f"[HA-WebSocket] Command {self.message_id} sent successfully")
+      self.command_stats['sent'] += 1
+      logger.debug(f"[HA-WebSocket] Command {message_id} sent successfully")
 
       # Ждем ответ с таймаутом
-      timeout = config.get_ha_timeout()
-      logger.debug(f"[HA-WebSocket] Waiting for response to command {self.message_id} (timeout: {timeout}s)")
+      logger.debug(f"[HA-WebSocket] Waiting for response to command {message_id} (timeout: {timeout}s)")
       response = await asyncio.wait_for(future, timeout=timeout)
-      logger.debug(f"[HA-WebSocket] Received response for command {self.message_id}: success={response.get('success')}")
+      logger.debug(f"[HA-WebSocket] Received response for command {message_id}: success={response.get('success')}")
 
       return response
 
     except asyncio.TimeoutError:
-      self.pending_requests.pop(self.message_id, None)
-      logger.error(f"[HA-WebSocket] Command {self.message_id} timeout after {timeout}s")
+      self.pending_requests.pop(message_id, None)
+      self.command_stats['timeouts'] += 1
+      logger.error(f"[HA-WebSocket] Command {message_id} timeout after {timeout}s")
       raise Exception("Command timeout")
     except Exception as e:
-      self.pending_requests.pop(self.message_id, None)
-      logger.error(f"[HA-WebSocket] Command {self.message_id} error: {e}")
+      self.pending_requests.pop(message_id, None)
+      self.command_stats['errors'] += 1
+      logger.error(f"[HA-WebSocket] Command {message_id} error: {e}")
       raise e
 
   # Методы для интеграции с реальным проектом
@@ -826,7 +949,12 @@ class HomeAssistantWebSocket:
       'authenticated': self.authenticated,
       'test_mode': self.test_mode,
       'custom_ports_count': len(self.custom_ports),
-      'subscriptions_count': len(self.port_subscriptions)
+      'subscriptions_count': len(self.port_subscriptions),
+      'http_session_open': self._http_session is not None and not self._http_session.closed,
+      'http_sessions_created': self.http_sessions_created,
+      'pending_requests': len(self.pending_requests),
+      'commands': {**self.command_stats, 'max_in_flight_limit': self.max_in_flight},
+      'states_mirror': {'loaded': self._states_loaded, 'entities': len(self._states)},
     }
 
   def get_custom_ports(self) -> List[str]:
@@ -857,31 +985,45 @@ class HomeAssistantWebSocket:
       }
       result = await self._send_command(command)
       logger.info(f"[HA-WebSocket] Get states result: success={result.get('success')}, result_count={len(result.get('result', []))}")
+      if result.get('success'):
+        for state in result.get('result') or []:
+          self._put_state(state)
+        self._states_loaded = True
       return result
     except Exception as e:
       logger.error(f"[HA-WebSocket] Get states error: {e}")
       return {"success": False, "error": str(e)}
 
   async def get_state(self, entity_id: str) -> Dict[str, Any]:
-    """Получение состояния конкретной сущности"""
+    """Получение состояния конкретной сущности (из зеркала состояний)"""
     try:
-      command = {
-        'type': 'get_states'
-      }
-      result = await self._send_command(command)
-
-      if result.get('success'):
-        states = result.get('result', [])
-        for state in states:
-          if state.get('entity_id') == entity_id:
-            return {"success": True, "data": state}
-        return {"success": False, "error": "Entity not found"}
-      else:
-        return result
+      if not self._states_loaded:
+        result = await self._load_states()
+        if not result.get('success'):
+          return result
+      state = self._states.get(entity_id)
+      if state is not None:
+        return {"success": True, "data": state}
+      return {"success": False, "error": "Entity not found"}
     except Exception as e:
       logger.error(f"[HA-WebSocket] Get state error: {e}")
       return {"success": False, "error": str(e)}
 
+  async def _load_states(self) -> Dict[str, Any]:
+    """Один get_states на всех одновременно ожидающих загрузки зеркала"""
+    if self._states_task is None or self._states_task.done():
+      self._states_task = asyncio.create_task(self.get_states())
+    return await asyncio.shield(self._states_task)
+
+  def _put_state(self, state: Dict[str, Any]):
+    """Запись в зеркало; более старое состояние не заменяет новое"""
+    entity_id = state.get('entity_id')
+    if not entity_id:
+      return
+    known = self._states.get(entity_id)
+    if known is None or (state.get('last_updated') or '') >= (known.get('last_updated') or ''):
+      self._states[entity_id] = state
+
   async def call_service(self, domain: str, service: str, entity_id: str = None, **kwargs) -> Dict[str, Any]:
     """Вызов сервиса Home Assistant"""
     try:
@@ -956,16 +1098,16 @@ class HomeAssistantWebSocket:
       if attributes:
         data["attributes"] = attributes
 
-      async with aiohttp.ClientSession() as session:
-        async with session.post(api_url, headers=headers, json=data) as response:
-          if response.status in [200, 201]:
-            result = await response.json()
-            logger.info(f"[HA-WebSocket] States API: State changed in UI")
-            return {"success": True, "data": result, "method": "states_api"}
-          else:
-            error_text = await response.text()
-            logger.error(f"[HA-WebSocket] States API: HTTP {response.status}")
-            return {"success": False, "error": f"HTTP {response.status}: {error_text}", "method": "states_api"}
+      session = self.http_session()
+      async with session.post(api_url, headers=headers, json=data) as response:
+        if response.status in [200, 201]:
+          result = await response.json()
+          logger.info(f"[HA-WebSocket] States API: State changed in UI")
+          return {"success": True, "data": result, "method": "states_api"}
+        else:
+          error_text = await response.text()
+          logger.error(f"[HA-WebSocket] States API: HTTP {response.status}")
+          return {"success": False, "error": f"HTTP {response.status}: {error_text}", "method": "states_api"}
 
     except Exception as e:
       logger.error(f"[HA-WebSocket] States API: {e}")
@@ -991,16 +1133,16 @@ class HomeAssistantWebSocket:
       if attributes:
         data.update(attributes)
 
-      async with aiohttp.ClientSession() as session:
-        async with session.post(api_url, headers=headers, json=data) as response:
-          if response.status in [200, 201]:
-            result = await response.json()
-            logger.info(f"[HA-WebSocket] Services API: Command sent to device")
-            return {"success": True, "data": result, "method": "services_api"}
-          else:
-            error_text = await response.text()
-            logger.error(f"[HA-WebSocket] Services API: HTTP {response.status}")
-            return {"success": False, "error": f"HTTP {response.status}: {error_text}", "method": "services_api"}
+      session = self.http_session()
+      async with session.post(api_url, headers=headers, json=data) as response:
+        if response.status in [200, 201]:
+          result = await response.json()
+          logger.info(f"[HA-WebSocket] Services API: Command sent to device")
+          return {"success": True, "data": result, "method": "services_api"}
+        else:
+          error_text = await response.text()
+          logger.error(f"[HA-WebSocket] Services API: HTTP {response.status}")
+          return {"success": False, "error": f"HTTP {response.status}: {error_text}", "method": "services_api"}
 
     except Exception as e:
       logger.error(f"[HA-WebSocket] Services API: {e}")
@@ -1009,32 +1151,8 @@ class HomeAssistantWebSocket:
   async def create_port(self, port_config: PortConfig) -> Dict[str, Any]:
     """Создание порта в Home Assistant через REST API"""
     try:
-      # Формируем атрибуты
-      attributes = {
-        'friendly_name': port_config.name,
-        'enabled_by_default': port_config.enabled_by_default,
-        'force_update': port_config.force_update,
-        'custom_component': 'my_home_addon',
-        'source': 'websocket_client'
-      }
-
-      if port_config.device_class:
-        attributes['device_class'] = port_config.device_class
-      if port_config.unit_of_measurement:
-        attributes['unit_of_measurement'] = port_config.unit_of_measurement
-      if port_config.icon:
-        attributes['icon'] = port_config.icon
-      if port_config.state_class:
-        attributes['state_class'] = port_config.state_class
-      if port_config.entity_category:
-        attributes['entity_category'] = port_config.entity_category
-      if port_config.suggested_display_precision:
-        attributes['suggested_display_precision'] = port_config.suggested_display_precision
-      if port_config.attributes:
-        attributes.update(port_config.attributes)
-
       # Создаем сущность через REST API
-      result = await self._create_entity_via_rest(port_config.entity_id, "unknown", attributes)
+      result = await self._create_entity_via_rest(port_config.entity_id, "unknown", port_config.to_attributes())
 
       if result.get('success'):
         # Добавляем в список кастомных портов
@@ -1066,16 +1184,16 @@ class HomeAssistantWebSocket:
         "attributes": attributes
       }
 
-      async with aiohttp.ClientSession() as session:
-        async with session.post(api_url, headers=headers, json=data) as response:
-          if response.status in [200, 201]:
-            result = await response.json()
-            logger.info(f"[HA-WebSocket] REST API: Entity created successfully")
-            return {"success": True, "data": result, "method": "rest_api"}
-          else:
-            error_text = await response.text()
-            logger.error(f"[HA-WebSocket] REST API: HTTP {response.status}")
-            return {"success": False, "error": f"HTTP {response.status}: {error_text}", "method": "rest_api"}
+      session = self.http_session()
+      async with session.post(api_url, headers=headers, json=data) as response:
+        if response.status in [200, 201]:
+          result = await response.json()
+          logger.info(f"[HA-WebSocket] REST API: Entity created successfully")
+          return {"success": True, "data": result, "method": "rest_api"}
+        else:
+          error_text = await response.text()
+          logger.error(f"[HA-WebSocket] REST API: HTTP {response.status}")
+          return {"success": False, "error": f"HTTP {response.status}: {error_text}", "method": "rest_api"}
 
     except Exception as e:
       logger.error(f"[HA-WebSocket] REST API: {e}")
@@ -1094,39 +1212,39 @@ class HomeAssistantWebSocket:
       }
 
       # Проверяем, существует ли сущность
-      async with aiohttp.ClientSession() as session:
-        async with session.get(api_url, headers=headers) as response:
-          if response.status == 404:
-            # Сущность не существует
-            logger.info(f"[HA-WebSocket] Entity {entity_id} does not exist")
-            if entity_id in self.custom_ports:
-              self.custom_ports.remove(entity_id)
-            return {"success": True, "message": f"Entity {entity_id} does not exist"}
-          elif response.status == 200:
-            # Сущность существует - удаляем через entity registry
-            registry_url = f"{ha_url}/api/config/entity_registry/remove"
-            registry_data = {"entity_id": entity_id}
-
-            try:
-              async with aiohttp.ClientSession() as reg_session:
-                async with reg_session.post(registry_url, headers=headers, json=registry_data) as reg_response:
-                  if reg_response.status in [200, 201, 204]:
-                    logger.info(f"[HA-WebSocket] Entity {entity_id} removed successfully")
-                    if entity_id in self.custom_ports:
-                      self.custom_ports.remove(entity_id)
-                    return {"success": True, "message": f"Entity {entity_id} deleted successfully"}
-                  else:
-                    error_text = await reg_response.text()
-                    logger.error(f"[HA-WebSocket] Entity registry removal failed: HTTP {reg_response.status}")
-                    # Fallback: mark as unavailable
-                    return {"success": False, "error": f"HTTP {reg_response.status}: {error_text}"}
-            except Exception as reg_error:
-              logger.error(f"[HA-WebSocket] Entity registry error: {reg_error}")
-              return {"success": False, "error": str(reg_error)}
-          else:
-            error_text = await response.text()
-            logger.error(f"[HA-WebSocket] Get entity failed: HTTP {response.status}")
-            return {"success": False, "error": f"HTTP {response.status}: {error_text}"}
+      session = self.http_session()
+      async with session.get(api_url, headers=headers) as response:
+        if response.status == 404:
+          # Сущность не существует
+          logger.info(f"[HA-WebSocket] Entity {entity_id} does not exist")
+          if entity_id in self.custom_ports:
+            self.custom_ports.remove(entity_id)
+          return {"success": True, "message": f"Entity {entity_id} does not exist"}
+        elif response.status == 200:
+          # Сущность существует - удаляем через entity registry
+          registry_url = f"{ha_url}/api/config/entity_registry/remove"
+          registry_data = {"entity_id": entity_id}
+
+          try:
+            reg_session = self.http_session()
+            async with reg_session.post(registry_url, headers=headers, json=registry_data) as reg_response:
+              if reg_response.status in [200, 201, 204]:
+                logger.info(f"[HA-WebSocket] Entity {entity_id} removed successfully")
+                if entity_id in self.custom_ports:
+                  self.custom_ports.remove(entity_id)
+                return {"success": True, "message": f"Entity {entity_id} deleted successfully"}
+              else:
+                error_text = await reg_response.text()
+                logger.error(f"[HA-WebSocket] Entity registry removal failed: HTTP {reg_response.status}")
+                # Fallback: mark as unavailable
+                return {"success": False, "error": f"HTTP {reg_response.status}: {error_text}"}
+          except Exception as reg_error:
+            logger.error(f"[HA-WebSocket] Entity registry error: {reg_error}")
+            return {"success": False, "error": str(reg_error)}
+        else:
+          error_text = await response.text()
+          logger.error(f"[HA-WebSocket] Get entity failed: HTTP {response.status}")
+          return {"success": False, "error": f"HTTP {response.status}: {error_text}"}
 
     except Exception as e:
       logger.error(f"[HA-WebSocket] Delete port error: {e}")
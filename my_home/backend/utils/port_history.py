@@ -0,0 +1,183 @@
+"""
+История значений портов в памяти процесса.
+
+Для каждого порта (device_id, code) — кольцевой буфер на array('d'):
+метка времени + числовое значение (16 байт на точку). Буфер ограничен
+количеством точек (max_points) и возрастом (max_age_sec); общий объем
+ограничен max_total_points — новые порты сверх лимита не отслеживаются.
+Графики получают историю из памяти без обращения к БД или HA.
+"""
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.configs import config
+
+
+class PortRingBuffer:
+  """Кольцевой буфер (timestamp, value) фиксированной емкости"""
+
+  __slots__ = ('capacity', '_ts', '_values', '_start', '_size')
+
+  def __init__(self, capacity: int):
+    self.capacity = capacity
+    self._ts = array('d', bytes(8 * capacity))
+    self._values = array('d', bytes(8 * capacity))
+    self._start = 0
+    self._size = 0
+
+  def __len__(self) -> int:
+    return self._size
+
+  def append(self, ts: float, value: float):
+    if self._size < self.capacity:
+      index = (self._start + self._size) % self.capacity
+      self._size += 1
+    else:
+      # Буфер заполнен — перезаписываем самую старую точку
+      index = self._start
+      self._start = (self._start + 1) % self.capacity
+    self._ts[index] = ts
+    self._values[index] = value
+
+  def trim(self, min_ts: float):
+    """Удаляет точки старше min_ts"""
+    while self._size and self._ts[self._start] < min_ts:
+      self._start = (self._start + 1) % self.capacity
+      self._size -= 1
+
+  def _ts_at(self, position: int) -> float:
+    return self._ts[(self._start + position) % self.capacity]
+
+  def points(self, since: Optional[float] = None) -> List[Tuple[float, float]]:
+    """Точки в хронологическом порядке, начиная с since (бинарный поиск)"""
+    low = 0
+    if since is not None:
+      high = self._size
+      while low < high:
+        middle = (low + high) // 2
+        if self._ts_at(middle) < since:
+          low = middle + 1
+        else:
+          high = middle
+    result = []
+    for position in range(low, self._size):
+      index = (self._start + position) % self.capacity
+      result.append((self._ts[index], self._values[index]))
+    return result
+
+
+class PortHistory:
+  """Кольцевые буферы истории по всем портам"""
+
+  def __init__(self, max_points: int = 1000, max_age_sec: int = 86400, max_total_points: int = 500000):
+    self.max_points = max(1, max_points)
+    self.max_age_sec = max_age_sec
+    self.max_total_points = max_total_points
+    self._buffers: Dict[Tuple[int, str], PortRingBuffer] = {}
+
+    self.stats = {
+      'points_added': 0,
+      'non_numeric': 0,  # значения, которые не сохраняются (текст и т.п.)
+      'rejected_ports': 0,  # портов не отслеживается из-за лимита памяти
+    }
+    self._rejected = set()
+
+  @classmethod
+  def from_config(cls) -> "PortHistory":
+    params = config['port_history'] or {}
+    return cls(
+      max_points=int(params.get('max_points', 1000)),
+      max_age_sec=int(params.get('max_age_sec', 86400)),
+      max_total_points=int(params.get('max_total_points', 500000)),
+    )
+
+  def add(self, device_id: int, code: str, value: Any, ts: Optional[float] = None):
+    """Добавляет числовое значение порта (остальные пропускаются)"""
+    if isinstance(value, bool):
+      value = float(value)
+    elif not isinstance(value, (int, float)):
+      self.stats['non_numeric'] += 1
+      return
+
+    key = (device_id, code)
+    buffer = self._buffers.get(key)
+    if buffer is None:
+      if key in self._rejected:
+        return
+      if (len(self._buffers) + 1) * self.max_points > self.max_total_points:
+        self._rejected.add(key)
+        self.stats['rejected_ports'] += 1
+        return
+      buffer = self._buffers[key] = PortRingBuffer(self.max_points)
+
+    now = time.time() if ts is None else ts
+    buffer.append(now, float(value))
+    if self.max_age_sec:
+      buffer.trim(now - self.max_age_sec)
+    self.stats['points_added'] += 1
+
+  def get(
+      self,
+      device_id: int,
+      code: str,
+      since: Optional[float] = None,
+      max_points: Optional[int] = None,
+  ) -> Dict[str, Any]:
+    """История порта с необязательным прореживанием до max_points точек"""
+    buffer = self._buffers.get((device_id, code))
+    if buffer is None:
+      points = []
+    else:
+      if self.max_age_sec:
+        buffer.trim(time.time() - self.max_age_sec)
+      points = buffer.points(since)
+
+    total = len(points)
+    downsampled = bool(max_points and 0 < max_points < total)
+    if downsampled:
+      points = self._downsample(points, max_points)
+    return {
+      'device_id': device_id,
+      'code': code,
+      'total': total,
+      'count': len(points),
+      'downsampled': downsampled,
+      'points': [[round(ts, 3), value] for ts, value in points],
+    }
+
+  def forget_device(self, device_id: int):
+    for key in [key for key in self._buffers if key[0] == device_id]:
+      del self._buffers[key]
+    self._rejected = {key for key in self._rejected if key[0] != device_id}
+
+  def get_stats(self) -> Dict[str, Any]:
+    points = sum(len(buffer) for buffer in self._buffers.values())
+    return {
+      **self.stats,
+      'ports': len(self._buffers),
+      'points': points,
+      'allocated_points': len(self._buffers) * self.max_points,
+      'memory_bytes': len(self._buffers) * self.max_points * 16,
+      'max_points': self.max_points,
+      'max_age_sec': self.max_age_sec,
+      'max_total_points': self.max_total_points,
+    }
+
+  @staticmethod
+  def _downsample(points: List[Tuple[float, float]], max_points: int) -> List[Tuple[float, float]]:
+    """Прореживание усреднением по равным корзинам"""
+    result = []
+    bucket_size = len(points) / max_points
+    for bucket in range(max_points):
+      start = int(bucket * bucket_size)
+      end = max(int((bucket + 1) * bucket_size), start + 1)
+      chunk = points[start:end]
+      result.append((
+        sum(ts for ts, _ in chunk) / len(chunk),
+        sum(value for _, value in chunk) / len(chunk),
+      ))
+    return result
+
+
+port_history = PortHistory.from_config()
@@ -0,0 +1,213 @@
+"""
+Реестр портов в памяти процесса.
+
+Ключ — (device_id, code). Для каждого порта хранится id строки в БД, тип (kind)
+для ValueMapper, направление, флаг публикации в HA и entity_id.
+Реестр загружается один раз при старте и перезагружается точечно (по устройству)
+при изменении портов через API, поэтому горячий путь обработки значений
+от устройств не выполняет SQL-запросов.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from db_models.devices import Devices
+from db_models.ports import Ports
+from utils.configs import config
+from utils.db_utils import db_session
+from utils.logger import db_logger as logger
+
+
+class PortRegistry:
+  """Индекс (device_id, code) → информация о порте"""
+
+  # Пауза перед повторной загрузкой после ошибки (сек), удваивается до максимума
+  retry_min_sec = 1.0
+  retry_max_sec = 60.0
+
+  def __init__(self):
+    self._ports: Dict[Tuple[int, str], Dict[str, Any]] = {}
+    self._lock = threading.RLock()
+    self.loaded_at: Optional[datetime] = None
+    self._retry_at = 0.0
+    self._retry_delay = 0.0
+    self.stats = {
+      'hits': 0,
+      'misses': 0,
+      'full_reloads': 0,
+      'device_reloads': 0,
+      'load_errors': 0,
+    }
+
+  @property
+  def loaded(self) -> bool:
+    return self.loaded_at is not None
+
+  # === загрузка ===
+  def load(self):
+    """Полная загрузка реестра из БД (один запрос с join)"""
+    try:
+      with db_session() as db:
+        rows = (
+          db.query(Ports, Devices.name)
+          .join(Devices, Ports.device_id == Devices.id)
+          .all()
+        )
+        ports = {(port.device_id, port.code): self._make_entry(port, device_name) for port, device_name in rows}
+    except Exception as e:
+      # Следующая попытка из горячего пути — не раньше чем через retry_delay
+      self._retry_delay = min(max(self._retry_delay * 2, self.retry_min_sec), self.retry_max_sec)
+      self._retry_at = time.monotonic() + self._retry_delay
+      self.stats['load_errors'] += 1
+      logger.error(f"PortRegistry load error (retry in {self._retry_delay:.0f}s): {e}")
+      return
+
+    with self._lock:
+      # Сохраняем данные, полученные от устройства в runtime (kind/direction из /values)
+      for key, entry in ports.items():
+        self._keep_runtime(entry, self._ports.get(key))
+      removed = [key for key in self._ports if key not in ports]
+      self._ports = ports
+      self.loaded_at = datetime.now()
+      self._retry_delay = 0.0
+      self.stats['full_reloads'] += 1
+    self._notify_removed(removed)
+    logger.info(f"PortRegistry loaded: {len(ports)} ports")
+
+  def reload_device(self, device_id: int):
+    """Перезагрузка портов одного устройства"""
+    try:
+      with db_session() as db:
+        rows = (
+          db.query(Ports, Devices.name)
+          .join(Devices, Ports.device_id == Devices.id)
+          .filter(Ports.device_id == device_id)
+          .all()
+        )
+        ports = {(port.device_id, port.code): self._make_entry(port, device_name) for port, device_name in rows}
+    except Exception as e:
+      logger.error(f"PortRegistry reload error for device {device_id}: {e}")
+      return
+
+    with self._lock:
+      new_index = {key: value for key, value in self._ports.items() if key[0] != device_id}
+      for key, entry in ports.items():
+        self._keep_runtime(entry, self._ports.get(key))
+        new_index[key] = entry
+      removed = [key for key in self._ports if key[0] == device_id and key not in ports]
+      self._ports = new_index
+      self.stats['device_reloads'] += 1
+    self._notify_removed(removed)
+    logger.debug(f"PortRegistry reloaded device {device_id}: {len(ports)} ports")
+
+  def invalidate(self, device_id: Optional[int] = None):
+    """Сбрасывает данные устройства (или весь реестр) и перечитывает их из БД"""
+    if device_id is None:
+      self.load()
+    else:
+      self.reload_device(device_id)
+
+  def remove_device(self, device_id: int):
+    """Удаляет из реестра все порты устройства"""
+    with self._lock:
+      removed = [key for key in self._ports if key[0] == device_id]
+      self._ports = {key: value for key, value in self._ports.items() if key[0] != device_id}
+    self._notify_removed(removed)
+
+  # === чтение ===
+  def get(self, device_id: int, code: str) -> Optional[Dict[str, Any]]:
+    """O(1) поиск порта по (device_id, code)"""
+    if not self.loaded and time.monotonic() >= self._retry_at:
+      self.load()
+    entry = self._ports.get((device_id, code))
+    if entry is None:
+      self.stats['misses'] += 1
+    else:
+      self.stats['hits'] += 1
+    return entry
+
+  def get_port_id(self, device_id: int, code: str) -> Optional[int]:
+    entry = self.get(device_id, code)
+    return entry['id'] if entry else None
+
+  def find_by_code(self, code: str) -> Optional[Dict[str, Any]]:
+    """Поиск порта только по коду (первое совпадение), для вызовов без device_id"""
+    for (device_id, port_code), entry in self._ports.items():
+      if port_code == code:
+        return entry
+    return None
+
+  def get_device_ports(self, device_id: int) -> List[Dict[str, Any]]:
+    return [entry for (entry_device_id, _), entry in self._ports.items() if entry_device_id == device_id]
+
+  def get_published(self) -> List[Dict[str, Any]]:
+    return [entry for entry in self._ports.values() if entry['published']]
+
+  # === обновление ===
+  def set_published(self, device_id: int, code: str, published: bool, entity_id: str = ''):
+    """Обновляет флаг публикации и entity_id порта (вызывается из AppConfig)"""
+    entry = self._ports.get((device_id, code))
+    if entry is None:
+      return
+    with self._lock:
+      self._ports[(device_id, code)] = {**entry, 'published': published, 'entity_id': entity_id or ''}
+
+  def update_runtime(self, device_id: int, code: str, kind: Optional[str] = None, direction: Optional[str] = None):
+    """Запоминает kind/direction, которые устройство отдает в /values"""
+    entry = self._ports.get((device_id, code))
+    if entry is None:
+      return
+    if entry.get('device_kind') == kind and entry.get('direction') == direction:
+      return
+    with self._lock:
+      self._ports[(device_id, code)] = {**entry, 'device_kind': kind, 'direction': direction}
+
+  def get_stats(self) -> Dict[str, Any]:
+    return {
+      **self.stats,
+      'size': len(self._ports),
+      'loaded_at': self.loaded_at.isoformat() if self.loaded_at else None,
+    }
+
+  # === вспомогательные ===
+  @staticmethod
+  def _make_entry(port: Ports, device_name: str) -> Dict[str, Any]:
+    ha_config = config['homeassistant'] or {}
+    published_ports = ha_config.get('published_ports', {}).get(str(port.device_id), [])
+    entity_id = ha_config.get('port_entities', {}).get(f"{port.device_id}:{port.code}", '')
+    return {
+      'id': port.id,
+      'device_id': port.device_id,
+      'port_code': port.code,
+      'code': port.code,
+      'name': port.name,
+      'port_name': port.name,
+      'device_name': device_name,
+      'port_type': port.type,
+      'kind': port.type or 'unknown',  # для ValueMapper (как в HomeAssistantManager._normalize_port_data)
+      'device_kind': None,
+      'direction': None,
+      'unit': port.unit,
+      'params': dict(port.params or {}),
+      'published': port.code in published_ports,
+      'entity_id': entity_id,
+    }
+
+  @staticmethod
+  def _notify_removed(keys: List[Tuple[int, str]]):
+    """Удаленные порты больше не нужны в таблице ссылок компактного кодирования WS"""
+    if not keys:
+      return
+    from utils.socket_utils import connection_manager
+    # Вызывается и из CRUD-хуков в пуле потоков FastAPI — передаем в loop сервера
+    connection_manager.forget_ports_threadsafe(keys)
+
+  @staticmethod
+  def _keep_runtime(entry: Dict[str, Any], old_entry: Optional[Dict[str, Any]]):
+    if old_entry:
+      entry['device_kind'] = old_entry.get('device_kind')
+      entry['direction'] = old_entry.get('direction')
+
+
+port_registry = PortRegistry()
@@ -0,0 +1,153 @@
+"""
+Отложенная (write-behind) запись значений портов в базу данных.
+
+Значения, пришедшие от устройств по WebSocket, не пишутся в БД на каждый кадр:
+в памяти хранится только последнее значение по ключу (device_id, code),
+а раз в flush_interval_ms (или при накоплении max_batch_size записей)
+всё накопленное сбрасывается одним пакетным UPDATE.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+from sqlalchemy import text
+
+from utils.configs import config
+from utils.db_utils import db_session
+from utils.logger import db_logger as logger
+
+
+class PortValuesWriter:
+  """Буфер последних значений портов с пакетной записью в БД"""
+
+  _update_port_sql = text(
+    "UPDATE ports SET last_value = :value WHERE device_id = :device_id AND code = :code"
+  )
+
+  def __init__(self, flush_interval_ms: int = 1000, max_batch_size: int = 500):
+    self.flush_interval_ms = flush_interval_ms
+    self.max_batch_size = max_batch_size
+
+    self._values: Dict[Tuple[int, str], Any] = {}  # (device_id, code) → последнее значение
+    self._lock = threading.Lock()
+    self._flush_lock = threading.Lock()
+    self._wakeup = threading.Event()
+    self._stop_event = threading.Event()
+    self._thread = None
+
+    self.stats = {
+      'queued': 0,  # всего принято значений
+      'coalesced': 0,  # значений, перезаписанных более новыми до сброса
+      'flushed_rows': 0,  # строк записано в БД
+      'flushes': 0,  # количество пакетных сбросов
+      'errors': 0,
+      'last_flush_ms': 0.0,
+      'last_flush_at': None,
+    }
+
+  @classmethod
+  def from_config(cls) -> "PortValuesWriter":
+    """Создает writer с параметрами из секции port_values конфигурации"""
+    params = config['port_values'] or {}
+    return cls(
+      flush_interval_ms=int(params.get('flush_interval_ms', 1000)),
+      max_batch_size=int(params.get('max_batch_size', 500)),
+    )
+
+  @property
+  def pending(self) -> int:
+    """Количество строк, ожидающих записи"""
+    return len(self._values)
+
+  def start(self):
+    """Запускает фоновый поток периодического сброса"""
+    if self._thread and self._thread.is_alive():
+      return
+    self._stop_event.clear()
+    self._thread = threading.Thread(target=self._run, name="PortValuesWriter", daemon=True)
+    self._thread.start()
+    logger.info(f"PortValuesWriter started (interval {self.flush_interval_ms} ms, batch {self.max_batch_size})")
+
+  def stop(self):
+    """Останавливает поток и сбрасывает оставшиеся значения в БД"""
+    self._stop_event.set()
+    self._wakeup.set()
+    if self._thread and self._thread.is_alive():
+      self._thread.join(timeout=5)
+    self._thread = None
+    self.flush()
+    logger.info(f"PortValuesWriter stopped, flushed rows total: {self.stats['flushed_rows']}")
+
+  def put(self, device_id: int, code: str, value: Any):
+    """Запоминает последнее значение порта (без обращения к БД)"""
+    key = (device_id, code)
+    with self._lock:
+      if key in self._values:
+        self.stats['coalesced'] += 1
+      self._values[key] = None if value is None else str(value)
+      self.stats['queued'] += 1
+      need_flush = len(self._values) >= self.max_batch_size
+
+    if not self._thread:
+      self.start()
+    if need_flush:
+      self._wakeup.set()
+
+  def flush(self) -> int:
+    """Сбрасывает накопленные значения в БД одним пакетом, возвращает число строк"""
+    with self._flush_lock:
+      with self._lock:
+        values, self._values = self._values, {}
+
+      if not values:
+        return 0
+
+      port_rows = [
+        {'device_id': device_id, 'code': code, 'value': value}
+        for (device_id, code), value in values.items()
+      ]
+
+      started = time.perf_counter()
+      try:
+        with db_session() as db:
+          db.execute(self._update_port_sql, port_rows)
+          db.commit()
+      except Exception as e:
+        self.stats['errors'] += 1
+        logger.error(f"PortValuesWriter flush error: {e}")
+        # Возвращаем значения в буфер, не затирая более свежие
+        with self._lock:
+          for key, value in values.items():
+            self._values.setdefault(key, value)
+        return 0
+
+      rows = len(port_rows)
+      self.stats['flushed_rows'] += rows
+      self.stats['flushes'] += 1
+      self.stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+      self.stats['last_flush_at'] = datetime.now()
+      logger.debug(f"PortValuesWriter flushed {rows} ports in {self.stats['last_flush_ms']} ms")
+      return rows
+
+  def get_stats(self) -> dict:
+    """Счетчики для диагностики"""
+    return {
+      **self.stats,
+      'pending': self.pending,
+      'flush_interval_ms': self.flush_interval_ms,
+      'max_batch_size': self.max_batch_size,
+      'running': bool(self._thread and self._thread.is_alive()),
+    }
+
+  def _run(self):
+    while not self._stop_event.is_set():
+      self._wakeup.wait(self.flush_interval_ms / 1000)
+      self._wakeup.clear()
+      try:
+        self.flush()
+      except Exception as e:
+        logger.error(f"PortValuesWriter loop error: {e}")
+
+
+port_values_writer = PortValuesWriter.from_config()
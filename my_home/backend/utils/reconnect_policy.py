@@ -0,0 +1,111 @@
+"""
+Политика переподключения клиентов устройств MyHome.
+
+После перезагрузки точки доступа все клиенты теряют связь одновременно.
+Чтобы они не переподключались синхронно каждые N секунд:
+- задержка растет экспоненциально (base_delay * 2^(attempt-1), не больше max_delay)
+  и размывается случайным jitter;
+- одновременных bootstrap-ов (GET /values + открытие WS) не больше
+  max_concurrent_bootstraps на event loop супервизора.
+"""
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from utils.configs import config
+
+
+class ReconnectPolicy:
+  """Экспоненциальная задержка с jitter и ограничение параллельных bootstrap-ов"""
+
+  def __init__(
+      self,
+      base_delay: float = 1.0,
+      max_delay: float = 60.0,
+      jitter: float = 0.5,
+      stable_sec: float = 30.0,
+      max_concurrent_bootstraps: int = 4,
+  ):
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.jitter = min(max(jitter, 0.0), 1.0)
+    self.stable_sec = stable_sec  # соединение, продержавшееся дольше, сбрасывает счетчик попыток
+    self.max_concurrent_bootstraps = max(1, max_concurrent_bootstraps)
+
+    # asyncio.Semaphore привязан к loop, поэтому у каждого loop супервизора свой
+    self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+    self._in_flight = 0
+
+    self.stats = {
+      'attempts': 0,  # попыток bootstrap (включая первое подключение)
+      'successes': 0,
+      'failures': 0,
+      'bootstrap_waits': 0,  # попыток, ждавших свободного слота
+      'max_wait_ms': 0.0,
+      'max_delay_used': 0.0,
+    }
+
+  @classmethod
+  def from_config(cls) -> "ReconnectPolicy":
+    params = config['device_reconnect'] or {}
+    return cls(
+      base_delay=float(params.get('base_delay', 1.0)),
+      max_delay=float(params.get('max_delay', 60.0)),
+      jitter=float(params.get('jitter', 0.5)),
+      stable_sec=float(params.get('stable_sec', 30.0)),
+      max_concurrent_bootstraps=int(params.get('max_concurrent_bootstraps', 4)),
+    )
+
+  def delay(self, attempt: int, base_delay: Optional[float] = None) -> float:
+    """Задержка перед попыткой номер attempt (1, 2, ...)"""
+    base = self.base_delay if base_delay is None else base_delay
+    delay = min(self.max_delay, base * (2 ** max(attempt - 1, 0)))
+    # jitter=0.5 → задержка равномерно в [delay/2, delay]
+    delay *= 1 - self.jitter * random.random()
+    self.stats['max_delay_used'] = max(self.stats['max_delay_used'], round(delay, 2))
+    return delay
+
+  @asynccontextmanager
+  async def bootstrap(self):
+    """Слот для bootstrap устройства: не больше max_concurrent_bootstraps одновременно"""
+    semaphore = self._get_semaphore()
+    self.stats['attempts'] += 1
+    if semaphore.locked():
+      self.stats['bootstrap_waits'] += 1
+    started = time.perf_counter()
+    async with semaphore:
+      wait_ms = (time.perf_counter() - started) * 1000
+      self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], round(wait_ms, 2))
+      self._in_flight += 1
+      try:
+        yield
+      except BaseException:
+        self.stats['failures'] += 1
+        raise
+      else:
+        self.stats['successes'] += 1
+      finally:
+        self._in_flight -= 1
+
+  def get_stats(self) -> Dict[str, Any]:
+    return {
+      **self.stats,
+      'in_flight': self._in_flight,
+      'base_delay': self.base_delay,
+      'max_delay': self.max_delay,
+      'jitter': self.jitter,
+      'max_concurrent_bootstraps': self.max_concurrent_bootstraps,
+    }
+
+  def _get_semaphore(self) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = self._semaphores.get(loop)
+    if semaphore is None:
+      semaphore = asyncio.Semaphore(self.max_concurrent_bootstraps)
+      self._semaphores[loop] = semaphore
+    return semaphore
+
+
+reconnect_policy = ReconnectPolicy.from_config()
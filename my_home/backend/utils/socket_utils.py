@@ -1,11 +1,15 @@
-from fastapi import WebSocket, WebSocketDisconnect
-from typing import List
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Any, Dict, List, Optional, Set
+from collections import deque
 import asyncio
 
 from datetime import datetime
 import json
+import time
 from utils.logs import log_print
 from utils.logger import api_logger as logger
+from utils.configs import config
+from utils.event_dispatcher import event_dispatcher
 import threading
 
 
@@ -17,35 +21,330 @@ def serialize_datetime(obj):
   raise TypeError("Type not serializable")
 
 
+# Порядок полей компактных кадров (отправляется клиенту при согласовании кодирования)
+COMPACT_SCHEMA = {
+  "d": ["ref", "device_id", "code", "pin_id", "direction", "kind"],  # определение порта
+  "p": ["seq", "ref", "value", "value_raw", "ts"],  # обновление порта
+  "b": ["seq", "ts", [["ref", "value", "value_raw", "ts"]]],  # пакет обновлений (port.batch)
+}
+
+
+def _compact_dumps(data) -> str:
+  return json.dumps(data, separators=(',', ':'), default=serialize_datetime)
+
+
+class EventLog:
+  """
+  Кольцевой буфер событий рассылки с монотонными номерами (seq).
+  Позиция события в буфере — seq % capacity, поэтому поиск по seq O(1).
+  """
+
+  def __init__(self, capacity: int = 10000):
+    self.capacity = max(1, capacity)
+    self._events: List[Optional[tuple]] = [None] * self.capacity
+    self.last_seq = 0
+
+  @property
+  def oldest_seq(self) -> int:
+    return max(1, self.last_seq - self.capacity + 1) if self.last_seq else 0
+
+  def append(self, data: dict) -> int:
+    self.last_seq += 1
+    self._events[self.last_seq % self.capacity] = (self.last_seq, data)
+    return self.last_seq
+
+  def after(self, after_seq: int, limit: int = 100, device_id: Optional[int] = None) -> List[dict]:
+    """События с seq > after_seq (не больше limit), опционально по одному устройству"""
+    result = []
+    seq = max(after_seq + 1, self.oldest_seq)
+    while seq <= self.last_seq and len(result) < limit:
+      item = self._events[seq % self.capacity]
+      if item is not None and item[0] == seq:
+        data = item[1]
+        if device_id is None or _message_device_id(data) == device_id:
+          result.append(data)
+      seq += 1
+    return result
+
+  def is_available(self, after_seq: int) -> bool:
+    """Можно ли продолжить с after_seq без потерь"""
+    return after_seq >= self.oldest_seq - 1
+
+
+def _percentiles(samples) -> Dict[str, Optional[float]]:
+  """p50/p95/p99/max по выборке задержек (мс)"""
+  if not samples:
+    return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+  ordered = sorted(samples)
+  last = len(ordered) - 1
+  return {
+    'p50': round(ordered[int(last * 0.5)], 2),
+    'p95': round(ordered[int(last * 0.95)], 2),
+    'p99': round(ordered[int(last * 0.99)], 2),
+    'max': round(ordered[-1], 2),
+  }
+
+
+def _message_device_id(data) -> Optional[int]:
+  if not isinstance(data, dict):
+    return None
+  device_id = data.get('device_id')
+  if device_id is None and isinstance(data.get('data'), dict):
+    device_id = data['data'].get('device_id')
+  return device_id
+
+
+class ClientConnection:
+  """
+  Подключенный браузер: ограниченная очередь уже сериализованных сообщений
+  и отдельная задача-писатель в loop, которому принадлежит WebSocket.
+  Медленный клиент задерживает только свою очередь, а не рассылку остальным.
+  В очереди хранится (текст, время постановки) — для задержки доставки.
+  """
+
+  def __init__(self, manager: "ConnectionManager", websocket: WebSocket, loop: asyncio.AbstractEventLoop):
+    self.manager = manager
+    self.websocket = websocket
+    self.loop = loop
+    self.id = manager.next_client_id()
+    self.host = websocket.client.host if websocket.client else None
+    self.queue = deque()
+    self.closed = False
+    self.sent = 0
+    self.bytes_sent = 0
+    self.dropped = 0
+    self.max_queued = 0
+    self.connected_at = datetime.now()
+    self.last_send_at: Optional[datetime] = None
+    # Задержки от постановки в очередь до окончания отправки, мс (последние N)
+    self.latencies = deque(maxlen=manager.latency_samples)
+    # Фильтры подписки: None — без ограничения по этому признаку
+    self.device_ids: Optional[Set[int]] = None
+    self.types: Optional[Set[str]] = None
+    self.levels: Optional[Set[str]] = None
+    # Режим пакетной отправки портов: последнее значение по (device_id, code) за тик
+    self.batch_tick_ms: Optional[int] = None
+    # Кодирование портов: 'json' (по умолчанию) или 'compact' (позиционные массивы)
+    self.encoding = 'json'
+    self.known_port_refs: Set[int] = set()  # ссылки на порты, определения которых клиент уже получил
+    self._pending_ports: Dict[tuple, Any] = {}
+    self._pending_seq = 0
+    self._pending_lock = threading.Lock()
+    self._flush_scheduled = False
+    self._wakeup = asyncio.Event()
+    self._task = loop.create_task(self._writer())
+
+  def push(self, text: str) -> bool:
+    """Ставит сообщение в очередь (из любого потока). False — клиент отключен"""
+    if self.closed:
+      return False
+    if len(self.queue) >= self.manager.send_queue_size:
+      if self.manager.slow_consumer_policy == 'disconnect':
+        self.manager.stats['slow_disconnects'] += 1
+        logger.warning(f"WebSocket client {self.host} is too slow, disconnecting")
+        self.close()
+        return False
+      # drop_oldest: самое старое сообщение теряется, новое ставится в очередь
+      self.queue.popleft()
+      self.dropped += 1
+      self.manager.stats['dropped'] += 1
+    self.queue.append((text, time.perf_counter()))
+    self.max_queued = max(self.max_queued, len(self.queue))
+    self._notify()
+    return True
+
+  def push_port(self, key: tuple, payload: Any, seq: int = 0):
+    """Копит обновление порта до конца тика (из любого потока)"""
+    if self.closed:
+      return
+    with self._pending_lock:
+      if key in self._pending_ports:
+        self.manager.stats['coalesced'] += 1
+      self._pending_ports[key] = payload
+      self._pending_seq = max(self._pending_seq, seq)
+      schedule = not self._flush_scheduled
+      self._flush_scheduled = True
+    if schedule:
+      self._call_in_loop(self._schedule_flush)
+
+  def _schedule_flush(self):
+    self.loop.call_later((self.batch_tick_ms or 0) / 1000, self.flush_ports)
+
+  def flush_ports(self):
+    """Отправляет накопленные за тик обновления одним кадром port.batch"""
+    with self._pending_lock:
+      pending, self._pending_ports = self._pending_ports, {}
+      seq, self._pending_seq = self._pending_seq, 0
+      self._flush_scheduled = False
+    if not pending or self.closed:
+      return
+    self.manager.stats['batches'] += 1
+    if self.encoding == 'compact':
+      entries = [self.manager.compact_port_entry(self, port) for port in pending.values()]
+      self.push(_compact_dumps(["b", seq, round(datetime.now().timestamp(), 3), entries]))
+      return
+    text = json.dumps(
+      {"type": "port.batch", "seq": seq, "data": list(pending.values()), "ts": datetime.now().timestamp()},
+      default=serialize_datetime,
+    )
+    self.push(text)
+
+  def set_batch(self, enabled: bool, tick_ms: Optional[int] = None):
+    if enabled:
+      tick_ms = int(tick_ms or self.manager.default_batch_tick_ms)
+      self.batch_tick_ms = min(max(tick_ms, self.manager.min_batch_tick_ms), self.manager.max_batch_tick_ms)
+    else:
+      self.batch_tick_ms = None
+      # Накопленное не теряем
+      self._call_in_loop(self.flush_ports)
+
+  def close(self):
+    """Отключает клиента (из любого потока)"""
+    if self.closed:
+      return
+    self.closed = True
+    self.queue.clear()
+    self._call_in_loop(self._close)
+
+  def _notify(self):
+    self._call_in_loop(self._wakeup.set)
+
+  def _call_in_loop(self, callback):
+    try:
+      running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+      running_loop = None
+    if running_loop is self.loop:
+      callback()
+    elif not self.loop.is_closed():
+      self.loop.call_soon_threadsafe(callback)
+
+  def _close(self):
+    self.manager.disconnect(self.websocket)
+    self._wakeup.set()
+    self.loop.create_task(self._close_socket())
+
+  async def _close_socket(self):
+    try:
+      await self.websocket.close(code=1013)
+    except Exception:
+      pass
+
+  async def _writer(self):
+    while not self.closed:
+      await self._wakeup.wait()
+      self._wakeup.clear()
+      while self.queue and not self.closed:
+        text, queued_at = self.queue.popleft()
+        try:
+          await self.websocket.send_text(text)
+          self.sent += 1
+          self.bytes_sent += len(text)
+          self.last_send_at = datetime.now()
+          self.latencies.append((time.perf_counter() - queued_at) * 1000)
+          self.manager.stats['messages_sent'] += 1
+          self.manager.stats['bytes_sent'] += len(text)
+        except WebSocketDisconnect:
+          logger.info(f"WebSocket disconnecting from {self.host}")
+          self.close()
+        except Exception as e:
+          self.manager.stats['send_errors'] += 1
+          logger.error(f"Error sending to client: {e}")
+          self.close()
+
+  def accepts(self, message_type: Optional[str], level: Optional[str]) -> bool:
+    """Проверка типа сообщения и уровня лога (device_id проверяется индексом)"""
+    if self.types is not None and message_type not in self.types:
+      return False
+    if self.levels is not None and level is not None and level not in self.levels:
+      return False
+    return True
+
+  @property
+  def subscription(self) -> Dict[str, Any]:
+    return {
+      'device_ids': sorted(self.device_ids) if self.device_ids is not None else None,
+      'types': sorted(self.types) if self.types is not None else None,
+      'levels': sorted(self.levels) if self.levels is not None else None,
+    }
+
+  def get_stats(self) -> dict:
+    return {
+      'id': self.id,
+      'host': self.host,
+      'subscription': self.subscription,
+      'batch_tick_ms': self.batch_tick_ms,
+      'encoding': self.encoding,
+      'queued': len(self.queue),
+      'max_queued': self.max_queued,
+      'sent': self.sent,
+      'bytes_sent': self.bytes_sent,
+      'dropped': self.dropped,
+      'latency_ms': _percentiles(self.latencies),
+      'connected_at': self.connected_at.isoformat(),
+      'connected_sec': round((datetime.now() - self.connected_at).total_seconds(), 1),
+      'last_send_at': self.last_send_at.isoformat() if self.last_send_at else None,
+    }
+
+
 class ConnectionManager:
-  logs_queue = []
-  logs_history = []
   max_history = 10 ** 5
 
   def __init__(self):
     self.active_connections: List[WebSocket] = []
-    self._thread = threading.Thread(target=self._thread_main, daemon=True)
-    self._loop = None
-    self._stop_event = threading.Event()
-    self._thread.start()
-
-  def _thread_main(self):
-    asyncio.set_event_loop(asyncio.new_event_loop())
-    self._loop = asyncio.get_event_loop()
-    self._loop.create_task(self._process_queue())
-    self._loop.run_forever()
-
-  async def _process_queue(self):
-    while not self._stop_event.is_set():
-      while self.logs_queue:
-        try:
-          data, permission = self.logs_queue.pop(0)
-          self.logs_history.append((data, permission))
-          self.logs_history = self.logs_history[-self.max_history:]
-          await self.broadcast(data)
-        except Exception as e:
-          logger.error(f"Error processing item: {e}")
-      await asyncio.sleep(0.1)
+    self._clients: Dict[WebSocket, ClientConnection] = {}
+    # Индекс подписок по устройствам: device_id → клиенты; клиенты без фильтра устройств
+    self._device_index: Dict[int, Set[ClientConnection]] = {}
+    self._all_devices: Set[ClientConnection] = set()
+
+    params = config['websocket'] or {}
+    self.send_queue_size = int(params.get('send_queue_size', 1000))
+    self.slow_consumer_policy = params.get('slow_consumer_policy', 'drop_oldest')  # drop_oldest / disconnect
+    self.latency_samples = int(params.get('latency_samples', 500))
+    self._client_seq = 0
+    self.stats = {
+      'connections': 0,
+      'disconnections': 0,
+      'broadcasts': 0,
+      'messages_queued': 0,
+      'messages_sent': 0,
+      'bytes_sent': 0,
+      'bytes_encoded': 0,
+      'encodes': 0,
+      'encode_ms': 0.0,  # суммарное время сериализации рассылок
+      'max_encode_ms': 0.0,
+      'dropped': 0,
+      'slow_disconnects': 0,
+      'send_errors': 0,
+      'filtered': 0,  # доставок, отсеянных подписками
+      'batches': 0,  # отправлено кадров port.batch
+      'coalesced': 0,  # обновлений портов, замененных более новыми внутри тика
+      'replayed': 0,  # событий, досланных при переподключении
+      'resyncs': 0,  # переподключений, для которых история уже потеряна
+    }
+    self.default_batch_tick_ms = int(params.get('batch_tick_ms', 100))
+    self.min_batch_tick_ms = int(params.get('min_batch_tick_ms', 20))
+    self.max_batch_tick_ms = int(params.get('max_batch_tick_ms', 1000))
+
+    # Компактное кодирование портов: (device_id, code) → (ссылка, метаданные), ссылка → кадр определения
+    self._port_refs: Dict[tuple, tuple] = {}
+    self._port_definitions: Dict[int, str] = {}
+    self._port_ref_seq = 0
+    # Все рассылаемые события с номерами — для продолжения после переподключения
+    self.events = EventLog(int(params.get('events_history', 10000)))
+    # История логов — кольцевой буфер, добавление O(1)
+    self.logs_history = deque(maxlen=self.max_history)
+    # loop сервера (uvicorn), которому принадлежат сокеты; рассылки из других
+    # потоков передаются в него через event_dispatcher
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+  def set_loop(self, loop: asyncio.AbstractEventLoop):
+    self._loop = loop
+    event_dispatcher.set_loop(loop)
+
+  def next_client_id(self) -> int:
+    self._client_seq += 1
+    return self._client_seq
 
   async def connect(self, websocket: WebSocket):
     token = websocket.cookies.get("token")
@@ -53,23 +352,300 @@ class ConnectionManager:
     # todo check auth
 
     await websocket.accept()
+    if self._loop is None:
+      self.set_loop(asyncio.get_running_loop())
+    client = ClientConnection(self, websocket, asyncio.get_running_loop())
+    self._clients[websocket] = client
+    self._all_devices.add(client)
     self.active_connections.append(websocket)
+    self.stats['connections'] += 1
+
+    # Клиент переподключился и продолжает с известного ему номера события
+    resume_from = websocket.query_params.get('resume_from')
+    if resume_from is not None:
+      self.replay(client, resume_from)
+
+  def replay(self, client: ClientConnection, resume_from) -> int:
+    """Досылает клиенту события после resume_from (или просит полную пересинхронизацию)"""
+    try:
+      after_seq = int(resume_from)
+    except (TypeError, ValueError):
+      return 0
+    # История потеряна или не помещается в очередь клиента без вытеснения —
+    # клиент догружает пропущенное через /api/events?after= или пересинхронизируется
+    free = self.send_queue_size - len(client.queue)
+    if not self.events.is_available(after_seq) or self.events.last_seq - after_seq > free:
+      client.push(json.dumps({
+        "type": "resync_required",
+        "data": {
+          "oldest_seq": self.events.oldest_seq,
+          "last_seq": self.events.last_seq,
+          "resume_from": after_seq,
+          "events_url": f"/api/events?after={after_seq}",
+        },
+      }))
+      self.stats['resyncs'] += 1
+      return 0
+    events = self.events.after(after_seq, limit=max(free, 0))
+    for data in events:
+      client.push(json.dumps(data, default=serialize_datetime))
+    self.stats['replayed'] += len(events)
+    return len(events)
 
   def disconnect(self, websocket: WebSocket):
     if websocket in self.active_connections:
       self.active_connections.remove(websocket)
+    client = self._clients.pop(websocket, None)
+    if client is not None:
+      self._unindex(client)
+      self.stats['disconnections'] += 1
+    if client is not None and not client.closed:
+      client.closed = True
+      client.queue.clear()
+      client._notify()
 
   async def broadcast(self, data: dict, permission: str = 'all'):
-    # Отправляем всем активным клиентам без подписки
-    for connection in self.active_connections:
-      try:
-        json_data = json.dumps(data, default=serialize_datetime)
-        await asyncio.create_task(connection.send_text(json_data))
-      except WebSocketDisconnect:
-        logger.info(f"WebSocket disconnecting from {connection.client.host}")
-        self.disconnect(connection)
-      except Exception as e:
-        logger.error(f"Error sending to client: {e}")
+    """
+    Рассылка всем активным клиентам: сообщение сериализуется один раз
+    и ставится в очередь каждого клиента, отправка идет параллельно.
+    Из других потоков/loop-ов рассылка передается в loop сервера.
+    """
+    event_dispatcher.publish(data, permission)
+
+  def broadcast_nowait(self, data: dict, permission: str = 'all'):
+    """Синхронная рассылка; вызывается в loop сервера"""
+    seq = 0
+    if isinstance(data, dict):
+      # Копия: история не должна меняться вместе с объектом вызывающего
+      seq = self.events.last_seq + 1
+      data = {**data, 'seq': seq}
+      self.events.append(data)
+    clients = self._recipients(data)
+    if not clients:
+      return
+
+    # Обновления портов клиентам в пакетном режиме копятся до конца тика
+    if isinstance(data, dict) and data.get('type') == 'port' and isinstance(data.get('data'), dict):
+      port = data['data']
+      key = (port.get('device_id'), port.get('code'))
+      batched = [client for client in clients if client.batch_tick_ms]
+      for client in batched:
+        client.push_port(key, port, seq)
+      if batched:
+        clients = [client for client in clients if not client.batch_tick_ms]
+        if not clients:
+          return
+
+      compact = [client for client in clients if client.encoding == 'compact']
+      if compact:
+        ref = self._port_ref(port)
+        started = time.perf_counter()
+        compact_text = _compact_dumps(["p", seq, ref] + self._compact_value(port))
+        self._count_encode(started, compact_text)
+        for client in compact:
+          self._ensure_definition(client, ref)
+          if client.push(compact_text):
+            self.stats['messages_queued'] += 1
+        clients = [client for client in clients if client.encoding != 'compact']
+        if not clients:
+          return
+
+    started = time.perf_counter()
+    try:
+      json_data = json.dumps(data, default=serialize_datetime)
+    except Exception as e:
+      logger.error(f"Error encoding broadcast message: {e}")
+      return
+    self._count_encode(started, json_data)
+    self.stats['broadcasts'] += 1
+    for client in clients:
+      if client.push(json_data):
+        self.stats['messages_queued'] += 1
+
+  def _count_encode(self, started: float, text: str):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    self.stats['encodes'] += 1
+    self.stats['encode_ms'] += elapsed_ms
+    self.stats['max_encode_ms'] = max(self.stats['max_encode_ms'], elapsed_ms)
+    self.stats['bytes_encoded'] += len(text)
+
+  def send_to(self, websocket: WebSocket, data: dict) -> bool:
+    """Сообщение одному клиенту (через его очередь, как и рассылка)"""
+    client = self._clients.get(websocket)
+    if client is None:
+      return False
+    return client.push(json.dumps(data, default=serialize_datetime))
+
+  def handle_batch_mode(self, websocket: WebSocket, message: dict) -> Optional[dict]:
+    """
+    Включение пакетной отправки портов: {"type": "batch", "enabled": true, "tick_ms": 100}.
+    tick_ms ограничивается min_batch_tick_ms..max_batch_tick_ms, в ответе — итоговое значение.
+    """
+    client = self._clients.get(websocket)
+    if client is None:
+      return None
+    client.set_batch(bool(message.get('enabled', True)), message.get('tick_ms'))
+    return {"type": "batch", "data": {"enabled": bool(client.batch_tick_ms), "tick_ms": client.batch_tick_ms}}
+
+  def handle_encoding(self, websocket: WebSocket, message: dict) -> Optional[dict]:
+    """
+    Согласование кодирования портов: {"type": "encoding", "mode": "compact" | "json"}.
+    В ответе — итоговый режим и схема позиционных кадров.
+    """
+    client = self._clients.get(websocket)
+    if client is None:
+      return None
+    client.encoding = 'compact' if message.get('mode') == 'compact' else 'json'
+    client.known_port_refs = set()
+    data = {"mode": client.encoding}
+    if client.encoding == 'compact':
+      data["schema"] = COMPACT_SCHEMA
+    return {"type": "encoding", "data": data}
+
+  def compact_port_entry(self, client: ClientConnection, port: dict) -> list:
+    """Элемент пакета ["ref", "value", "value_raw", "ts"] (определение порта досылается)"""
+    ref = self._port_ref(port)
+    self._ensure_definition(client, ref)
+    return [ref] + self._compact_value(port)
+
+  def _port_ref(self, port: dict) -> int:
+    """Постоянная ссылка на порт; при изменении метаданных определение заменяется"""
+    key = (port.get('device_id'), port.get('code'))
+    meta = (port.get('pin_id'), port.get('direction'), port.get('kind'))
+    known = self._port_refs.get(key)
+    if known is not None and known[1] == meta:
+      return known[0]
+    if known is None:
+      self._port_ref_seq += 1
+      ref = self._port_ref_seq
+    else:
+      # Та же ссылка, новое определение — клиенты получат его перед следующим значением
+      ref = known[0]
+      self._forget_ref(ref)
+    self._port_refs[key] = (ref, meta)
+    self._port_definitions[ref] = _compact_dumps(["d", ref, key[0], key[1], *meta])
+    return ref
+
+  def forget_ports_threadsafe(self, keys):
+    """forget_ports из любого потока: выполняется в loop сервера, которому принадлежат клиенты"""
+    loop = self._loop
+    try:
+      running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+      running_loop = None
+    if loop is None or running_loop is loop:
+      self.forget_ports(keys)
+    elif not loop.is_closed():
+      loop.call_soon_threadsafe(self.forget_ports, list(keys))
+
+  def forget_ports(self, keys):
+    """Удаляет ссылки удаленных портов (device_id, code); только в loop сервера"""
+    for key in keys:
+      known = self._port_refs.pop(key, None)
+      if known is not None:
+        self._forget_ref(known[0])
+        self._port_definitions.pop(known[0], None)
+
+  def _forget_ref(self, ref: int):
+    for client in list(self._clients.values()):
+      client.known_port_refs.discard(ref)
+
+  def _ensure_definition(self, client: ClientConnection, ref: int):
+    if ref not in client.known_port_refs:
+      client.known_port_refs.add(ref)
+      client.push(self._port_definitions[ref])
+
+  @staticmethod
+  def _compact_value(port: dict) -> list:
+    value = port.get('value')
+    value_raw = port.get('value_raw')
+    # value_raw передается, только если отличается от строкового вида value
+    if value_raw is not None and str(value_raw) == str(value):
+      value_raw = None
+    ts = port.get('ts')
+    return [value, value_raw, round(ts, 3) if isinstance(ts, float) else ts]
+
+  # === подписки ===
+  def handle_subscription(self, websocket: WebSocket, message: dict) -> Optional[dict]:
+    """
+    Сообщение от клиента:
+      {"type": "subscribe", "device_ids": [1, 2], "types": ["port", "log"], "levels": ["error"], "replace": false}
+      {"type": "unsubscribe", "device_ids": [2]}
+    subscribe добавляет значения к фильтрам (replace: true — заменяет фильтры целиком,
+    пустой subscribe с replace — снова получать всё), unsubscribe — убирает.
+    Возвращает текущую подписку для подтверждения клиенту.
+    """
+    client = self._clients.get(websocket)
+    if client is None:
+      return None
+
+    subscribe = message.get('type') == 'subscribe'
+    if subscribe and message.get('replace'):
+      client.device_ids = client.types = client.levels = None
+
+    for field, cast in (('device_ids', int), ('types', str), ('levels', str)):
+      values = message.get(field)
+      if values is None:
+        continue
+      if not isinstance(values, list):
+        values = [values]
+      values = {cast(value) for value in values}
+      current = getattr(client, field)
+      if subscribe:
+        setattr(client, field, values if current is None else current | values)
+      elif current is not None:
+        setattr(client, field, current - values)
+
+    self._unindex(client)
+    if client.device_ids is None:
+      self._all_devices.add(client)
+    else:
+      for device_id in client.device_ids:
+        self._device_index.setdefault(device_id, set()).add(client)
+    return {"type": "subscription", "data": client.subscription}
+
+  def _unindex(self, client: ClientConnection):
+    self._all_devices.discard(client)
+    for device_id in list(self._device_index):
+      clients = self._device_index[device_id]
+      clients.discard(client)
+      if not clients:
+        del self._device_index[device_id]
+
+  def _recipients(self, data) -> List[ClientConnection]:
+    """Клиенты, подписанные на сообщение (по device_id через индекс, затем тип и уровень)"""
+    if not isinstance(data, dict):
+      return list(self._clients.values())
+    message_type = data.get('type')
+    level = data.get('level')
+    device_id = _message_device_id(data)
+
+    if device_id is None:
+      # Сообщение не относится к устройству — фильтр устройств не применяется
+      candidates = list(self._clients.values())
+    else:
+      candidates = list(self._all_devices) + list(self._device_index.get(device_id, ()))
+    recipients = [client for client in candidates if client.accepts(message_type, level)]
+    self.stats['filtered'] += len(self._clients) - len(recipients)
+    return recipients
+
+  def get_stats(self) -> dict:
+    clients = list(self._clients.values())
+    encodes = self.stats['encodes']
+    return {
+      **self.stats,
+      'encode_ms': round(self.stats['encode_ms'], 2),
+      'max_encode_ms': round(self.stats['max_encode_ms'], 3),
+      'avg_encode_ms': round(self.stats['encode_ms'] / encodes, 3) if encodes else None,
+      'latency_ms': _percentiles([latency for client in clients for latency in client.latencies]),
+      'logs_history': len(self.logs_history),
+      'last_seq': self.events.last_seq,
+      'oldest_seq': self.events.oldest_seq,
+      'clients': len(clients),
+      'queued': sum(len(client.queue) for client in clients),
+      'send_queue_size': self.send_queue_size,
+      'slow_consumer_policy': self.slow_consumer_policy,
+    }
 
   def broadcast_log(self,
                     text: str = None,
@@ -146,7 +722,50 @@ class ConnectionManager:
     else:
         logger.info(log_message)
     
-    self.logs_queue.append((data, permission))
+    self.logs_history.append((data, permission))
+    event_dispatcher.publish(data, permission)
 
 
 connection_manager = ConnectionManager()
+
+
+def add_ws_stats_routes(app: APIRouter):
+  """Статистика WebSocket-рассылки по клиентам"""
+
+  @app.get("/api/ws/stats", tags=["live"])
+  async def get_ws_stats():
+    """
+    Итоги рассылки (включая время сериализации) и по каждому подключению:
+    отправлено сообщений/байт, глубина очереди, задержка доставки (p50/p95/p99), потери.
+    Клиенты отсортированы по глубине очереди — медленные первыми.
+    """
+    clients = [client.get_stats() for client in list(connection_manager._clients.values())]
+    clients.sort(key=lambda item: (item['queued'], item['dropped']), reverse=True)
+    return {
+      "totals": connection_manager.get_stats(),
+      "clients": clients,
+    }
+
+
+def add_events_routes(app: APIRouter):
+  """Постраничное чтение журнала событий рассылки"""
+
+  @app.get("/api/events", tags=["live"])
+  async def get_events(after: int = 0, limit: int = 100, device_id: Optional[int] = None):
+    """
+    События с seq > after (для пересинхронизации UI без полной перезагрузки).
+    truncated — часть событий после after уже вытеснена из буфера.
+    """
+    limit = min(max(limit, 1), 1000)
+    events = connection_manager.events
+    items = events.after(after, limit=limit, device_id=device_id)
+    # Меньше limit — буфер просмотрен до конца
+    has_more = len(items) >= limit and items[-1]['seq'] < events.last_seq
+    return {
+      "events": items,
+      "last_seq": events.last_seq,
+      "oldest_seq": events.oldest_seq,
+      "truncated": not events.is_available(after),
+      "has_more": has_more,
+      "next_after": items[-1]['seq'] if has_more else max(after, events.last_seq),
+    }
@@ -21,6 +21,42 @@ def _split_type(type_str: Optional[str]) -> (Optional[str], Optional[str]):
     a, b = type_str.split(".", 1)
     return a or None, b or None
 
+# kind порта из /values → тип значения
+_FLOAT_KINDS = {"analog", "sensor", "temperature", "humidity", "pressure"}
+_INT_KINDS = {"digital", "switch", "button", "relay", "pwm", "dimmer"}
+_TRUE_STRINGS = {"on", "true", "yes"}
+_FALSE_STRINGS = {"off", "false", "no"}
+
+
+def decode_value(kind: Optional[str], val: Any) -> Any:
+    """
+    Приводит значение порта к типу по его kind (один раз, при получении):
+    analog → float, digital → int (0/1 и т.п.; дробное остается float),
+    text и неизвестные → str как есть.
+    Если значение не разбирается — возвращается исходное.
+    """
+    if val is None or not isinstance(val, str) or not kind:
+        return val
+    text = val.strip()
+    try:
+        if kind in _FLOAT_KINDS:
+            return float(text)
+        if kind in _INT_KINDS:
+            lowered = text.lower()
+            if lowered in _TRUE_STRINGS:
+                return 1
+            if lowered in _FALSE_STRINGS:
+                return 0
+            if "." not in text:
+                return int(text)
+            # Дробные значения (pwm 12.5) не обрезаются, "1.0" → 1
+            number = float(text)
+            return int(number) if number.is_integer() else number
+    except ValueError:
+        return val
+    return val
+
+
 def flatten_ports(values: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Превращает /values в расширенный список портов.
@@ -61,7 +97,7 @@ def flatten_ports(values: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
             "direction": direction,       # "in" / "out"
             "kind": kind,                 # "analog" / "text" / "digital" ...
             "type_raw": type_raw,
-            "val": item.get("val"),
+            "val": decode_value(kind, item.get("val")),
             "unit": item.get("unit"),
             "mqtt": item.get("mqtt"),
             "href": href,
@@ -3,17 +3,23 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, Response
 from datetime import datetime
+import asyncio
 import json
 
-from utils.socket_utils import connection_manager
+from utils.socket_utils import connection_manager, add_events_routes, add_ws_stats_routes
 from os import path
 from utils.db_utils import init_db
 from utils.configs import config
 from utils.ha_manager import ha_manager
+from utils.home_assistant import ha_websocket
+from utils.port_values_writer import port_values_writer
+from utils.device_liveness import device_liveness
 from utils.logger import api_logger as logger, add_logger_routes
 from models.my_home import MyHomeClass
 from models.my_home import add_routes as my_home_routes
 from models.device import add_myhome_device_routes
+from models.device_supervisor import device_supervisor, add_device_supervisor_routes
+from utils.device_http import device_http
 from models.ha_routes import add_ha_routes
 from models.logs_backup_routes import add_logs_backup_routes
 from models.ports_settings_routes import add_ports_settings_routes
@@ -81,6 +87,9 @@ def init(add_routes=True):
   if add_routes:
     my_home_routes(app, my_home)
     add_myhome_device_routes(app, resolver=my_home.get_client)
+    add_device_supervisor_routes(app)
+    add_events_routes(app)
+    add_ws_stats_routes(app)
     add_ha_routes(app)
     add_logs_backup_routes(app)
     add_ports_settings_routes(app)
@@ -122,6 +131,72 @@ async def handle_device_command(message):
     logger.error(f"Error handling device command: {e}")
 
 
+# Задачи пакетов команд (ссылки держим, чтобы задачи не собрал GC)
+_command_tasks = set()
+
+
+def handle_device_commands(websocket: WebSocket, message: dict):
+  """
+  Пакет команд (в т.ч. разным устройствам):
+    {"type": "device_commands", "commands": [{"id": "c1", "device_id": 1, "code": "pwm1", "value": 10}, ...]}
+  Команды выполняются параллельно в фоне, на каждую клиенту отправляется
+  {"type": "command_ack", "data": {id, device_id, code, success, echoed, sent_ms, latency_ms, error}}
+  по мере готовности; latency_ms — от отправки до эха порта от устройства.
+  """
+  commands = message.get('commands')
+  if not isinstance(commands, list):
+    logger.warning("Invalid device_commands message: commands must be a list")
+    return
+  params = config['device_commands'] or {}
+  max_batch = int(params.get('max_batch', 100))
+  timeout = float(params.get('ack_timeout', 3.0))
+
+  for command in commands[max_batch:]:
+    connection_manager.send_to(websocket, _command_ack(command, {"success": False, "error": "batch too large"}))
+  task = asyncio.create_task(_run_device_commands(websocket, commands[:max_batch], timeout))
+  _command_tasks.add(task)
+  task.add_done_callback(_command_tasks.discard)
+
+
+async def _run_device_commands(websocket: WebSocket, commands: list, timeout: float):
+  await asyncio.gather(*(_run_device_command(websocket, command, timeout) for command in commands))
+
+
+async def _run_device_command(websocket: WebSocket, command, timeout: float):
+  if not isinstance(command, dict):
+    return
+  device_id = command.get('device_id')
+  code = command.get('code')
+  value = command.get('value')
+  if not all([device_id, code, value is not None]):
+    result = {"success": False, "error": "missing required fields"}
+  else:
+    client = my_home.get_client(device_id)
+    if not client:
+      result = {"success": False, "error": "device not found"}
+    else:
+      try:
+        result = await client.send_command_ack(code, value, timeout=timeout)
+      except Exception as e:
+        logger.error(f"Error sending command to device {device_id}: {e}")
+        result = {"success": False, "error": str(e)}
+  connection_manager.send_to(websocket, _command_ack(command, result))
+
+
+def _command_ack(command, result: dict) -> dict:
+  command = command if isinstance(command, dict) else {}
+  return {
+    "type": "command_ack",
+    "data": {
+      "id": command.get('id'),
+      "device_id": command.get('device_id'),
+      "code": command.get('code'),
+      "value": command.get('value'),
+      **result,
+    },
+  }
+
+
 async def send_command_to_device_ws(client, code: str, value) -> bool:
   """
   Отправляет команду на устройство через WebSocket в формате ESP
@@ -160,30 +235,60 @@ async def restart():
   return {"status": "restarting", "message": "Server will restart"}
 
 
-# Websocket endpoint
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, access_token=Cookie(None)):
-  # if access_token is None:
-  #   await websocket.close()
+# Ответы на служебные сообщения клиента (подписки, пакетный режим, кодирование)
+_WS_CONTROL_HANDLERS = {
+  'subscribe': connection_manager.handle_subscription,
+  'unsubscribe': connection_manager.handle_subscription,
+  'batch': connection_manager.handle_batch_mode,
+  'encoding': connection_manager.handle_encoding,
+}
+
+
+async def handle_ws_message(websocket: WebSocket, data: str, device_commands: bool = True):
+  """Обработка одного сообщения от фронтенда (общая для /ws и /{token}/ws)"""
+  try:
+    message = json.loads(data)
+  except json.JSONDecodeError:
+    # Если это не JSON, игнорируем
+    return
+  if not isinstance(message, dict):
+    return
+
+  message_type = message.get('type')
+  if device_commands and message_type == 'device_command':
+    await handle_device_command(message)
+  elif device_commands and message_type == 'device_commands':
+    handle_device_commands(websocket, message)
+  elif message_type in _WS_CONTROL_HANDLERS:
+    reply = _WS_CONTROL_HANDLERS[message_type](websocket, message)
+    if reply:
+      connection_manager.send_to(websocket, reply)
+
+
+async def _serve_ws(websocket: WebSocket, device_commands: bool = True):
+  """Цикл чтения сообщений клиента; при любом завершении клиент отключается"""
   await connection_manager.connect(websocket)
   try:
     while True:
       data = await websocket.receive_text()
-
-      # Обрабатываем команды от фронтенда
       try:
-        message = json.loads(data)
-        if message.get('type') == 'device_command':
-          await handle_device_command(message)
-      except json.JSONDecodeError:
-        # Если это не JSON, игнорируем
-        pass
+        await handle_ws_message(websocket, data, device_commands)
       except Exception as e:
         logger.error(f"Error handling WebSocket message: {e}")
-
   except WebSocketDisconnect:
     connection_manager.disconnect(websocket)
     await connection_manager.broadcast("A client just disconnected.")
+  except Exception as e:
+    logger.error(f"WebSocket error: {e}")
+    connection_manager.disconnect(websocket)
+
+
+# Websocket endpoint
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, access_token=Cookie(None)):
+  # if access_token is None:
+  #   await websocket.close()
+  await _serve_ws(websocket)
 
 
 # WebSocket endpoint для ingress (будет обрабатываться middleware)
@@ -192,14 +297,8 @@ async def websocket_ingress_endpoint(websocket: WebSocket, token: str, access_to
   logger.info(f"Ingress WebSocket connection with token: {token}")
   # if access_token is None:
   #   await websocket.close()
-  await connection_manager.connect(websocket)
-  try:
-    while True:
-      data = await websocket.receive_text()
-      # Убираем входящие сообщения от устройств - не пересылаем их
-  except WebSocketDisconnect:
-    connection_manager.disconnect(websocket)
-    await connection_manager.broadcast("A client just disconnected.")
+  # Команды устройствам через ingress не принимаются, только служебные сообщения
+  await _serve_ws(websocket, device_commands=False)
 
 
 def join_dist():
@@ -331,6 +430,11 @@ async def startup_event():
     live_routes = [route for route in routes if '/api/live' in route]
     logger.info(f"Live routes registered: {live_routes}")
 
+    # Колбэки клиентов устройств выполняем в loop приложения
+    device_supervisor.set_main_loop(asyncio.get_running_loop())
+    # Рассылки в браузеры тоже выполняются в loop приложения
+    connection_manager.set_loop(asyncio.get_running_loop())
+
     # Инициализируем HA Manager
     ha_manager.set_my_home(my_home)
     await ha_manager.initialize()
@@ -350,6 +454,34 @@ async def shutdown_event():
   except Exception as e:
     logger.error(f"Error shutting down HA Manager: {e}")
 
+  # Глобальный клиент HA (маршруты /api/ha) держит свою HTTP-сессию
+  try:
+    await ha_websocket.close_http_session()
+  except Exception as e:
+    logger.error(f"Error closing HA HTTP session: {e}")
+
+  # Останавливаем клиентов устройств
+  try:
+    device_supervisor.shutdown()
+  except Exception as e:
+    logger.error(f"Error stopping device supervisor: {e}")
+
+  try:
+    await device_http.close()
+  except Exception as e:
+    logger.error(f"Error closing device HTTP pool: {e}")
+
+  # Сбрасываем в БД накопленные значения портов
+  try:
+    port_values_writer.stop()
+  except Exception as e:
+    logger.error(f"Error flushing port values: {e}")
+
+  try:
+    device_liveness.stop()
+  except Exception as e:
+    logger.error(f"Error saving device liveness checkpoint: {e}")
+
 
 join_dist()
 